@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Genome-wide hs-blastn search of every fungal genome against every plant genome.
+
+1. Missing hs-blastn indexes are built up front, several plants at a time.
+2. (plant, fungus) pairs are packed onto a fixed core budget, largest plant
+   genome first (and largest fungal genomes first inside each plant). Several
+   fungal genomes can be sent to one 'hs-blastn align' call (--batch_size) so a
+   plant index is loaded once per batch instead of once per fungus.
+3. Every finished pair is appended to <outdir>/completed_pairs.tsv; rerunning
+   the same command resumes exactly where an interrupted run stopped. With
+   --delta the pairs are recorded with the content hashes of both genomes, so
+   after adding or replacing genomes only the pairs involving them are run.
+
+By default each pair gives one raw tabular '<plant>_VS_<fungus>.blast' file.
+With --filter, hs-blastn's '-f 6' output is piped straight into the filters of
+2-filter_blast_results.py, so raw hits never touch the disk. Only passing hits
+are kept (one shard per pair) and the shards are merged into the same table
+that script 2 writes.
+"""
+import os
+import sys
+import argparse
+import threading
+import subprocess
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from cpu_budget import run_with_core_budget
+from content_cache import FileHashes
+from scaffold_index import ensure_index
+from table_io import TableWriter, is_parquet, require_parquet
+from blast_filter import COLUMN_DTYPES, DEFAULT_CHUNK_ROWS, IDENTITY_THRESHOLD, ALIGNMENT_LENGTH_THRESHOLD, \
+    SCAFFOLD_LENGTH_THRESHOLD, filter_blast_stream, filter_chunk, read_blast_chunks
+
+# ─── ARGUMENT PARSING ───────────────────────────────────────────────────────────
+parser = argparse.ArgumentParser(description="All-vs-all hs-blastn search of fungal genomes against plant genomes.")
+parser.add_argument("plant_genomes", help="Directory containing Plant genome .fasta files")
+parser.add_argument("fungi_genomes", help="Directory containing Fungi genome .fasta files")
+parser.add_argument("-o", "--outdir", default="blastresults", help="Directory for .blast files (or filtered shards)")
+parser.add_argument("-c", "--cores", type=int, default=os.cpu_count(), help="Total number of cores shared by all running alignments")
+parser.add_argument("-p", "--threads", type=int, default=20, help="hs-blastn threads per alignment")
+parser.add_argument("--index_jobs", type=int, default=4, help="Number of hs-blastn indexes built in parallel")
+parser.add_argument("--batch_size", type=int, default=1, help="Fungal genomes sent to one hs-blastn align call")
+parser.add_argument("--filter", action="store_true", help="Filter hs-blastn output on the fly (raw hits are never written)")
+parser.add_argument("--fungi_fai", help="Directory containing Fungi .fasta.fai index files (required with --filter)")
+parser.add_argument("--plant_fai", help="Directory containing Plant .fasta.fai index files")
+parser.add_argument("--scaffold_index", default="scaffold_index", help="Scaffold-length index directory")
+parser.add_argument("--shard_format", default="tsv.gz", choices=["tsv", "tsv.gz", "parquet"], help="Format of the per-pair filtered shards")
+parser.add_argument("--output", default="filtered_blast_results_with_fungi.tsv", help="Merged filtered table (with --filter; Parquet if it ends in .parquet)")
+parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows filtered at once from the hs-blastn stream")
+parser.add_argument("--min_identity", type=float, default=IDENTITY_THRESHOLD, help="Minimum percent identity (with --filter)")
+parser.add_argument("--min_length", type=int, default=ALIGNMENT_LENGTH_THRESHOLD, help="Minimum alignment length in bp (with --filter)")
+parser.add_argument("--min_scaffold", type=int, default=SCAFFOLD_LENGTH_THRESHOLD, help="Minimum fungal scaffold length in bp (with --filter)")
+parser.add_argument("--delta", action="store_true", help="Identify genomes by content hash: only pairs with a new or changed genome are run")
+
+args = parser.parse_args()
+
+PLANT_DIR = args.plant_genomes
+FUNGI_DIR = args.fungi_genomes
+OUTDIR = args.outdir
+THREADS = min(args.threads, args.cores)
+SHARD_FORMAT = args.shard_format
+MODE = "filter" if args.filter else "raw"
+
+MANIFEST_FILE = os.path.join(OUTDIR, "completed_pairs.tsv")
+GENOME_HASHES_FILE = os.path.join(OUTDIR, ".genome_hashes.json")
+QUERY_DIR = os.path.join(OUTDIR, ".batch_queries")
+
+if args.filter and not args.fungi_fai:
+    sys.exit("[ERROR] --filter needs --fungi_fai to check scaffold lengths.")
+
+if SHARD_FORMAT == "parquet":
+    require_parquet("--shard_format parquet")
+if args.filter and is_parquet(args.output):
+    require_parquet("A Parquet --output")
+
+SHARD_DTYPES = dict(COLUMN_DTYPES, fungi_genome=str)
+
+# Same options and defaults as 2-filter_blast_results.py
+THRESHOLDS = {"min_identity": args.min_identity, "min_length": args.min_length, "min_scaffold": args.min_scaffold}
+
+# In batched runs every query header is prefixed with '<index in batch>|' so
+# the output can be split back per fungal genome.
+BATCH_TAG_SEP = "|"
+
+# ─── FUNCTIONS ──────────────────────────────────────────────────────────────────
+def list_genomes(directory):
+    """.fasta files of a directory, largest first."""
+    paths = [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith(".fasta")]
+    return sorted(paths, key=os.path.getsize, reverse=True)
+
+def pair_name(plant_path, fungi_path):
+    return f"{os.path.basename(plant_path)}_VS_{os.path.basename(fungi_path)}"
+
+def raw_path(plant_path, fungi_path):
+    return os.path.join(OUTDIR, pair_name(plant_path, fungi_path) + ".blast")
+
+def shard_path(plant_path, fungi_path):
+    return os.path.join(OUTDIR, f"{pair_name(plant_path, fungi_path)}.filtered.{SHARD_FORMAT}")
+
+def load_manifest():
+    """
+    Pairs already completed in the current mode: {pair: (plant hash, fungi hash)},
+    or None as hashes for pairs recorded without --delta. The last record of a pair wins.
+    """
+    done = {}
+    if os.path.exists(MANIFEST_FILE):
+        with open(MANIFEST_FILE) as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) in (2, 4) and parts[1] == MODE:
+                    done[parts[0]] = tuple(parts[2:]) or None
+    return done
+
+# Content hashes of the genomes (filled in main() with --delta)
+GENOME_HASHES = {}
+
+manifest_lock = threading.Lock()
+
+def record_completed(pairs):
+    """Appends finished pairs to the manifest (flushed immediately, so a crash loses nothing)."""
+    with manifest_lock:
+        with open(MANIFEST_FILE, "a") as f:
+            for plant_path, fungi_path in pairs:
+                line = f"{pair_name(plant_path, fungi_path)}\t{MODE}"
+                if GENOME_HASHES:
+                    line += f"\t{GENOME_HASHES[plant_path]}\t{GENOME_HASHES[fungi_path]}"
+                f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def current_pairs(manifest, pairs):
+    """
+    --delta: the completed pairs whose two genomes still have the recorded
+    content. Pairs recorded without hashes are adopted as they are and recorded
+    with the current hashes.
+    """
+    completed = set()
+    adopted = []
+    for plant_path, fungi_path in pairs:
+        name = pair_name(plant_path, fungi_path)
+        if name not in manifest:
+            continue
+        hashes = manifest[name]
+        if hashes is None:
+            adopted.append((plant_path, fungi_path))
+        elif hashes != (GENOME_HASHES[plant_path], GENOME_HASHES[fungi_path]):
+            continue
+        completed.add(name)
+    if adopted:
+        record_completed(adopted)
+        print(f"[INFO] {len(adopted)} pairs completed without --delta adopted with their current genome hashes")
+    return completed
+
+def build_plant_index(plant_path):
+    """
+    Builds the hs-blastn index of a plant genome if it does not exist yet. With
+    --delta the genome hash the index was built from is kept in '<genome>.sys.hash'
+    and a changed genome is re-indexed (an index without that file is adopted).
+    Returns an error message if the build failed, None otherwise.
+    """
+    index_file = plant_path + ".sys"
+    hash_file = index_file + ".hash"
+    stale = False
+    if GENOME_HASHES and os.path.exists(index_file) and os.path.exists(hash_file):
+        with open(hash_file) as f:
+            stale = f.read().strip() != GENOME_HASHES[plant_path]
+    if stale or not os.path.exists(index_file):
+        print(f"Building hs-blastn index for {os.path.basename(plant_path)}...")
+        try:
+            result = subprocess.run(["hs-blastn", "index", "-i", plant_path, "-d", plant_path])
+        except OSError as e:
+            return str(e)
+        if result.returncode != 0:
+            # A partial index must not be taken as built by the next run
+            if os.path.exists(index_file):
+                os.remove(index_file)
+            return f"hs-blastn index exited with code {result.returncode}"
+    if GENOME_HASHES and (stale or not os.path.exists(hash_file)):
+        with open(hash_file, "w") as f:
+            f.write(GENOME_HASHES[plant_path] + "\n")
+    return None
+
+def align_command(plant_path, query_path, threads, output_path=None):
+    cmd = ["hs-blastn", "align", "-d", plant_path, "-q", query_path, "-p", str(threads), "-f", "6"]
+    if output_path:
+        cmd += ["-o", output_path]
+    return cmd
+
+def write_batch_query(plant_path, fungi_paths, batch_id):
+    """Concatenates several fungal genomes into one query, tagging headers with their batch index."""
+    os.makedirs(QUERY_DIR, exist_ok=True)
+    query_path = os.path.join(QUERY_DIR, f"{os.path.basename(plant_path)}.batch{batch_id}.fasta")
+    with open(query_path, "wb") as out:
+        for tag, fungi_path in enumerate(fungi_paths):
+            prefix = f">{tag}{BATCH_TAG_SEP}".encode()
+            with open(fungi_path, "rb") as f:
+                for line in f:
+                    out.write(prefix + line[1:] if line.startswith(b">") else line)
+    return query_path
+
+def write_shard(hits, path):
+    """Writes a pair's kept hits atomically (an empty shard marks a pair with no hits)."""
+    if hits is None:
+        hits = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in SHARD_DTYPES.items()})
+    tmp_path = path + ".tmp"
+    if SHARD_FORMAT == "parquet":
+        hits.to_parquet(tmp_path, index=False)
+    else:
+        hits.to_csv(tmp_path, sep="\t", index=False, compression="gzip" if SHARD_FORMAT == "tsv.gz" else None)
+    os.replace(tmp_path, path)
+
+def read_shard(path):
+    if SHARD_FORMAT == "parquet":
+        return pd.read_parquet(path)
+    return pd.read_csv(path, sep="\t", dtype=SHARD_DTYPES)
+
+def run_align(command):
+    """Starts hs-blastn with its tabular output on a pipe."""
+    return subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+
+def check_align(process):
+    """Waits for a normally finished hs-blastn and raises if it failed."""
+    if process.wait() != 0:
+        raise RuntimeError(f"hs-blastn exited with code {process.returncode}")
+
+def close_align(process):
+    """Releases the pipe and reaps the process (after an error it has been killed)."""
+    process.stdout.close()
+    process.wait()
+
+def align_single(plant_path, fungi_path, threads, scaffold_index):
+    """One fungal genome against one plant index. Returns (rows_seen, hits_kept)."""
+    if not args.filter:
+        # Raw mode: hs-blastn writes the unfiltered tabular output itself
+        tmp_path = raw_path(plant_path, fungi_path) + ".tmp"
+        result = subprocess.run(align_command(plant_path, fungi_path, threads, tmp_path))
+        if result.returncode != 0:
+            raise RuntimeError(f"hs-blastn exited with code {result.returncode}")
+        os.replace(tmp_path, raw_path(plant_path, fungi_path))
+        return 0, 0
+
+    # Fused mode: stream stdout through the script 2 filters
+    process = run_align(align_command(plant_path, fungi_path, threads))
+    try:
+        hits, rows_read = filter_blast_stream(process.stdout, os.path.basename(fungi_path), scaffold_index,
+                                              args.chunksize, **THRESHOLDS)
+        check_align(process)
+    except Exception:
+        process.kill()
+        raise
+    finally:
+        close_align(process)
+    write_shard(hits, shard_path(plant_path, fungi_path))
+    return rows_read, 0 if hits is None else len(hits)
+
+def align_batch(plant_path, fungi_paths, batch_id, threads, scaffold_index):
+    """Several fungal genomes in one align call; output is split back per pair."""
+    query_path = write_batch_query(plant_path, fungi_paths, batch_id)
+    process = run_align(align_command(plant_path, query_path, threads))
+    rows_read = 0
+    kept = 0
+    tmp_paths = []
+    try:
+        if not args.filter:
+            tmp_paths = [raw_path(plant_path, f) + ".tmp" for f in fungi_paths]
+            handles = [open(path, "w") for path in tmp_paths]
+            try:
+                for line in process.stdout:
+                    tag, line = line.split(BATCH_TAG_SEP, 1)
+                    handles[int(tag)].write(line)
+            finally:
+                for handle in handles:
+                    handle.close()
+        else:
+            kept_parts = [[] for _ in fungi_paths]
+            for chunk in read_blast_chunks(process.stdout, args.chunksize):
+                rows_read += len(chunk)
+                if chunk.empty:
+                    continue
+                tags = chunk["qseqid"].str.split(BATCH_TAG_SEP, n=1, expand=True)
+                chunk = chunk.assign(qseqid=tags[1])
+                for tag, group in chunk.groupby(tags[0].astype(int), sort=False):
+                    group = filter_chunk(group, scaffold_index, os.path.basename(fungi_paths[tag]), **THRESHOLDS)
+                    if not group.empty:
+                        kept_parts[tag].append(group)
+        check_align(process)
+    except Exception:
+        process.kill()
+        for path in tmp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        close_align(process)
+        os.remove(query_path)
+
+    for tag, fungi_path in enumerate(fungi_paths):
+        if not args.filter:
+            os.replace(tmp_paths[tag], raw_path(plant_path, fungi_path))
+            continue
+        parts = kept_parts[tag]
+        hits = None
+        if parts:
+            hits = pd.concat(parts, ignore_index=True).assign(fungi_genome=os.path.basename(fungi_path))
+            kept += len(hits)
+        write_shard(hits, shard_path(plant_path, fungi_path))
+    return rows_read, kept
+
+def make_jobs(plant_genomes, fungi_genomes, completed):
+    """
+    Returns ((plant, [fungi...], batch_id), threads) jobs for the pairs that are
+    not completed yet, largest plant genome first, largest fungi first inside a plant.
+    """
+    jobs = []
+    for plant_path in plant_genomes:
+        todo = [f for f in fungi_genomes if pair_name(plant_path, f) not in completed]
+        for batch_id, start in enumerate(range(0, len(todo), args.batch_size)):
+            jobs.append(((plant_path, todo[start:start + args.batch_size], batch_id), THREADS))
+    return jobs
+
+def merge_shards(pairs, output_file):
+    """
+    Concatenates the filtered shards into the script 2 output table, pair by
+    pair in the given order (sorted by pair name). Script 2 follows the
+    os.listdir() order of the BLAST directory instead, so the two tables hold
+    the same rows but their row order can differ.
+    """
+    writer = TableWriter(output_file)
+    total_kept = 0
+    for plant_path, fungi_path in pairs:
+        path = shard_path(plant_path, fungi_path)
+        if not os.path.exists(path):
+            continue
+        hits = read_shard(path)
+        if hits.empty:
+            continue
+        writer.write(hits)
+        total_kept += len(hits)
+
+    if not writer.close():
+        print("[WARNING] No hits passed the filters. Output file not created.")
+        return
+    print(f"[SUCCESS] Filtered results saved to {output_file}")
+    print(f"[INFO] Total hits kept: {total_kept}")
+
+# ─── MAIN EXECUTION ─────────────────────────────────────────────────────────────
+def main():
+    os.makedirs(OUTDIR, exist_ok=True)
+
+    plant_genomes = list_genomes(PLANT_DIR)
+    fungi_genomes = list_genomes(FUNGI_DIR)
+    completed = load_manifest()
+    pairs = [(p, f) for p in plant_genomes for f in fungi_genomes]
+    if args.delta:
+        print("[INFO] Hashing genomes (only new or modified files are read)...")
+        hashes = FileHashes(GENOME_HASHES_FILE)
+        GENOME_HASHES.update((path, hashes.digest(path)) for path in plant_genomes + fungi_genomes)
+        hashes.save()
+        completed = current_pairs(completed, pairs)
+    remaining = sum(1 for p, f in pairs if pair_name(p, f) not in completed)
+    print(f"[INFO] {len(plant_genomes)} plant x {len(fungi_genomes)} fungal genomes = {len(pairs)} pairs "
+          f"({len(pairs) - remaining} already completed)")
+
+    scaffold_index = None
+    if args.filter:
+        scaffold_index = ensure_index(args.scaffold_index, {"fungi": args.fungi_fai, "plant": args.plant_fai})
+
+    # 1. Build missing plant indexes ahead of time
+    print(f"[INFO] Checking hs-blastn indexes ({args.index_jobs} parallel builds)...")
+    unindexed = []
+    with ThreadPoolExecutor(max_workers=args.index_jobs) as executor:
+        for plant_path, error in zip(plant_genomes, executor.map(build_plant_index, plant_genomes)):
+            if error is not None:
+                unindexed.append(plant_path)
+                print(f"[ERROR] {os.path.basename(plant_path)}: {error}; its pairs are skipped", file=sys.stderr)
+
+    # 2. Align, packing jobs onto the core budget
+    jobs = make_jobs([p for p in plant_genomes if p not in unindexed], fungi_genomes, completed)
+    print(f"[INFO] {len(jobs)} align jobs on {args.cores} cores ({THREADS} threads each, {args.batch_size} fungi per job)")
+
+    def run_job(job, threads):
+        plant_path, fungi_paths, batch_id = job
+        if len(fungi_paths) == 1:
+            return align_single(plant_path, fungi_paths[0], threads, scaffold_index)
+        return align_batch(plant_path, fungi_paths, batch_id, threads, scaffold_index)
+
+    total_rows = 0
+    total_kept = 0
+    failed = 0
+    done_pairs = len(pairs) - remaining
+    for (plant_path, fungi_paths, _), result, error in run_with_core_budget(jobs, args.cores, run_job):
+        names = ", ".join(os.path.basename(f) for f in fungi_paths)
+        if error is not None:
+            failed += len(fungi_paths)
+            print(f"[ERROR] {os.path.basename(plant_path)} vs {names}: {error}", file=sys.stderr)
+            continue
+        record_completed([(plant_path, f) for f in fungi_paths])
+        done_pairs += len(fungi_paths)
+        total_rows += result[0]
+        total_kept += result[1]
+        print(f"[{done_pairs}/{len(pairs)}] {os.path.basename(plant_path)} vs {names}")
+
+    # Pairs of plants without an index are retried like failed pairs
+    failed += sum(1 for p in unindexed for f in fungi_genomes if pair_name(p, f) not in completed)
+    if failed:
+        print(f"[WARNING] {failed} pairs failed; rerun the same command to retry them.", file=sys.stderr)
+
+    if args.filter:
+        print(f"[INFO] {total_rows} raw hits streamed, {total_kept} kept")
+        merge_shards(sorted(pairs, key=lambda pair: pair_name(*pair)), args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Screens the trees of 9-build_phylogenies.py for fungal candidates nested
+inside plant clades.
+
+Every leaf is classified as plant / fungi / other through a taxonomy table
+('<sequence id>\t<group>'); leaves missing from the table are 'unknown'. The
+(unrooted) IQ-TREE trees are oriented from the leaf farthest from the
+_CANDIDATE leaf, and the clades containing the candidate are visited from the
+smallest outwards. The smallest one holding at least --min_clade other
+classified leaves is scored by its plant fraction and its bootstrap support.
+
+    python 10-screen_trees.py -d ./phylogenies --taxonomy homolog_taxonomy.tsv -j 8
+"""
+import os
+import re
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+parser = argparse.ArgumentParser(description="Rank candidate trees by fungal-in-plant nesting.")
+parser.add_argument("-d", "--tree_dir", default="phylogenies", help="Directory with the .treefile outputs of Script 9")
+parser.add_argument("--taxonomy", required=True, help="TSV '<sequence id>\\t<group>' (group: plant/Viridiplantae, fungi/Fungi, anything else = other)")
+parser.add_argument("-o", "--output", default="tree_screening.tsv", help="Ranked screening table")
+parser.add_argument("-j", "--jobs", type=int, default=4, help="Trees parsed in parallel (worker processes)")
+parser.add_argument("--min_clade", type=int, default=2, help="Classified leaves (besides the candidate) needed in the scored clade")
+parser.add_argument("--min_plant_fraction", type=float, default=0.8, help="Plant fraction of the scored clade needed to call a candidate nested")
+parser.add_argument("--min_support", type=float, default=95, help="Bootstrap support of the scored clade needed for a supported call")
+
+args = parser.parse_args()
+
+CANDIDATE_SUFFIX = "_CANDIDATE"
+TREE_SUFFIX = ".treefile"
+PLANT_GROUPS = {"plant", "plants", "viridiplantae", "streptophyta", "embryophyta"}
+FUNGI_GROUPS = {"fungi", "fungus", "fungal"}
+GROUPS = ["plant", "fungi", "other", "unknown"]
+GROUP_INDEX = {g: i for i, g in enumerate(GROUPS)}
+# Tree programs replace characters that are special in Newick; IDs are matched in both forms
+ILLEGAL_CHARS = re.compile(r"[^A-Za-z0-9_.\-]")
+# Quoted label, structural character, branch length or bare label
+NEWICK_TOKEN = re.compile(r"'[^']*'|[(),;]|:[^,();]*|[^:,();'\s][^:,();']*")
+
+# Filled in each worker process by load_taxonomy()
+TAXONOMY = None
+
+# ─── TAXONOMY ───────────────────────────────────────────────────────────────────
+def load_taxonomy(path):
+    global TAXONOMY
+    table = pd.read_csv(path, sep="\t", header=None, usecols=[0, 1], names=["id", "group"], dtype=str, comment="#")
+    groups = table["group"].fillna("").str.strip().str.lower()
+    groups = groups.where(~groups.isin(PLANT_GROUPS), "plant")
+    groups = groups.where(~groups.isin(FUNGI_GROUPS), "fungi")
+    groups = groups.where(groups.isin(["plant", "fungi"]), "other")
+    TAXONOMY = dict(zip(table["id"].str.replace(ILLEGAL_CHARS, "_", regex=True), groups))
+    TAXONOMY.update(zip(table["id"], groups))
+
+def classify(name):
+    group = TAXONOMY.get(name)
+    if group is None:
+        group = TAXONOMY.get(ILLEGAL_CHARS.sub("_", name), "unknown")
+    return group
+
+# ─── NEWICK ─────────────────────────────────────────────────────────────────────
+def parse_newick(text):
+    """
+    Parses one Newick tree. Returns (parents, names) lists indexed by node
+    (node 0 is the root); leaves carry their name, internal nodes their label
+    (the support value IQ-TREE writes there).
+    """
+    parents, names = [-1], [""]
+    current = 0
+    for token in NEWICK_TOKEN.findall(text):
+        c = token[0]
+        if c == "(" or c == ",":
+            parents.append(current if c == "(" else parents[current])
+            names.append("")
+            current = len(parents) - 1
+        elif c == ")":
+            current = parents[current]
+        elif c == "'":
+            names[current] = token[1:-1]
+        elif c != ":" and c != ";":
+            # Branch lengths are not used
+            names[current] = token.strip()
+    return parents, names
+
+def support_value(label):
+    """Numeric support of an internal label ('95', 'SH-aLRT/UFBoot' -> UFBoot), NaN if absent."""
+    if not label:
+        return float("nan")
+    try:
+        return float(label.split("/")[-1])
+    except ValueError:
+        return float("nan")
+
+# ─── SCREENING ──────────────────────────────────────────────────────────────────
+def screen_tree(path):
+    """Returns the screening row of one tree file."""
+    row = {"candidate": os.path.basename(path)[:-len(TREE_SUFFIX)], "tree_file": path}
+    with open(path) as f:
+        parents, names = parse_newick(f.read())
+
+    n = len(parents)
+    children = [[] for _ in range(n)]
+    for node, parent in enumerate(parents):
+        if parent >= 0:
+            children[parent].append(node)
+    leaves = [node for node in range(n) if not children[node]]
+    candidates = [node for node in leaves if names[node].endswith(CANDIDATE_SUFFIX)]
+    if not candidates:
+        return dict(row, verdict="no_candidate")
+    candidate = candidates[0]
+    row["candidate"] = names[candidate][:-len(CANDIDATE_SUFFIX)]
+
+    group = {node: classify(names[node]) for node in leaves if node != candidate}
+    row["leaves"] = len(leaves)
+    for g in GROUPS:
+        row[g + "_leaves"] = sum(1 for v in group.values() if v == g)
+
+    # Undirected adjacency, walked breadth-first from the candidate
+    neighbours = [list(children[node]) for node in range(n)]
+    for node, parent in enumerate(parents):
+        if parent >= 0:
+            neighbours[node].append(parent)
+    towards = {candidate: -1}
+    distance = {candidate: 0}
+    order = [candidate]
+    for node in order:
+        for other in neighbours[node]:
+            if other not in towards:
+                towards[other] = node
+                distance[other] = distance[node] + 1
+                order.append(other)
+
+    # Group counts of everything beyond each node, seen from the candidate
+    beyond = {node: [0] * len(GROUPS) for node in order}
+    for node in reversed(order[1:]):
+        if node in group:
+            beyond[node][GROUP_INDEX[group[node]]] += 1
+        counts = beyond[towards[node]]
+        for i, count in enumerate(beyond[node]):
+            counts[i] += count
+    total = beyond[candidate]
+
+    # The leaf farthest from the candidate roots the tree. The clade of a node on
+    # the path between them is everything except what lies beyond its root-side neighbour.
+    root = max(leaves, key=lambda node: (distance.get(node, -1), -node))
+    path = [root]
+    while path[-1] != candidate:
+        path.append(towards[path[-1]])
+    path.reverse()
+
+    def clade_support(node, root_side):
+        # A support label belongs to the edge above its node in the original tree
+        return support_value(names[node] if parents[node] == root_side else names[root_side])
+
+    # Walk from the candidate towards the root: clades of increasing size
+    scored = None
+    pure_size, pure_support = 0, float("nan")
+    for node, root_side in zip(path[1:-1], path[2:]):
+        c = dict(zip(GROUPS, (t - b for t, b in zip(total, beyond[root_side]))))
+        classified = c["plant"] + c["fungi"] + c["other"]
+        if c["fungi"] == 0 and c["other"] == 0 and c["plant"] > 0:
+            pure_size, pure_support = c["plant"], clade_support(node, root_side)
+        if scored is None and classified >= args.min_clade:
+            scored = c, clade_support(node, root_side)
+        if scored is not None and (c["fungi"] or c["other"]):
+            break
+
+    row["pure_plant_clade"] = pure_size
+    row["pure_plant_support"] = pure_support
+    if scored is None:
+        return dict(row, verdict="unclassified")
+
+    c, row["support"] = scored
+    row["clade_size"] = sum(c.values()) + 1
+    for g in GROUPS:
+        row["clade_" + g] = c[g]
+    classified = c["plant"] + c["fungi"] + c["other"]
+    row["plant_fraction"] = c["plant"] / classified
+    support = 0 if pd.isna(row["support"]) else row["support"]
+    row["score"] = row["plant_fraction"] * support / 100
+    if row["plant_fraction"] < args.min_plant_fraction:
+        row["verdict"] = "not_nested"
+    elif support >= args.min_support:
+        row["verdict"] = "nested"
+    else:
+        row["verdict"] = "nested_low_support"
+    return row
+
+def screen_safe(path):
+    try:
+        return screen_tree(path)
+    except Exception as e:
+        return {"candidate": os.path.basename(path)[:-len(TREE_SUFFIX)], "tree_file": path, "verdict": f"error: {e}"}
+
+# ─── MAIN EXECUTION ─────────────────────────────────────────────────────────────
+VERDICT_RANK = {"nested": 0, "nested_low_support": 1, "not_nested": 2, "unclassified": 3, "no_candidate": 4}
+COLUMNS = ["candidate", "verdict", "score", "plant_fraction", "support", "clade_size"] + \
+          ["clade_" + g for g in GROUPS] + ["pure_plant_clade", "pure_plant_support", "leaves"] + \
+          [g + "_leaves" for g in GROUPS] + ["tree_file"]
+
+def main():
+    if not os.path.isdir(args.tree_dir):
+        sys.exit(f"[ERROR] Tree directory not found: {args.tree_dir}")
+    tree_files = sorted(os.path.join(args.tree_dir, f) for f in os.listdir(args.tree_dir) if f.endswith(TREE_SUFFIX))
+    print(f"[INFO] Screening {len(tree_files)} trees with {args.jobs} worker(s)...")
+
+    load_taxonomy(args.taxonomy)
+    print(f"[INFO] Taxonomy: {len(TAXONOMY)} sequence IDs")
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=load_taxonomy, initargs=(args.taxonomy,)) as executor:
+            rows = list(executor.map(screen_safe, tree_files, chunksize=64))
+    else:
+        rows = [screen_safe(path) for path in tree_files]
+
+    table = pd.DataFrame(rows, columns=COLUMNS)
+    counts = ["clade_size", "pure_plant_clade", "leaves"] + ["clade_" + g for g in GROUPS] + [g + "_leaves" for g in GROUPS]
+    table[counts] = table[counts].astype("Int64")
+    table["_rank"] = table["verdict"].map(VERDICT_RANK).fillna(len(VERDICT_RANK))
+    table = table.sort_values(["_rank", "score", "pure_plant_clade", "candidate"],
+                              ascending=[True, False, False, True], kind="stable").drop(columns="_rank")
+    tmp_output = args.output + ".tmp"
+    table.to_csv(tmp_output, sep="\t", index=False)
+    os.replace(tmp_output, args.output)
+
+    summary = table["verdict"].value_counts()
+    print(f"[SUCCESS] Screening saved to {args.output}")
+    for verdict, count in summary.items():
+        print(f"         {verdict}: {count}")
+
+if __name__ == "__main__":
+    main()
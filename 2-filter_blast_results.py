@@ -5,136 +5,258 @@
 """
 import os
 import sys
+import time
+import pickle
 import argparse
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scaffold_index import ScaffoldIndex, ensure_index
+from content_cache import ContentCache, cache_key
+from hit_store import HitStoreWriter
+from table_io import TableWriter
+import instrument
+from blast_filter import (
+    IDENTITY_THRESHOLD, ALIGNMENT_LENGTH_THRESHOLD, SCAFFOLD_LENGTH_THRESHOLD, filter_blast_stream, merge_hsps
+)
 
 # ─── ARGUMENT PARSING ───────────────────────────────────────────────────────────
 parser = argparse.ArgumentParser(description="Filter BLAST results for HT candidates.")
 parser.add_argument("--blast_dir", required=True, help="Directory containing .blast output files")
 parser.add_argument("--fungi_fai", required=True, help="Directory containing Fungi .fasta.fai index files")
 parser.add_argument("--plant_fai", required=True, help="Directory containing Plant .fasta.fai index files")
-parser.add_argument("--output", default="filtered_blast_results_with_fungi.tsv", help="Output TSV filename")
+parser.add_argument("--output", default="filtered_blast_results_with_fungi.tsv", help="Output table (TSV, or Parquet if it ends in .parquet)")
+parser.add_argument("--scaffold_index", default="scaffold_index", help="Scaffold-length index directory (built or refreshed from the .fai files)")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of BLAST files filtered in parallel (worker processes)")
+parser.add_argument("--chunksize", type=int, default=500000, help="Rows read at once from a single BLAST file")
+parser.add_argument("--min_identity", type=float, default=IDENTITY_THRESHOLD, help="Minimum percent identity")
+parser.add_argument("--min_length", type=int, default=ALIGNMENT_LENGTH_THRESHOLD, help="Minimum alignment length (bp)")
+parser.add_argument("--min_scaffold", type=int, default=SCAFFOLD_LENGTH_THRESHOLD, help="Minimum fungal scaffold length (bp)")
+parser.add_argument("--hit_store", help="Also keep every hit above the --store_* floors in this directory, for hit_store.py sweep/export")
+parser.add_argument("--store_identity", type=float, default=70, help="Identity floor of the hit store")
+parser.add_argument("--store_length", type=int, default=100, help="Alignment length floor of the hit store")
+parser.add_argument("--store_scaffold", type=int, default=0, help="Fungal scaffold length floor of the hit store")
+parser.add_argument("--merge_loci", action="store_true", help="Collapse overlapping HSPs of the same scaffold pair into one locus (best bitscore + hsp_count)")
+parser.add_argument("--merge_gap", type=int, default=0, help="With --merge_loci, also merge HSPs at most this many bp apart")
+parser.add_argument("--pair_cache", help="Keep each BLAST file's filtered hits in this directory; unchanged files are not re-read on later runs")
+parser.add_argument("--delta_output", help="With --pair_cache, also write the hits of the files filtered by this run (input of 5-CompareBlastResults.py --update)")
+instrument.add_arguments(parser)
 
 args = parser.parse_args()
 
 BLAST_DIR = args.blast_dir
 FUNGI_FAI_DIR = args.fungi_fai
 PLANT_FAI_DIR = args.plant_fai
+SCAFFOLD_INDEX_DIR = args.scaffold_index
 OUTPUT_FILE = args.output
+MAX_WORKERS = args.jobs
+CHUNK_ROWS = args.chunksize
+MERGE_LOCI = args.merge_loci
+THRESHOLDS = {"min_identity": args.min_identity, "min_length": args.min_length, "min_scaffold": args.min_scaffold}
+HIT_STORE_DIR = args.hit_store
+STORE_FLOORS = {
+    "min_identity": min(args.store_identity, args.min_identity),
+    "min_length": min(args.store_length, args.min_length),
+    "min_scaffold": min(args.store_scaffold, args.min_scaffold),
+}
+MERGE_GAP = args.merge_gap
+PAIR_CACHE_DIR = args.pair_cache
+
+if PAIR_CACHE_DIR and HIT_STORE_DIR:
+    sys.exit("[ERROR] --pair_cache cannot be combined with --hit_store (the store needs every file re-read).")
+if args.delta_output and not PAIR_CACHE_DIR:
+    sys.exit("[ERROR] --delta_output requires --pair_cache.")
 
 # ─── CONFIGURATION ──────────────────────────────────────────────────────────────
-# Thresholds defined in the thesis context
-IDENTITY_THRESHOLD = 80
-ALIGNMENT_LENGTH_THRESHOLD = 500
-SCAFFOLD_LENGTH_THRESHOLD = 20000  # 20 kb (filters out short/fragmented scaffolds)
+# Thresholds, BLAST columns and dtypes live in blast_filter.py (shared with the
+# fused align-and-filter mode of 1-BlastWholeGenomes.py).
+PROGRESS_EVERY = 1000  # files
 
-COLUMNS = [
-    "qseqid", "sseqid", "pident", "length", "mismatch", "gapopen",
-    "qstart", "qend", "sstart", "send", "evalue", "bitscore"
-]
+# Refreshed in main() before the worker pool starts. Each process opens the
+# memory-mapped arrays once instead of re-reading a .fai for every BLAST file.
+SCAFFOLD_INDEX = None
+PAIR_CACHE = None
+PAIR_CACHE_FILE = "hits.pkl"
 
 # ─── HELPER FUNCTIONS ───────────────────────────────────────────────────────────
-def load_fai(fai_path):
-    """Parses a .fai file and returns a dictionary of {seq_id: length}."""
-    lengths = {}
-    if os.path.exists(fai_path):
-        try:
-            with open(fai_path, 'r') as f:
-                for line in f:
-                    parts = line.strip().split("\t")
-                    if len(parts) >= 2:
-                        lengths[parts[0]] = int(parts[1])
-        except Exception as e:
-            print(f"[WARNING] Could not read FAI file {fai_path}: {e}", file=sys.stderr)
-    return lengths
+def parse_pair_name(filename):
+    """Returns (plant_name, fungi_name) from a '<plant>_VS_<fungus>.blast' filename."""
+    base = filename[:-6]  # remove .blast suffix
+    if "_VS_" in base:
+        plant_name, fungi_name = base.split("_VS_", 1)
+    else:
+        # Fallback logic
+        fungi_name = base
+        plant_name = ""
+    return plant_name, fungi_name
+
+def get_scaffold_index():
+    """Returns this process's handle on the scaffold index, opening it on first use."""
+    global SCAFFOLD_INDEX
+    if SCAFFOLD_INDEX is None:
+        SCAFFOLD_INDEX = ScaffoldIndex(SCAFFOLD_INDEX_DIR)
+    return SCAFFOLD_INDEX
+
+def get_pair_cache():
+    """Returns this process's handle on the --pair_cache directory."""
+    global PAIR_CACHE
+    if PAIR_CACHE is None:
+        PAIR_CACHE = ContentCache(PAIR_CACHE_DIR)
+    return PAIR_CACHE
+
+def pair_cache_key(file_path, fungi_name):
+    """
+    Cache key of one BLAST file's filtered hits: the file (path, size, mtime),
+    the .fai its fungal scaffold lengths come from (the one the scaffold index
+    resolves for fungi_name) and every filter setting.
+    """
+    st = os.stat(file_path)
+    fai = get_scaffold_index().resolve("fungi", fungi_name)
+    fai_signature = f"{fai['fai']}:{fai['size']}:{fai['mtime_ns']}" if fai else ""
+    settings = f"{THRESHOLDS}|{MERGE_LOCI}|{MERGE_GAP}|{CHUNK_ROWS}"
+    return cache_key("filtered_pair", os.path.abspath(file_path), str(st.st_size), str(st.st_mtime_ns), fai_signature, settings)
+
+def filter_blast_file(filename):
+    """
+    Filters a single BLAST file chunk by chunk.
+    Returns (kept_hits or None, store_hits or None, rows_read, bytes_read, error_message, cached).
+    store_hits (every hit above the store floors) is only produced with --hit_store.
+    With --pair_cache, hits of an unchanged file are returned from the cache (cached=True).
+    Runs inside worker processes, so it only touches module-level configuration.
+    """
+    file_path = os.path.join(BLAST_DIR, filename)
+    plant_name, fungi_name = parse_pair_name(filename)
+
+    try:
+        # Check if file is empty first to avoid pandas errors
+        file_size = os.path.getsize(file_path)
+        if file_size == 0:
+            return None, None, 0, 0, None, False
+
+        key = None
+        if PAIR_CACHE_DIR:
+            key = pair_cache_key(file_path, fungi_name)
+            data = get_pair_cache().read(key, PAIR_CACHE_FILE)
+            if data is not None:
+                return (pickle.loads(data) if data else None), None, 0, 0, None, True
+
+        store_hits = None
+        if HIT_STORE_DIR:
+            # One pass at the (lower) store floors; the output thresholds are a subset
+            store_hits, rows_read = filter_blast_stream(file_path, fungi_name, get_scaffold_index(), CHUNK_ROWS,
+                                                        keep_scaffold_length=True, **STORE_FLOORS)
+            hits = None
+            if store_hits is not None:
+                mask = (store_hits["pident"] >= THRESHOLDS["min_identity"]) & \
+                       (store_hits["length"] >= THRESHOLDS["min_length"]) & \
+                       (store_hits["scaffold_length"] >= THRESHOLDS["min_scaffold"])
+                if mask.any():
+                    hits = store_hits[mask].drop(columns="scaffold_length").reset_index(drop=True)
+        else:
+            hits, rows_read = filter_blast_stream(file_path, fungi_name, get_scaffold_index(), CHUNK_ROWS, **THRESHOLDS)
+        # One file is one genome pair, so loci never span files
+        if MERGE_LOCI and hits is not None:
+            hits = merge_hsps(hits, MERGE_GAP)
+        if key is not None:
+            get_pair_cache().put(key, {PAIR_CACHE_FILE: b"" if hits is None else pickle.dumps(hits, pickle.HIGHEST_PROTOCOL)})
+        return hits, store_hits, rows_read, file_size, None, False
+
+    except Exception as e:
+        return None, None, 0, 0, str(e), False
 
 # ─── MAIN EXECUTION ─────────────────────────────────────────────────────────────
 def main():
+    global SCAFFOLD_INDEX
+    instrument.start(args)
+
     if not os.path.isdir(BLAST_DIR):
         sys.exit(f"[ERROR] BLAST directory not found: {BLAST_DIR}")
 
+    with instrument.span("scaffold_index"):
+        SCAFFOLD_INDEX = ensure_index(SCAFFOLD_INDEX_DIR, {"fungi": FUNGI_FAI_DIR, "plant": PLANT_FAI_DIR})
+
     print(f"[INFO] Starting filtering process...")
-    print(f"[INFO] Thresholds: Identity>={IDENTITY_THRESHOLD}%, Len>={ALIGNMENT_LENGTH_THRESHOLD}bp, Scaffold>={SCAFFOLD_LENGTH_THRESHOLD}bp")
+    print(f"[INFO] Thresholds: Identity>={THRESHOLDS['min_identity']}%, Len>={THRESHOLDS['min_length']}bp, Scaffold>={THRESHOLDS['min_scaffold']}bp")
+    if MERGE_LOCI:
+        print(f"[INFO] Overlapping HSPs merged into loci (max gap {MERGE_GAP}bp)")
 
-    filtered_frames = []  # List to store valid dataframes (much faster than append)
-    file_count = 0
+    blast_files = [f for f in os.listdir(BLAST_DIR) if f.endswith(".blast")]
+    print(f"[INFO] {len(blast_files)} BLAST files to filter with {MAX_WORKERS} worker(s)")
 
-    for filename in os.listdir(BLAST_DIR):
-        if not filename.endswith(".blast"):
-            continue
-            
-        file_path = os.path.join(BLAST_DIR, filename)
-        base = filename[:-6]  # remove .blast suffix
+    # Kept hits are streamed to a temporary file in input order, so memory stays
+    # bounded by one file's hits and the output matches the serial run.
+    writer = TableWriter(OUTPUT_FILE)
+    delta_writer = TableWriter(args.delta_output) if args.delta_output else None
+    file_count = 0
+    total_rows = 0
+    total_bytes = 0
+    total_kept = 0
+    cached_files = 0
+    start_time = time.time()
 
-        # Parse filename to get genome names
-        if "_VS_" in base:
-            plant_name, fungi_name = base.split("_VS_", 1)
-        else:
-            # Fallback logic
-            fungi_name = base
-            plant_name = ""
-
-        # Paths to index files
-        fungi_fai_path = os.path.join(FUNGI_FAI_DIR, fungi_name + ".fasta.fai")
-        # Handle inconsistent extensions if necessary (.fai or .fasta.fai)
-        if not os.path.exists(fungi_fai_path):
-             fungi_fai_path = os.path.join(FUNGI_FAI_DIR, fungi_name + ".fai")
-
-        # Load scaffold lengths
-        fungi_lengths = load_fai(fungi_fai_path)
-        
-        # (Optional: Load plant lengths if you need to filter by plant scaffold size too)
-        # plant_fai_path = os.path.join(PLANT_FAI_DIR, plant_name + ".fai")
-        
-        if not fungi_lengths:
-            # If we can't verify scaffold length, we might skip or warn. 
-            # Here we warn but proceed (filtering will fail for missing IDs).
-            # print(f"[DEBUG] No FAI found for {fungi_name}", file=sys.stderr)
-            pass
+    store = None
+    if HIT_STORE_DIR:
+        floors = {"identity": STORE_FLOORS["min_identity"], "length": STORE_FLOORS["min_length"],
+                  "scaffold": STORE_FLOORS["min_scaffold"]}
+        store = HitStoreWriter(HIT_STORE_DIR, floors)
+        print(f"[INFO] Keeping all hits with Identity>={floors['identity']}%, Len>={floors['length']}bp, "
+              f"Scaffold>={floors['scaffold']}bp in {HIT_STORE_DIR}")
 
+    with instrument.span("filter") as filter_span:
+        executor = ProcessPoolExecutor(max_workers=MAX_WORKERS) if MAX_WORKERS > 1 else None
         try:
-            # Read BLAST result
-            # Check if file is empty first to avoid pandas errors
-            if os.path.getsize(file_path) == 0:
-                continue
-
-            blast_results = pd.read_csv(file_path, sep="\t", names=COLUMNS)
-            blast_results["fungi_genome"] = fungi_name
-            
-            # Apply Filters
-            # 1. Identity & Alignment Length
-            mask = (blast_results["pident"] >= IDENTITY_THRESHOLD) & \
-                   (blast_results["length"] >= ALIGNMENT_LENGTH_THRESHOLD)
-            
-            temp_filtered = blast_results[mask]
-
-            if temp_filtered.empty:
-                continue
-
-            # 2. Scaffold Length (Map qseqid to length dictionary)
-            # This ensures the fungal hit is on a substantial scaffold, not a tiny contig
-            temp_filtered = temp_filtered[
-                temp_filtered["qseqid"].map(lambda x: fungi_lengths.get(x, 0)) >= SCAFFOLD_LENGTH_THRESHOLD
-            ]
-
-            if not temp_filtered.empty:
-                filtered_frames.append(temp_filtered)
-        
-        except Exception as e:
-            print(f"[ERROR] Processing {filename}: {e}", file=sys.stderr)
-        
-        file_count += 1
-        if file_count % 1000 == 0:
-            print(f"[INFO] Processed {file_count} files...")
-
-    # Concatenate all results
-    if filtered_frames:
-        final_df = pd.concat(filtered_frames, ignore_index=True)
-        final_df.to_csv(OUTPUT_FILE, sep="\t", index=False)
+            if executor is not None:
+                results = executor.map(filter_blast_file, blast_files, chunksize=8)
+            else:
+                results = map(filter_blast_file, blast_files)
+
+            for filename, (hits, store_hits, rows_read, bytes_read, error, cached) in zip(blast_files, results):
+                if error:
+                    print(f"[ERROR] Processing {filename}: {error}", file=sys.stderr)
+                cached_files += cached
+
+                if store is not None:
+                    store.append(store_hits, filename)
+
+                if hits is not None:
+                    writer.write(hits)
+                    total_kept += len(hits)
+                    if delta_writer is not None and not cached:
+                        delta_writer.write(hits)
+
+                file_count += 1
+                total_rows += rows_read
+                total_bytes += bytes_read
+                filter_span.add(rows=rows_read, bytes=bytes_read)
+                if file_count % PROGRESS_EVERY == 0:
+                    elapsed = max(time.time() - start_time, 1e-9)
+                    print(f"[INFO] Processed {file_count}/{len(blast_files)} files "
+                          f"({file_count / elapsed:.1f} files/s, {total_rows / elapsed:,.0f} rows/s, "
+                          f"{total_bytes / elapsed / 1e6:.1f} MB/s), {total_kept} hits kept")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    if store is not None:
+        with instrument.span("hit_store", rows=store.rows):
+            store.close()
+        print(f"[INFO] Hit store: {store.rows} hits saved to {HIT_STORE_DIR}")
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f"[INFO] Filtered {file_count} files ({total_rows} rows) in {elapsed:.1f}s")
+    if PAIR_CACHE_DIR:
+        print(f"[INFO] {cached_files} unchanged files taken from {PAIR_CACHE_DIR}, {file_count - cached_files} filtered")
+
+    with instrument.span("write_output", rows=total_kept):
+        written = writer.close()
+    if written:
         print(f"[SUCCESS] Filtered results saved to {OUTPUT_FILE}")
-        print(f"[INFO] Total hits kept: {len(final_df)}")
+        print(f"[INFO] Total hits kept: {total_kept}")
     else:
         print("[WARNING] No hits passed the filters. Output file not created.")
+    if delta_writer is not None:
+        if delta_writer.close():
+            print(f"[INFO] Hits of the newly filtered files saved to {args.delta_output}")
+        else:
+            print("[INFO] No newly filtered hits; delta output not created.")
 
 if __name__ == "__main__":
     main()
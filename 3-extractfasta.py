@@ -1,45 +1,85 @@
 #!/usr/bin/env python3
 import os
+import sys
 import argparse
-from Bio import SeqIO
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from table_io import read_table
+from fasta_io import FastaIndex, FastaWriter, ensure_fai, fasta_basename, is_fasta_file, read_fai
+import instrument
 
 parser = argparse.ArgumentParser(description="Extract FASTA sequences for identified Plant hits.")
-parser.add_argument("-i", "--input_tsv", default="filtered_blast_results_with_fungi.tsv", help="Input filtered BLAST results")
-parser.add_argument("-p", "--plant_genomes", required=True, help="Directory containing Plant Genome FASTA files")
+parser.add_argument("-i", "--input_tsv", default="filtered_blast_results_with_fungi.tsv", help="Input filtered BLAST results (TSV or .parquet)")
+parser.add_argument("-p", "--plant_genomes", required=True, help="Directory containing Plant Genome FASTA files (plain or bgzip-compressed)")
 parser.add_argument("-o", "--outdir", default="selected_sequences", help="Output directory for extracted sequences")
+parser.add_argument("--fai_dir", help="Directory containing Plant .fai index files (default: next to each genome)")
+parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of genomes extracted in parallel")
+instrument.add_arguments(parser)
 
 args = parser.parse_args()
 
-if not os.path.exists(args.outdir):
-    os.makedirs(args.outdir)
-
-print(f"[INFO] Reading {args.input_tsv}...")
-try:
-    filtered_results = pd.read_csv(args.input_tsv, sep="\t")
-    selected_sseqids = set(filtered_results["sseqid"].astype(str))
-except Exception as e:
-    exit(f"[ERROR] Could not read input TSV: {e}")
-
-print(f"[INFO] Looking for {len(selected_sseqids)} unique sequences in {args.plant_genomes}...")
-
-found_count = 0
-for genome_file in os.listdir(args.plant_genomes):
-    if genome_file.lower().endswith((".fasta", ".fa", ".fna")):
-        fasta_path = os.path.join(args.plant_genomes, genome_file)
-        base_name = os.path.splitext(genome_file)[0]
-        output_fasta = os.path.join(args.outdir, f"selected_{base_name}.fasta")
-        hits_in_genome = []
-        for record in SeqIO.parse(fasta_path, "fasta"):
-            if record.id in selected_sseqids:
-                hits_in_genome.append(record)
-                selected_sseqids.remove(record.id)
-                found_count += 1
-        
-        if hits_in_genome:
-            with open(output_fasta, "w") as output_handle:
-                SeqIO.write(hits_in_genome, output_handle, "fasta")
-
-print(f"[SUCCESS] Extracted {found_count} sequences into '{args.outdir}/'.")
-if len(selected_sseqids) > 0:
-    print(f"[WARNING] {len(selected_sseqids)} sequences were not found in the provided genome directory.")
+# Where .fai files are written for genomes that have none
+FAI_CACHE_DIR = os.path.join(args.outdir, ".fai")
+
+def index_genome(fasta_path):
+    """The genome's .fai, built into FAI_CACHE_DIR if it has none."""
+    return ensure_fai(fasta_path, args.fai_dir, FAI_CACHE_DIR)
+
+def extract_genome(task):
+    """Seeks straight to the wanted scaffolds of one genome and writes them in genome order."""
+    fasta_path, fai_path, scaffold_ids, output_fasta = task
+    with FastaIndex(fasta_path, fai_path) as genome, FastaWriter(output_fasta) as writer:
+        for scaffold in scaffold_ids:
+            writer.write(genome.header(scaffold), genome.fetch(scaffold))
+    return len(scaffold_ids)
+
+def main():
+    instrument.start(args)
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+
+    print(f"[INFO] Reading {args.input_tsv}...")
+    try:
+        with instrument.span("read_input") as read_span:
+            filtered_results = read_table(args.input_tsv, columns=["sseqid"], dtype={"sseqid": str})
+            selected_sseqids = set(filtered_results["sseqid"])
+            read_span.add(rows=len(filtered_results))
+    except Exception as e:
+        sys.exit(f"[ERROR] Could not read input TSV: {e}")
+
+    print(f"[INFO] Looking for {len(selected_sseqids)} unique sequences in {args.plant_genomes}...")
+
+    genome_files = [f for f in os.listdir(args.plant_genomes) if is_fasta_file(f)]
+    fasta_paths = [os.path.join(args.plant_genomes, f) for f in genome_files]
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        # 1. Plan from the .fai files only (missing ones are built in parallel):
+        #    each sequence is taken from the first genome (in directory order)
+        #    that contains it.
+        with instrument.span("plan") as plan_span:
+            tasks = []
+            for genome_file, fasta_path, fai_path in zip(genome_files, fasta_paths, executor.map(index_genome, fasta_paths)):
+                base_name = fasta_basename(genome_file)
+                output_fasta = os.path.join(args.outdir, f"selected_{base_name}.fasta")
+
+                # Keep the genome's own order (dicts preserve .fai order)
+                scaffolds = read_fai(fai_path)
+                plan_span.add(rows=len(scaffolds))
+                hits_in_genome = [name for name in scaffolds if name in selected_sseqids]
+                if hits_in_genome:
+                    selected_sseqids.difference_update(hits_in_genome)
+                    tasks.append((fasta_path, fai_path, hits_in_genome, output_fasta))
+
+        # 2. Extract genomes in parallel
+        found_count = 0
+        with instrument.span("extract") as extract_span:
+            for (fasta_path, _, _, output_fasta), count in zip(tasks, executor.map(extract_genome, tasks)):
+                print(f"  -> {os.path.basename(fasta_path)}: {count} sequences")
+                found_count += count
+                extract_span.add(rows=count, bytes=os.path.getsize(output_fasta))
+
+    print(f"[SUCCESS] Extracted {found_count} sequences into '{args.outdir}/'.")
+    if len(selected_sseqids) > 0:
+        print(f"[WARNING] {len(selected_sseqids)} sequences were not found in the provided genome directory.")
+
+if __name__ == "__main__":
+    main()
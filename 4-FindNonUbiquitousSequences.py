@@ -6,31 +6,78 @@
 
 import os
 import sys
+import glob
+import json
+import fcntl
+import heapq
+import hashlib
 import argparse
-import subprocess
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from cpu_budget import run_with_core_budget
+from content_cache import FileHashes
+from table_io import TableWriter
+import instrument
 
 # ─── ARGUMENT PARSING ───────────────────────────────────────────────────────────
 parser = argparse.ArgumentParser(description="Check distribution of candidates across plant genomes.")
-parser.add_argument("-s", "--selected_fasta", required=True, help="Directory containing extracted FASTA sequences (from Script 3)")
+parser.add_argument("-s", "--selected_fasta", help="Directory containing extracted FASTA sequences (from Script 3)")
 parser.add_argument("-p", "--plant_genomes", required=True, help="Directory containing all plant genome FASTAs")
-parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of parallel genomes to process at once")
-parser.add_argument("-t", "--threads", type=int, default=8, help="BLAST threads per job")
+parser.add_argument("-j", "--jobs", type=int, default=4, help="Most BLAST jobs running at once within the core budget (also parallel makeblastdb builds)")
+parser.add_argument("-t", "--threads", type=int, default=8, help="BLAST threads for a median-sized genome (scaled with each DB's size)")
+parser.add_argument("-c", "--cores", type=int, help="Total core budget shared by all BLAST jobs (default: jobs x threads)")
+parser.add_argument("--query_shards", type=int, default=1, help="Split the master query into this many residue-balanced shards (query shard x genome tasks)")
+parser.add_argument("--no_dedup", action="store_true", help="BLAST every candidate even if its sequence is identical to another one")
+parser.add_argument("--dedup_revcomp", action="store_true", help="Also collapse candidates that are reverse complements of each other")
+parser.add_argument("--clades", help="Optional TSV '<plant genome file>\\t<clade>' used to weight the distribution scores by clade")
+parser.add_argument("-o", "--output", default="plant_alignment_results.tsv", help="Combined plant hits, the input of 5-CompareBlastResults.py (TSV, or Parquet if it ends in .parquet)")
+parser.add_argument("--no_long_table", action="store_true", help="Do not write the combined plant hits (-o): only the distribution scores and the per-genome hits")
+parser.add_argument("--max_fraction", type=float, help="Drop candidates hitting more than this fraction of plant genomes (clade-weighted with --clades)")
+parser.add_argument("--incremental", action="store_true", help="Keep each genome's hits by candidate sequence: only new candidate sequences and new or changed genomes are BLASTed")
+parser.add_argument("--delta_output", help="With --incremental, also write the plant hits added by this run (input of 5-CompareBlastResults.py --update)")
+parser.add_argument("--keep_query", action="store_true", help="Keep the consolidated all_candidates_query.fasta instead of deleting it")
+parser.add_argument("--databases_only", action="store_true", help="Only build the missing BLAST databases of --plant_genomes, then exit (-s not needed)")
+instrument.add_arguments(parser)
 
 args = parser.parse_args()
+if not args.selected_fasta and not args.databases_only:
+    parser.error("-s/--selected_fasta is required (unless --databases_only)")
 
 SELECTED_SEQUENCES_DIR = args.selected_fasta
 PLANT_GENOMES_DIR = args.plant_genomes
 MAX_PARALLEL_JOBS = args.jobs
 THREADS_PER_JOB = args.threads
+TOTAL_CORES = args.cores or MAX_PARALLEL_JOBS * THREADS_PER_JOB
+QUERY_SHARDS = max(1, args.query_shards)
+DEDUP = not args.no_dedup
+
+if args.incremental and not DEDUP:
+    sys.exit("[ERROR] --incremental needs the sequence hashes of the deduplication; drop --no_dedup.")
+if args.delta_output and not args.incremental:
+    sys.exit("[ERROR] --delta_output requires --incremental.")
 
 # Outputs
 PLANT_BLAST_RESULTS_DIR = "plant_blast_outputs"
-PLANT_COMBINED_RESULTS = "plant_alignment_results.tsv"
+PLANT_COMBINED_RESULTS = None if args.no_long_table else args.output
+SHARD_DIR = os.path.join(PLANT_BLAST_RESULTS_DIR, ".shards")
+PRESENCE_MATRIX_FILE = os.path.join(PLANT_BLAST_RESULTS_DIR, "candidate_presence.npz")
+DISTRIBUTION_FILE = os.path.join(PLANT_BLAST_RESULTS_DIR, "candidate_distribution.tsv")
+DEDUP_MAP_FILE = os.path.join(PLANT_BLAST_RESULTS_DIR, "candidate_dedup_map.tsv")
+# Where earlier versions wrote the dedup map (read by --incremental to adopt their results)
+LEGACY_DEDUP_MAP_FILE = "candidate_dedup_map.tsv"
+# Summary tables sharing PLANT_BLAST_RESULTS_DIR with the per-genome .tsv files
+SUMMARY_FILES = {os.path.basename(DISTRIBUTION_FILE), os.path.basename(DEDUP_MAP_FILE)}
+# --incremental: per-genome hits keyed by sequence hash, and what was searched
+INCREMENTAL_DIR = os.path.join(PLANT_BLAST_RESULTS_DIR, ".incremental")
+GENOME_HASHES_FILE = os.path.join(INCREMENTAL_DIR, "genome_hashes.json")
 
 # BLAST Parameters
 OUTFMT = "6 qseqid sseqid pident length evalue bitscore"
+BLAST_COLUMNS = ["qseqid", "sseqid", "pident", "length", "evalue", "bitscore"]
+# Fixed dtypes so every per-genome file is written with the same number formatting
+BLAST_DTYPES = {"qseqid": str, "sseqid": str, "pident": "float64", "length": "int64", "evalue": "float64", "bitscore": "float64"}
 EVALUE_THRESHOLD = 1e-20
 
 # ─── SETUP ──────────────────────────────────────────────────────────────────────
@@ -38,133 +85,724 @@ if not os.path.exists(PLANT_BLAST_RESULTS_DIR):
     os.makedirs(PLANT_BLAST_RESULTS_DIR)
 
 # ─── FUNCTIONS ──────────────────────────────────────────────────────────────────
-def check_blast_db(fasta_path):
-    """Checks if BLAST DB exists for a fasta, creates it if not."""
-    # Check for .nsq or .nal or .nin
-    if not (os.path.exists(fasta_path + ".nsq") or os.path.exists(fasta_path + ".nin")):
-        # Ensure we don't have a race condition if multiple jobs try to make the same DB
-        # Ideally, DBs are pre-built by Script 1. We assume they exist or try to build.
+def blast_db_exists(fasta_path):
+    # Single-volume (.nsq/.nin) or multi-volume (.nal) nucleotide DB
+    return any(os.path.exists(fasta_path + ext) for ext in (".nsq", ".nin", ".nal"))
+
+@contextmanager
+def db_lock(fasta_path, exclusive):
+    """
+    Holds the lock on '<fasta>.makeblastdb.lock': exclusive while makeblastdb
+    writes the volumes, shared while they are checked or searched.
+    """
+    with open(fasta_path + ".makeblastdb.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def check_blast_db(fasta_path, rebuild=False):
+    """
+    Checks if BLAST DB exists for a fasta, creates it if not (with rebuild, it is
+    built again over the existing volumes: makeblastdb overwrites them).
+    The volumes are only looked at under db_lock, so a build in progress (another
+    job, or another run of this script) is waited for instead of being taken as a
+    finished DB or started a second time.
+    """
+    if not rebuild:
+        with db_lock(fasta_path, exclusive=False):
+            if blast_db_exists(fasta_path):
+                return None
+    with db_lock(fasta_path, exclusive=True):
+        if blast_db_exists(fasta_path) and not rebuild:
+            return None
         cmd = ["makeblastdb", "-in", fasta_path, "-dbtype", "nucl", "-out", fasta_path]
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        result = instrument.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            return f"makeblastdb failed for {fasta_path}: {result.stderr.strip()}"
+        return None
+
+def blast_db_size(fasta_path):
+    """Size of the DB's sequence volumes (falls back to the FASTA size)."""
+    volumes = glob.glob(glob.escape(fasta_path) + "*.nsq")
+    return sum(os.path.getsize(v) for v in volumes) if volumes else os.path.getsize(fasta_path)
+
+def threads_for_size(size, median_size):
+    """Scales THREADS_PER_JOB with the DB size relative to the median genome, within the core budget."""
+    if median_size <= 0:
+        return THREADS_PER_JOB
+    return int(min(TOTAL_CORES, max(1, round(THREADS_PER_JOB * size / median_size))))
 
-def run_blast_job(plant_fasta_path, query_fasta_path, output_path):
+def run_blast_job(plant_fasta_path, query_fasta_path, output_path, threads):
     """Runs blastn for a specific plant genome against the query sequences."""
     try:
-        # ensure db exists
-        check_blast_db(plant_fasta_path)
-        
+        # Written under a temporary name so an interrupted job is never taken as done
+        tmp_output = output_path + ".tmp"
         cmd = [
             "blastn",
             "-db", plant_fasta_path,
             "-query", query_fasta_path,
             "-outfmt", OUTFMT,
             "-evalue", str(EVALUE_THRESHOLD),
-            "-num_threads", str(THREADS_PER_JOB),
-            "-out", output_path
+            "-num_threads", str(threads),
+            "-out", tmp_output
         ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
+
+        # Shared lock: a rebuild by another run waits until this search is done
+        with db_lock(plant_fasta_path, exclusive=False):
+            if not blast_db_exists(plant_fasta_path):
+                return f"No BLAST database for {plant_fasta_path}"
+            result = instrument.run(cmd, capture_output=True, text=True)
         if result.returncode != 0:
             return f"Error blasting {plant_fasta_path}: {result.stderr}"
+        os.replace(tmp_output, output_path)
         return None  # Success
     except Exception as e:
         return str(e)
 
+class PresenceMatrix:
+    """
+    Candidate x plant-genome hit matrix stored as a bitset (one bit per genome),
+    filled one genome at a time as BLAST results come in.
+    """
+
+    def __init__(self, candidates, genomes):
+        self.candidates = list(candidates)
+        self.genomes = list(genomes)
+        self.row_of = pd.Index(self.candidates)
+        self.bits = np.zeros((len(self.candidates), (len(self.genomes) + 7) // 8), dtype=np.uint8)
+
+    def add_hits(self, genome_index, qseqids):
+        """Marks every candidate of `qseqids` as present in genome `genome_index`."""
+        rows = self.row_of.get_indexer(pd.unique(qseqids))
+        rows = rows[rows >= 0]
+        self.bits[rows, genome_index >> 3] |= np.uint8(1 << (genome_index & 7))
+
+    def iter_blocks(self, block_rows=65536):
+        """Yields (row_slice, bool matrix) blocks so the full bool matrix is never materialized."""
+        for start in range(0, len(self.candidates), block_rows):
+            rows = slice(start, start + block_rows)
+            yield rows, np.unpackbits(self.bits[rows], axis=1, count=len(self.genomes), bitorder="little").astype(bool)
+
+    def scores(self, genome_clades=None):
+        """
+        Per-candidate distribution scores: number and fraction of genomes hit and,
+        if a genome -> clade mapping is given, the number of clades hit and the
+        clade-weighted fraction (mean over clades of the fraction of the clade's genomes hit).
+        """
+        n_genomes = max(len(self.genomes), 1)
+        hits = np.zeros(len(self.candidates), dtype=np.int32)
+        result = {"qseqid": self.candidates}
+
+        if genome_clades:
+            clades = sorted({genome_clades.get(g, "unassigned") for g in self.genomes})
+            clade_of = np.array([clades.index(genome_clades.get(g, "unassigned")) for g in self.genomes])
+            clade_sizes = np.bincount(clade_of, minlength=len(clades))
+            weights = 1.0 / (len(clades) * clade_sizes[clade_of])
+            membership = np.zeros((len(self.genomes), len(clades)), dtype=np.int32)
+            membership[np.arange(len(self.genomes)), clade_of] = 1
+            clades_hit = np.zeros(len(self.candidates), dtype=np.int32)
+            weighted = np.zeros(len(self.candidates), dtype=np.float64)
+
+        for rows, present in self.iter_blocks():
+            hits[rows] = present.sum(axis=1)
+            if genome_clades:
+                clades_hit[rows] = ((present.astype(np.int32) @ membership) > 0).sum(axis=1)
+                weighted[rows] = present @ weights
+
+        result["n_genomes_hit"] = hits
+        result["genome_fraction"] = hits / n_genomes
+        if genome_clades:
+            result["n_clades_hit"] = clades_hit
+            result["clade_weighted_fraction"] = weighted
+        return pd.DataFrame(result)
+
+    def save(self, path):
+        np.savez_compressed(path, bits=self.bits, candidates=np.array(self.candidates, dtype=str),
+                            genomes=np.array(self.genomes, dtype=str))
+
+def read_fasta_records(fasta_path):
+    """Yields (record_id, record_text, sequence) for every record of a FASTA file."""
+    record_id, text, sequence = None, [], []
+    with open(fasta_path) as f:
+        for line in f:
+            if line.startswith(">"):
+                if text:
+                    yield record_id, "".join(text), "".join(sequence)
+                record_id = line[1:].split(None, 1)[0] if line[1:].strip() else ""
+                text, sequence = [], []
+            else:
+                sequence.append(line.strip())
+            text.append(line)
+    if text:
+        yield record_id, "".join(text), "".join(sequence)
+
+COMPLEMENT = str.maketrans("ACGTRYKMBVDHN", "TGCAYRMKVBHDN")
+
+def sequence_key(sequence):
+    """
+    Hash identifying a candidate's sequence (case-insensitive). With
+    --dedup_revcomp the key is strand-independent. Returns (key, is_forward):
+    is_forward tells whether the sequence is in the orientation that was hashed.
+    """
+    sequence = sequence.upper()
+    is_forward = True
+    if args.dedup_revcomp:
+        reverse = sequence.translate(COMPLEMENT)[::-1]
+        if reverse < sequence:
+            sequence, is_forward = reverse, False
+    return hashlib.blake2b(sequence.encode(), digest_size=16).hexdigest(), is_forward
+
+def split_query(query_fasta_path, n_shards, shard_dir):
+    """
+    Splits a FASTA into at most n_shards files with balanced total residues
+    (longest record first onto the currently lightest shard). Returns the
+    non-empty shard paths. The split is deterministic, so resumed runs reuse it.
+    """
+    records = [(text, len(sequence)) for _, text, sequence in read_fasta_records(query_fasta_path)]
+    order = sorted(range(len(records)), key=lambda i: (-records[i][1], i))
+    heap = [(0, k) for k in range(n_shards)]
+    assignment = [[] for _ in range(n_shards)]
+    for i in order:
+        load, k = heapq.heappop(heap)
+        assignment[k].append(i)
+        heapq.heappush(heap, (load + records[i][1], k))
+
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_paths = []
+    for k, members in enumerate(assignment):
+        if not members:
+            continue
+        path = os.path.join(shard_dir, f"query_shard{k}.fasta")
+        with open(path, "w") as f:
+            for i in sorted(members):
+                f.write(records[i][0])
+        shard_paths.append(path)
+    return shard_paths
+
+def merge_shard_outputs(shard_outputs, output_path, duplicates=None):
+    """
+    Concatenates the task outputs of one genome into its final .tsv. Hits of a
+    deduplicated representative are repeated for each of its duplicates (only
+    qseqid changes), so the result looks as if every candidate had been BLASTed.
+    """
+    tmp_output = output_path + ".tmp"
+    with open(tmp_output, "wb" if duplicates is None else "w") as out:
+        for path in shard_outputs:
+            if duplicates is None:
+                with open(path, "rb") as f:
+                    while True:
+                        block = f.read(1 << 20)
+                        if not block:
+                            break
+                        out.write(block)
+                continue
+            if os.path.getsize(path) == 0:
+                continue
+            # Read as text so every value is written back exactly as BLAST printed it
+            for chunk in pd.read_csv(path, sep="\t", header=None, dtype=str, keep_default_na=False, chunksize=500000):
+                expanded = chunk.merge(duplicates, left_on=0, right_on="representative", how="left")
+                expanded[0] = expanded["qseqid"].fillna(expanded[0])
+                expanded[chunk.columns].to_csv(out, sep="\t", header=False, index=False)
+    os.replace(tmp_output, output_path)
+    for path in shard_outputs:
+        if path != output_path:
+            os.remove(path)
+
+def load_clades(path):
+    """Reads '<plant genome file>\t<clade>' lines."""
+    clades = pd.read_csv(path, sep="\t", header=None, names=["genome", "clade"], dtype=str, comment="#")
+    return dict(zip(clades["genome"], clades["clade"]))
+
+def read_result_ids(output_path):
+    """qseqid column of one BLAST output (empty list for empty files)."""
+    if os.path.getsize(output_path) == 0:
+        return []
+    return pd.read_csv(output_path, sep="\t", header=None, usecols=[0], dtype=str)[0]
+
+# ─── INCREMENTAL MODE ───────────────────────────────────────────────────────────
+# Each genome keeps '<genome>.hits.tsv' (BLAST rows whose qseqid is the sequence
+# hash of DEDUP_MAP_FILE) and '<genome>.done' (the genome's content hash and the
+# sequence hashes it was searched with). A run only BLASTs the hashes a genome
+# has not seen, then writes '<genome>.tsv' back in candidate-ID space.
+# Hits do not depend on the strand of the query, so the state stays valid
+# whether or not --dedup_revcomp is used.
+
+def state_paths(plant_name):
+    base = os.path.join(INCREMENTAL_DIR, plant_name)
+    return base + ".hits.tsv", base + ".done"
+
+def save_state(plant_name, state):
+    _, done_path = state_paths(plant_name)
+    with open(done_path + ".tmp", "w") as f:
+        json.dump({"genome": state["genome"], "searched": sorted(state["searched"])}, f)
+    os.replace(done_path + ".tmp", done_path)
+
+def rewrite_rows(sources, output_path):
+    """
+    Streams the rows of BLAST outputs into output_path, atomically. sources is a
+    list of (path, transform or None); rows are read as text so every value is
+    written back exactly as BLAST printed it.
+    """
+    tmp_output = output_path + ".tmp"
+    with open(tmp_output, "w") as out:
+        for path, transform in sources:
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                continue
+            for chunk in pd.read_csv(path, sep="\t", header=None, dtype=str, keep_default_na=False, chunksize=500000):
+                if transform is not None:
+                    chunk = transform(chunk)
+                chunk.to_csv(out, sep="\t", header=False, index=False)
+    os.replace(tmp_output, output_path)
+
+def load_state(plant_path, genome_hash, legacy):
+    """
+    {'genome', 'searched'} of one genome. A genome whose content changed starts
+    over: its hits are dropped and 'rebuild_db' is set, so the preflight builds
+    its BLAST DB again. Its .done file keeps the old genome hash until then, so
+    an interrupted run still rebuilds the DB next time. A genome finished by a run without
+    --incremental is adopted through the previous dedup map, given as
+    legacy = ({representative id: hash}, hashes of that run) or None.
+    """
+    plant_name = os.path.basename(plant_path)
+    hits_path, done_path = state_paths(plant_name)
+    if os.path.exists(done_path):
+        with open(done_path) as f:
+            state = json.load(f)
+        if state["genome"] == genome_hash:
+            return {"genome": genome_hash, "searched": set(state["searched"])}
+        print(f"[INFO] {plant_name} changed since it was last searched: its hits and BLAST database are rebuilt.")
+        if os.path.exists(hits_path):
+            os.remove(hits_path)
+        return {"genome": genome_hash, "searched": set(), "rebuild_db": True}
+
+    out_file = os.path.join(PLANT_BLAST_RESULTS_DIR, f"{plant_name}.tsv")
+    if legacy is None or not os.path.exists(out_file) or os.path.getsize(out_file) == 0:
+        return {"genome": genome_hash, "searched": set()}
+    hash_of, searched = legacy
+
+    def to_hash_space(chunk):
+        # Only the representative rows: duplicates carry the same hits
+        chunk[0] = chunk[0].map(hash_of)
+        return chunk[chunk[0].notna()]
+    rewrite_rows([(out_file, to_hash_space)], hits_path)
+    state = {"genome": genome_hash, "searched": set(searched)}
+    save_state(plant_name, state)
+    return state
+
+def load_states(plant_files, previous_map):
+    """Hashes every plant genome and loads (or adopts) its incremental state."""
+    os.makedirs(INCREMENTAL_DIR, exist_ok=True)
+    legacy = None
+    if previous_map is not None and "seq_hash" in previous_map.columns:
+        own = previous_map[previous_map["qseqid"] == previous_map["representative"]]
+        legacy = (dict(zip(own["qseqid"], own["seq_hash"])), set(previous_map["seq_hash"]))
+    hashes = FileHashes(GENOME_HASHES_FILE)
+    states = {os.path.basename(p): load_state(p, hashes.digest(p), legacy) for p in plant_files}
+    hashes.save()
+    adopted = sum(1 for state in states.values() if state["searched"])
+    print(f"[INFO] Incremental state loaded: {adopted}/{len(states)} genomes already searched with some candidates.")
+    return states
+
+def run_incremental(plant_files, states, sequences, dedup_map, refresh_all, matrix, genome_index, stale_dbs=()):
+    """
+    BLASTs every genome against the candidate sequences it has not been searched
+    with yet (genomes missing the same set share one query file), then writes
+    each genome's .tsv in candidate-ID space. Genomes in stale_dbs (DB not rebuilt
+    after a change) are not searched. Returns {plant name: hashes searched by this run}.
+    """
+    current = set(sequences)
+    groups = {}
+    for plant_path in plant_files:
+        missing = current - states[os.path.basename(plant_path)]["searched"]
+        if missing and blast_db_exists(plant_path) and plant_path not in stale_dbs:
+            groups.setdefault(frozenset(missing), []).append(plant_path)
+
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    query_files = []
+    group_of = {}
+    pending = {}
+    jobs = []
+    for i, (missing, group_paths) in enumerate(groups.items()):
+        query = os.path.join(SHARD_DIR, f"incremental_query{i}.fasta")
+        with open(query, "w") as f:
+            for h in sorted(missing):
+                f.write(f">{h}\n{sequences[h]}\n")
+        shards = [query]
+        if QUERY_SHARDS > 1:
+            shards = split_query(query, QUERY_SHARDS, os.path.join(SHARD_DIR, f"incremental_query{i}"))
+            query_files.extend(shards)
+        query_files.append(query)
+        for plant_path in group_paths:
+            plant_name = os.path.basename(plant_path)
+            group_of[plant_name] = (missing, shards)
+            pending[plant_name] = set(range(len(shards)))
+            size = blast_db_size(plant_path)
+            jobs.extend((plant_path, k, size) for k in range(len(shards)))
+
+    jobs.sort(key=lambda job: (-job[2], job[1]))
+    median_size = float(np.median([size for _, _, size in jobs])) if jobs else 0
+    tasks = [((plant_path, k), threads_for_size(size, median_size)) for plant_path, k, size in jobs]
+
+    print(f"[INFO] Running {len(tasks)} BLAST tasks: {len(pending)} genomes with unsearched candidates "
+          f"({len(groups)} distinct query sets) on {TOTAL_CORES} cores, at most {MAX_PARALLEL_JOBS} at once...")
+
+    def new_output(plant_name, shard):
+        return os.path.join(SHARD_DIR, f"{plant_name}.new{shard}.tsv")
+
+    def blast_task(task, threads):
+        plant_path, shard = task
+        plant_name = os.path.basename(plant_path)
+        return run_blast_job(plant_path, group_of[plant_name][1][shard], new_output(plant_name, shard), threads)
+
+    with instrument.span("blast", rows=len(tasks)):
+        new_hashes = {}
+        for (plant_path, shard), error, exception in run_with_core_budget(tasks, TOTAL_CORES, blast_task, MAX_PARALLEL_JOBS):
+            plant_name = os.path.basename(plant_path)
+            error = error or exception
+            if error:
+                print(f"[ERROR] {plant_name}: {error}", file=sys.stderr)
+                continue
+
+            pending[plant_name].discard(shard)
+            if pending[plant_name]:
+                continue
+            missing, shards = group_of[plant_name]
+            outputs = [new_output(plant_name, k) for k in range(len(shards))]
+            hits_path, _ = state_paths(plant_name)
+            # Rows of the searched hashes are replaced, so a run interrupted between
+            # the two writes below never duplicates hits
+            keep_old = lambda chunk: chunk[~chunk[0].isin(missing)]
+            rewrite_rows([(hits_path, keep_old)] + [(path, None) for path in outputs], hits_path)
+            states[plant_name]["searched"] |= missing
+            save_state(plant_name, states[plant_name])
+            new_hashes[plant_name] = missing
+            for path in outputs:
+                os.remove(path)
+            print(".", end="", flush=True)
+
+    print("\n[INFO] BLAST processing complete.")
+
+    # Back to candidate IDs: every current candidate gets the rows of its sequence hash
+    expansion = dedup_map[["seq_hash", "qseqid"]].rename(columns={"qseqid": "candidate"})
+
+    def to_id_space(chunk):
+        expanded = chunk.merge(expansion, left_on=0, right_on="seq_hash", how="inner")
+        expanded[0] = expanded["candidate"]
+        return expanded[chunk.columns]
+
+    for plant_path in plant_files:
+        plant_name = os.path.basename(plant_path)
+        out_file = os.path.join(PLANT_BLAST_RESULTS_DIR, f"{plant_name}.tsv")
+        if refresh_all or plant_name in new_hashes or plant_path in stale_dbs or not os.path.exists(out_file):
+            rewrite_rows([(state_paths(plant_name)[0], to_id_space)], out_file)
+        matrix.add_hits(genome_index[plant_name], read_result_ids(out_file))
+
+    for path in query_files:
+        os.remove(path)
+    return new_hashes
+
+def list_plant_files():
+    """Plant genome FASTAs of PLANT_GENOMES_DIR."""
+    return [
+        os.path.join(PLANT_GENOMES_DIR, f)
+        for f in os.listdir(PLANT_GENOMES_DIR)
+        if f.endswith(('.fasta', '.fa', '.fna'))
+    ]
+
+def build_missing_dbs(plant_files, rebuild=()):
+    """
+    Builds every missing BLAST DB up front, plus those of the genomes in
+    `rebuild` (changed since their DB was made), MAX_PARALLEL_JOBS at a time.
+    Returns the genomes whose DB could not be built.
+    """
+    missing_dbs = [p for p in plant_files if p in rebuild or not blast_db_exists(p)]
+    failed = []
+    if missing_dbs:
+        print(f"[INFO] Building {len(missing_dbs)} missing BLAST databases ({MAX_PARALLEL_JOBS} at a time)...")
+        for plant_path in missing_dbs:
+            if plant_path in rebuild:
+                print(f"[INFO] Rebuilding the BLAST database of {os.path.basename(plant_path)} (genome changed)")
+        with instrument.span("blast_databases", rows=len(missing_dbs)), ThreadPoolExecutor(max_workers=MAX_PARALLEL_JOBS) as executor:
+            errors = executor.map(lambda path: check_blast_db(path, path in rebuild), missing_dbs)
+            for plant_path, error in zip(missing_dbs, errors):
+                if error:
+                    print(f"[ERROR] {error}", file=sys.stderr)
+                    failed.append(plant_path)
+    return failed
+
+def remove_queries(master_query_file, query_files):
+    """Cleans up the query files (the master query stays with --keep_query)."""
+    for path in [master_query_file] + query_files:
+        if args.keep_query and path == master_query_file:
+            continue
+        if os.path.exists(path):
+            os.remove(path)
+
 # ─── MAIN EXECUTION ─────────────────────────────────────────────────────────────
 def main():
+    instrument.start(args)
+    if args.databases_only:
+        plant_files = list_plant_files()
+        failed = build_missing_dbs(plant_files)
+        if failed:
+            sys.exit(f"[ERROR] {len(failed)} BLAST databases could not be built.")
+        print(f"[SUCCESS] BLAST databases ready for {len(plant_files)} plant genomes.")
+        return
+
     # 1. Consolidate all 'selected' sequences into one master query file
     # This is much more efficient than blasting many small fasta files individually.
+    # Identical sequences (by hash) are only written once; the others are
+    # recorded in DEDUP_MAP_FILE and get their representative's hits afterwards.
     master_query_file = "all_candidates_query.fasta"
     print("[INFO] Consolidating candidate sequences into master query...")
-    
-    with open(master_query_file, 'w') as outfile:
+
+    # The previous run's candidates (--incremental): adoption of old results and the delta
+    previous_map = None
+    if args.incremental:
+        for path in (DEDUP_MAP_FILE, LEGACY_DEDUP_MAP_FILE):
+            if os.path.exists(path):
+                previous_map = pd.read_csv(path, sep="\t", dtype=str, keep_default_na=False)
+                break
+
+    candidate_ids = []
+    representatives = {}  # sequence key -> (representative id, is_forward)
+    sequences = {}  # sequence key -> representative sequence (--incremental)
+    dedup_rows = []
+    with instrument.span("consolidate") as consolidate_span, open(master_query_file, 'w') as outfile:
         found_any = False
         for filename in os.listdir(SELECTED_SEQUENCES_DIR):
             if filename.endswith(".fasta") or filename.endswith(".fa"):
                 path = os.path.join(SELECTED_SEQUENCES_DIR, filename)
-                with open(path, 'r') as infile:
-                    outfile.write(infile.read())
-                    found_any = True
+                found_any = True
+                for record_id, text, sequence in read_fasta_records(path):
+                    candidate_ids.append(record_id)
+                    consolidate_span.add(rows=1, bytes=len(text))
+                    if not DEDUP:
+                        outfile.write(text)
+                        continue
+                    key, is_forward = sequence_key(sequence)
+                    if key not in representatives:
+                        representatives[key] = (record_id, is_forward)
+                        outfile.write(text)
+                        if args.incremental:
+                            sequences[key] = sequence
+                    representative, rep_forward = representatives[key]
+                    dedup_rows.append((record_id, representative, "+" if is_forward == rep_forward else "-", key))
     
     if not found_any:
         sys.exit(f"[ERROR] No fasta files found in {SELECTED_SEQUENCES_DIR}")
 
+    candidate_ids = list(dict.fromkeys(candidate_ids))
+    duplicates = None
+    if DEDUP:
+        dedup_map = pd.DataFrame(dedup_rows, columns=["qseqid", "representative", "strand", "seq_hash"])
+        dedup_map.to_csv(DEDUP_MAP_FILE, sep="\t", index=False)
+        duplicates = dedup_map.loc[dedup_map["qseqid"] != dedup_map["representative"], ["representative", "qseqid"]]
+        # Keep each representative's own rows too, first, so hit order is preserved
+        if not duplicates.empty:
+            own = pd.DataFrame({"representative": duplicates["representative"].unique()})
+            own["qseqid"] = own["representative"]
+            duplicates = pd.concat([own, duplicates], ignore_index=True).drop_duplicates()
+            duplicates = duplicates.sort_values("representative", kind="stable").reset_index(drop=True)
+        print(f"[INFO] {len(candidate_ids)} candidate sequences, {len(representatives)} distinct "
+              f"(mapping saved to {DEDUP_MAP_FILE}).")
+    else:
+        print(f"[INFO] {len(candidate_ids)} candidate sequences in master query.")
+
     # 2. Prepare Jobs
-    plant_files = [
-        os.path.join(PLANT_GENOMES_DIR, f) 
-        for f in os.listdir(PLANT_GENOMES_DIR) 
-        if f.endswith(('.fasta', '.fa', '.fna'))
-    ]
-    
+    plant_files = list_plant_files()
     print(f"[INFO] Found {len(plant_files)} plant genomes to check against.")
+
+    # Candidate x genome presence matrix, filled as each genome's results arrive
+    plant_names = [os.path.basename(p) for p in plant_files]
+    genome_index = {name: i for i, name in enumerate(plant_names)}
+    matrix = PresenceMatrix(candidate_ids, plant_names)
     
-    # 3. Run BLAST in Parallel
-    print(f"[INFO] Running BLAST with {MAX_PARALLEL_JOBS} parallel jobs...")
-    
-    with ProcessPoolExecutor(max_workers=MAX_PARALLEL_JOBS) as executor:
-        futures = {}
+    # Genomes whose content changed are marked here, so the preflight rebuilds their BLAST DB
+    rebuild = set()
+    if args.incremental:
+        states = load_states(plant_files, previous_map)
+        rebuild = {p for p in plant_files if states[os.path.basename(p)].get("rebuild_db")}
+
+    # 3. Preflight: build every missing BLAST DB up front, in parallel
+    failed_dbs = build_missing_dbs(plant_files, rebuild)
+    for plant_path in rebuild.difference(failed_dbs):
+        # The DB now matches the genome: record its new hash (nothing searched yet)
+        plant_name = os.path.basename(plant_path)
+        save_state(plant_name, states[plant_name])
+
+    new_hashes = {}
+    if args.incremental:
+        query_files = []
+        same_candidates = previous_map is not None and \
+            list(zip(previous_map["qseqid"], previous_map["seq_hash"])) == list(zip(dedup_map["qseqid"], dedup_map["seq_hash"]))
+        # A changed genome whose DB could not be rebuilt must not be searched with the old one
+        new_hashes = run_incremental(plant_files, states, sequences, dedup_map, not same_candidates, matrix, genome_index,
+                                     rebuild.intersection(failed_dbs))
+    else:
+        # 4. Split the master query into balanced shards (optional)
+        if QUERY_SHARDS > 1:
+            query_files = split_query(master_query_file, QUERY_SHARDS, SHARD_DIR)
+            print(f"[INFO] Master query split into {len(query_files)} shards.")
+        else:
+            query_files = [master_query_file]
+
+        if duplicates is not None and duplicates.empty:
+            duplicates = None
+
+        if len(query_files) > 1 or duplicates is not None:
+            os.makedirs(SHARD_DIR, exist_ok=True)
+
+        def task_output(plant_name, shard):
+            if len(query_files) == 1 and duplicates is None:
+                return os.path.join(PLANT_BLAST_RESULTS_DIR, f"{plant_name}.tsv")
+            return os.path.join(SHARD_DIR, f"{plant_name}.shard{shard}.tsv")
+
+        # 5. Schedule (query shard x genome) BLAST tasks longest-first, threads scaled to the DB size
+        jobs = []
+        pending = {}
         for plant_path in plant_files:
             plant_name = os.path.basename(plant_path)
             out_file = os.path.join(PLANT_BLAST_RESULTS_DIR, f"{plant_name}.tsv")
-            
+
             # Skip if already done (resume capability)
             if os.path.exists(out_file) and os.path.getsize(out_file) > 0:
+                matrix.add_hits(genome_index[plant_name], read_result_ids(out_file))
+                continue
+            if not blast_db_exists(plant_path):
                 continue
-                
-            future = executor.submit(run_blast_job, plant_path, master_query_file, out_file)
-            futures[future] = plant_name
 
-        for future in as_completed(futures):
-            plant_name = futures[future]
-            error = future.result()
-            if error:
-                print(f"[ERROR] {plant_name}: {error}", file=sys.stderr)
-            else:
+            shards = [k for k in range(len(query_files)) if not os.path.exists(task_output(plant_name, k))]
+            if not shards:
+                # Every shard finished in a previous run, only the merge is missing
+                merge_shard_outputs([task_output(plant_name, k) for k in range(len(query_files))], out_file, duplicates)
+                matrix.add_hits(genome_index[plant_name], read_result_ids(out_file))
+                continue
+            pending[plant_name] = set(shards)
+            size = blast_db_size(plant_path)
+            jobs.extend((plant_path, k, size) for k in shards)
+
+        jobs.sort(key=lambda job: (-job[2], job[1]))
+        median_size = float(np.median([size for _, _, size in jobs])) if jobs else 0
+        tasks = [((plant_path, k), threads_for_size(size, median_size)) for plant_path, k, size in jobs]
+
+        print(f"[INFO] Running {len(tasks)} BLAST tasks ({len(pending)} genomes x {len(query_files)} query shards) "
+              f"on {TOTAL_CORES} cores, at most {MAX_PARALLEL_JOBS} at once (largest genomes first)...")
+
+        def blast_task(task, threads):
+            plant_path, shard = task
+            return run_blast_job(plant_path, query_files[shard], task_output(os.path.basename(plant_path), shard), threads)
+
+        with instrument.span("blast", rows=len(tasks)):
+            for (plant_path, shard), error, exception in run_with_core_budget(tasks, TOTAL_CORES, blast_task, MAX_PARALLEL_JOBS):
+                plant_name = os.path.basename(plant_path)
+                error = error or exception
+                if error:
+                    print(f"[ERROR] {plant_name}: {error}", file=sys.stderr)
+                    continue
+
+                pending[plant_name].discard(shard)
+                if pending[plant_name]:
+                    continue
+                out_file = os.path.join(PLANT_BLAST_RESULTS_DIR, f"{plant_name}.tsv")
+                if len(query_files) > 1 or duplicates is not None:
+                    merge_shard_outputs([task_output(plant_name, k) for k in range(len(query_files))], out_file, duplicates)
+                matrix.add_hits(genome_index[plant_name], read_result_ids(out_file))
                 # Optional: Print progress dots
                 print(".", end="", flush=True)
 
-    print("\n[INFO] BLAST processing complete.")
+        print("\n[INFO] BLAST processing complete.")
+
+    # 6. Distribution (patchiness) scores from the presence matrix
+    with instrument.span("scores", rows=len(candidate_ids)):
+        genome_clades = load_clades(args.clades) if args.clades else None
+        scores = matrix.scores(genome_clades)
+        score_column = "clade_weighted_fraction" if genome_clades else "genome_fraction"
+        if args.max_fraction is not None:
+            scores["kept"] = scores[score_column] <= args.max_fraction
+        scores.to_csv(DISTRIBUTION_FILE, sep="\t", index=False)
+        matrix.save(PRESENCE_MATRIX_FILE)
+    print(f"[INFO] Distribution scores saved to {DISTRIBUTION_FILE} (matrix: {PRESENCE_MATRIX_FILE})")
+
+    kept_ids = None
+    if args.max_fraction is not None:
+        kept_ids = pd.Index(scores.loc[scores["kept"], "qseqid"])
+        print(f"[INFO] {len(kept_ids)}/{len(scores)} candidates hit at most {args.max_fraction:.0%} "
+              f"of plant genomes ({score_column}).")
+
+    # 7. Combine Results (streamed genome by genome, restricted to kept candidates).
+    #    --no_long_table skips it unless --delta_output still needs the pass.
+    if PLANT_COMBINED_RESULTS is None and not args.delta_output:
+        print("[INFO] Combined hit table skipped (--no_long_table); per-genome hits stay in "
+              f"{PLANT_BLAST_RESULTS_DIR}/.")
+        remove_queries(master_query_file, query_files)
+        return
 
-    # 4. Combine Results
     print("[INFO] Combining results...")
-    all_plant_hits = []
-    columns_list = ["qseqid", "sseqid", "pident", "length", "evalue", "bitscore"]
+    writer = TableWriter(PLANT_COMBINED_RESULTS) if PLANT_COMBINED_RESULTS else None
+    total_hits = 0
+    delta_writer = None
+    if args.delta_output:
+        # Added rows: genomes searched with a sequence for the first time, or candidates new to this run
+        delta_writer = TableWriter(args.delta_output)
+        hash_of = dict(zip(dedup_map["qseqid"], dedup_map["seq_hash"]))
+        previous_ids = set(previous_map["qseqid"]) if previous_map is not None else set()
+        delta_hits = 0
 
-    for filename in os.listdir(PLANT_BLAST_RESULTS_DIR):
-        if not filename.endswith(".tsv"):
-            continue
+    with instrument.span("combine") as combine_span:
+        for filename in os.listdir(PLANT_BLAST_RESULTS_DIR):
+            if not filename.endswith(".tsv") or filename in SUMMARY_FILES:
+                continue
             
-        file_path = os.path.join(PLANT_BLAST_RESULTS_DIR, filename)
+            file_path = os.path.join(PLANT_BLAST_RESULTS_DIR, filename)
         
-        # Determine plant name from filename
-        plant_genome_name = filename.replace(".tsv", "") # Simplification
+            # Determine plant name from filename
+            plant_genome_name = filename.replace(".tsv", "") # Simplification
+            if args.incremental and plant_genome_name not in genome_index:
+                continue  # genome no longer in --plant_genomes
         
-        try:
-            # Check for empty files
-            if os.path.getsize(file_path) == 0:
+            try:
+                # Check for empty files
+                if os.path.getsize(file_path) == 0:
+                    continue
+
+                df = pd.read_csv(file_path, sep="\t", names=BLAST_COLUMNS, dtype=BLAST_DTYPES)
+                if kept_ids is not None:
+                    df = df[df["qseqid"].isin(kept_ids)]
+                if df.empty:
+                    continue
+                df["plant_genome"] = plant_genome_name
+            except Exception as e:
+                print(f"[WARNING] Could not read {filename}: {e}")
                 continue
 
-            df = pd.read_csv(file_path, sep="\t", names=columns_list)
-            df["plant_genome"] = plant_genome_name
-            all_plant_hits.append(df)
-        except Exception as e:
-            print(f"[WARNING] Could not read {filename}: {e}")
+            if writer is not None:
+                writer.write(df)
+            total_hits += len(df)
+            combine_span.add(rows=len(df), bytes=os.path.getsize(file_path))
+            if delta_writer is not None:
+                added = df["qseqid"].map(hash_of).isin(new_hashes.get(plant_genome_name, ())) | ~df["qseqid"].isin(previous_ids)
+                if added.any():
+                    delta_writer.write(df[added])
+                    delta_hits += int(added.sum())
 
-    if all_plant_hits:
-        plant_results_df = pd.concat(all_plant_hits, ignore_index=True)
-        
-        # Save raw combined results
-        plant_results_df.to_csv(PLANT_COMBINED_RESULTS, sep="\t", index=False)
-        print(f"[SUCCESS] Combined plant hits saved to {PLANT_COMBINED_RESULTS}")
-        print(f"[INFO] Total hits found: {len(plant_results_df)}")
-        
-        # (The comparison logic happens in Script 5, so we stop here)
-    else:
-        print("[WARNING] No hits found in any plant genome.")
+    if writer is not None:
+        if writer.close():
+            print(f"[SUCCESS] Combined plant hits saved to {PLANT_COMBINED_RESULTS}")
+            print(f"[INFO] Total hits found: {total_hits}")
+
+            # (The comparison logic happens in Script 5, so we stop here)
+        else:
+            print("[WARNING] No hits found in any plant genome.")
+    if delta_writer is not None:
+        if delta_writer.close():
+            print(f"[INFO] {delta_hits} hits added by this run saved to {args.delta_output}")
+        else:
+            print("[INFO] No hits added by this run; delta output not created.")
 
-    # Clean up temp file
-    if os.path.exists(master_query_file):
-        os.remove(master_query_file)
+    remove_queries(master_query_file, query_files)
 
 if __name__ == "__main__":
     main()
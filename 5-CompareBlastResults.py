@@ -1,30 +1,88 @@
 #!/usr/bin/env python3
+import os
 import argparse
 import pandas as pd
 import numpy as np
+from table_io import read_table, write_table
+import instrument
 
 parser = argparse.ArgumentParser(description="Calculate HT Index by comparing Fungi vs Plant Bitscores.")
 parser.add_argument("--fungi_results", required=True, help="Filtered BLAST results against Fungi (from Script 2)")
 parser.add_argument("--plant_results", required=True, help="BLAST results against Plants (from Script 4)")
-parser.add_argument("--output", default="fungi_vs_plant_comparison.tsv", help="Output comparison file")
-parser.add_argument("--candidates_out", default="ht_candidates.tsv", help="Final HT candidates file")
+parser.add_argument("--output", default="fungi_vs_plant_comparison.tsv", help="Output comparison file (TSV, or Parquet if it ends in .parquet)")
+parser.add_argument("--candidates_out", default="ht_candidates.tsv", help="Final HT candidates file (TSV, or Parquet if it ends in .parquet)")
+parser.add_argument("--engine", default="vectorized", choices=["vectorized", "legacy"],
+                    help="'legacy' keeps the original sort/apply implementation (for comparison and benchmarks)")
+parser.add_argument("--update", help="Previous --output comparison to update: --fungi_results/--plant_results are then the delta tables of an incremental run")
+instrument.add_arguments(parser)
 
 args = parser.parse_args()
+instrument.start(args)
 
-print("[INFO] Loading Fungi results...")
-fungi_df = pd.read_csv(args.fungi_results, sep="\t")
+# Declared dtypes for the Script 2 / Script 4 tables (columns that are absent are ignored).
+# bitscore is left to inference, as in the legacy engine: BLAST writes scores of
+# 100 and over as integers, which must come back out as integers.
+FUNGI_DTYPES = {
+    "qseqid": str, "sseqid": str, "pident": "float64", "length": "uint32",
+    "mismatch": "uint32", "gapopen": "uint32", "qstart": "uint32", "qend": "uint32",
+    "sstart": "uint32", "send": "uint32", "evalue": "float64",
+    "fungi_genome": "category"
+}
+PLANT_DTYPES = {
+    "qseqid": str, "sseqid": str, "pident": "float64", "length": "uint32",
+    "evalue": "float64", "plant_genome": "category"
+}
 
-print("[INFO] Loading Plant results...")
-plant_df = pd.read_csv(args.plant_results, sep="\t")
+# Ties on bitscore go to the lower evalue, then the smaller sseqid, then the earlier row
+TIE_BREAK = ["evalue", "sseqid"]
 
-fungi_best = fungi_df.sort_values("bitscore", ascending=False).groupby("qseqid", as_index=False).first()
-fungi_best = fungi_best.rename(columns=lambda x: x + "_fungi" if x != "qseqid" else x)
+def best_hits(df):
+    """Best-scoring row per qseqid (ties broken by TIE_BREAK), ordered by qseqid."""
+    score = df["bitscore"].fillna(-np.inf)
+    top = df[score.eq(score.groupby(df["qseqid"]).transform("max"))]
+    best = top.sort_values(["qseqid"] + [c for c in TIE_BREAK if c in df], kind="stable")
+    best = best.drop_duplicates("qseqid")
+    columns = ["qseqid"] + [c for c in df.columns if c != "qseqid"]
+    return best[columns].reset_index(drop=True)
 
-plant_best = plant_df.sort_values("bitscore", ascending=False).groupby("qseqid", as_index=False).first()
-plant_best = plant_best.rename(columns=lambda x: x + "_plant" if x != "qseqid" else x)
+def legacy_best_hits(df):
+    """The original sort + groupby().first(), with the same tie-break as best_hits."""
+    keys = ["bitscore"] + [c for c in TIE_BREAK if c in df]
+    ordered = df.sort_values(keys, ascending=[False] + [True] * (len(keys) - 1), kind="stable")
+    return ordered.groupby("qseqid", as_index=False).first()
 
-print("[INFO] Merging and calculating HT Index...")
-comparison = pd.merge(fungi_best, plant_best, on="qseqid", how="outer")
+def load_delta(path, dtype, label):
+    """A delta table, or None if the incremental run added no hits (no file)."""
+    if not os.path.exists(path):
+        print(f"[INFO] No {label} delta table ({path}); previous {label} hits kept as they are.")
+        return None
+    print(f"[INFO] Loading {label} delta {path}...")
+    return read_table(path, dtype=dtype)
+
+def previous_side(previous, suffix):
+    """One side's best hits of a previous comparison, without the column suffix."""
+    columns = [c for c in previous.columns if c.endswith(suffix)]
+    side = previous.loc[previous["bitscore" + suffix].notna(), ["qseqid"] + columns]
+    return side.rename(columns=lambda c: c[:-len(suffix)] if c.endswith(suffix) else c)
+
+def update_best(previous_best, delta):
+    """Best row per qseqid over previous best hits and a delta table; the previous row wins full ties."""
+    if delta is None:
+        return best_hits(previous_best)
+    best = best_hits(pd.concat([previous_best, delta], ignore_index=True))
+    # The previous table came back from text: restore the integer columns
+    for column in delta.columns:
+        if column in best and pd.api.types.is_numeric_dtype(delta[column]) and not best[column].isna().any():
+            best[column] = best[column].astype(delta[column].dtype)
+    return best
+
+def add_metrics(comparison):
+    """h_index = bitscore_fungi - bitscore_plant; score_ratio = fungi/plant (fungi score if no plant hit)."""
+    bf = comparison["bitscore_fungi"].fillna(0).astype("float64")
+    bp = comparison["bitscore_plant"].fillna(0).astype("float64")
+    comparison["h_index"] = bf - bp
+    comparison["score_ratio"] = bf.div(bp.where(bp > 0)).fillna(bf)
+    return comparison
 
 def calculate_metrics(row):
     bf = row.get("bitscore_fungi", 0)
@@ -32,16 +90,66 @@ def calculate_metrics(row):
     if pd.isna(bf): bf = 0
     if pd.isna(bp): bp = 0
     h_index = bf - bp
-    ratio = bf / bp if bp > 0 else bf 
+    ratio = bf / bp if bp > 0 else bf
     return pd.Series([h_index, ratio], index=['h_index', 'score_ratio'])
 
-comparison[["h_index", "score_ratio"]] = comparison.apply(calculate_metrics, axis=1)
-comparison_sorted = comparison.sort_values("h_index", ascending=False)
+if args.update:
+    # Only right for added genomes: hits of a replaced genome, or candidates
+    # dropped by 4-FindNonUbiquitousSequences.py --max_fraction, are never removed.
+    with instrument.span("load") as load_span:
+        print(f"[INFO] Loading previous comparison {args.update}...")
+        previous = read_table(args.update, dtype={"qseqid": str, "sseqid_fungi": str, "sseqid_plant": str})
+        fungi_delta = load_delta(args.fungi_results, FUNGI_DTYPES, "Fungi")
+        plant_delta = load_delta(args.plant_results, PLANT_DTYPES, "Plant")
+        load_span.add(rows=len(previous) + sum(len(d) for d in (fungi_delta, plant_delta) if d is not None))
+    with instrument.span("best_hits", rows=load_span.rows):
+        fungi_best = update_best(previous_side(previous, "_fungi"), fungi_delta)
+        plant_best = update_best(previous_side(previous, "_plant"), plant_delta)
+elif args.engine == "legacy":
+    with instrument.span("load") as load_span:
+        print("[INFO] Loading Fungi results...")
+        fungi_df = read_table(args.fungi_results)
+
+        print("[INFO] Loading Plant results...")
+        plant_df = read_table(args.plant_results)
+        load_span.add(rows=len(fungi_df) + len(plant_df))
+
+    with instrument.span("best_hits", rows=load_span.rows):
+        fungi_best = legacy_best_hits(fungi_df)
+        plant_best = legacy_best_hits(plant_df)
+else:
+    with instrument.span("load") as load_span:
+        print("[INFO] Loading Fungi results...")
+        fungi_df = read_table(args.fungi_results, dtype=FUNGI_DTYPES)
+
+        print("[INFO] Loading Plant results...")
+        plant_df = read_table(args.plant_results, dtype=PLANT_DTYPES)
+        load_span.add(rows=len(fungi_df) + len(plant_df))
+
+    with instrument.span("best_hits", rows=load_span.rows):
+        fungi_best = best_hits(fungi_df)
+        plant_best = best_hits(plant_df)
+
+fungi_best = fungi_best.rename(columns=lambda x: x + "_fungi" if x != "qseqid" else x)
+plant_best = plant_best.rename(columns=lambda x: x + "_plant" if x != "qseqid" else x)
+
+print("[INFO] Merging and calculating HT Index...")
+with instrument.span("merge") as merge_span:
+    comparison = pd.merge(fungi_best, plant_best, on="qseqid", how="outer")
+
+    if args.engine == "legacy" and not args.update:
+        comparison[["h_index", "score_ratio"]] = comparison.apply(calculate_metrics, axis=1)
+    else:
+        comparison = add_metrics(comparison)
+    comparison_sorted = comparison.sort_values("h_index", ascending=False, kind="stable")
+    merge_span.add(rows=len(comparison))
 
-comparison_sorted.to_csv(args.output, sep="\t", index=False)
+with instrument.span("write", rows=len(comparison_sorted)) as write_span:
+    write_table(comparison_sorted, args.output)
 
-candidates = comparison_sorted[comparison_sorted["h_index"] > 0]
-candidates.to_csv(args.candidates_out, sep="\t", index=False)
+    candidates = comparison_sorted[comparison_sorted["h_index"] > 0]
+    write_table(candidates, args.candidates_out)
+    write_span.add(rows=len(candidates))
 
 print(f"[SUCCESS] Comparison saved to {args.output}")
 print(f"[INFO] {len(candidates)} potential candidates (h_index > 0) saved to {args.candidates_out}")
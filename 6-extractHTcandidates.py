@@ -1,53 +1,91 @@
 #!/usr/bin/env python3
 import os
+import sys
 import argparse
-from Bio import SeqIO
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from table_io import read_table, table_columns
+from fasta_io import FastaIndex, FastaWriter, ensure_fai
+import instrument
 
 parser = argparse.ArgumentParser(description="Extract full genomic sequences of HT candidates from Fungal Genomes.")
-parser.add_argument("-i", "--input_candidates", required=True, help="Candidate TSV file (e.g., ht_candidates.tsv)")
-parser.add_argument("-g", "--fungi_genomes", required=True, help="Directory containing Fungi Genome FASTA files")
+parser.add_argument("-i", "--input_candidates", required=True, help="Candidate table (e.g., ht_candidates.tsv or .parquet)")
+parser.add_argument("-g", "--fungi_genomes", required=True, help="Directory containing Fungi Genome FASTA files (plain or bgzip-compressed)")
 parser.add_argument("-o", "--output", default="ht_candidates.fasta", help="Output Multi-FASTA file")
+parser.add_argument("--fai_dir", help="Directory containing Fungi .fai index files (default: next to each genome)")
+parser.add_argument("--fai_cache", default=".fai_cache", help="Where .fai files are built for genomes that have none")
+parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of genomes sliced in parallel")
+instrument.add_arguments(parser)
 
 args = parser.parse_args()
 
-df = pd.read_csv(args.input_candidates, sep="\t")
-# We need 'fungi_genome' column (added in Script 2) and coordinates
-required_cols = ["sseqid_fungi", "sstart_fungi", "send_fungi", "fungi_genome"]
-if not all(col in df.columns for col in required_cols):
-    exit(f"[ERROR] Input TSV missing one of required columns: {required_cols}")
+def slice_genome(task):
+    """
+    Reads only the candidate byte ranges of one genome (memory-mapped, random access).
+    A missing .fai is built here, so the workers index genomes in parallel.
+    Returns ([(header, fragment)], warnings); rows keep their input order.
+    """
+    genome_name, genome_path, rows = task
+    fai_path = ensure_fai(genome_path, args.fai_dir, args.fai_cache)
+    records = []
+    warnings = []
+    with FastaIndex(genome_path, fai_path) as genome:
+        for qseqid, scaffold, start, end in rows:
+            if start > end: start, end = end, start
+
+            if scaffold in genome:
+                fragment = genome.fetch(scaffold, start - 1, end)
+                records.append((f"{qseqid}|{genome_name}|{scaffold}:{start}-{end}", fragment))
+            else:
+                warnings.append(f"[WARNING] Scaffold {scaffold} not found in {genome_name}")
+    return records, warnings
 
-print(f"[INFO] Extracting {len(df)} sequences...")
+def main():
+    instrument.start(args)
+    # We need 'fungi_genome' column (added in Script 2) and coordinates.
+    # Script 5 writes it with the '_fungi' suffix of the other fungal columns.
+    columns = table_columns(args.input_candidates)
+    genome_col = "fungi_genome_fungi" if "fungi_genome" not in columns and "fungi_genome_fungi" in columns else "fungi_genome"
+    required_cols = ["sseqid_fungi", "sstart_fungi", "send_fungi", genome_col]
+    if not all(col in columns for col in required_cols):
+        sys.exit(f"[ERROR] Input TSV missing one of required columns: {required_cols}")
+    with instrument.span("read_input") as read_span:
+        df = read_table(args.input_candidates, columns=["qseqid"] + required_cols).rename(columns={genome_col: "fungi_genome"})
+        read_span.add(rows=len(df))
 
-grouped = df.groupby("fungi_genome")
+    print(f"[INFO] Extracting {len(df)} sequences...")
 
-with open(args.output, "w") as out_f:
-    for genome_name, group in grouped:
-        genome_path = os.path.join(args.fungi_genomes, str(genome_name) + ".fasta") 
-        if not os.path.exists(genome_path):
-             genome_path = os.path.join(args.fungi_genomes, str(genome_name))
-        
-        if not os.path.exists(genome_path):
+    tasks = []
+    for genome_name, group in df.groupby("fungi_genome"):
+        # Plain or bgzip-compressed genome
+        for suffix in (".fasta", "", ".fasta.gz", ".gz"):
+            genome_path = os.path.join(args.fungi_genomes, str(genome_name) + suffix)
+            if os.path.exists(genome_path):
+                break
+        else:
             print(f"[WARNING] Genome file for {genome_name} not found in {args.fungi_genomes}. Skipping {len(group)} candidates.")
             continue
-            
-        print(f"  -> Processing {genome_name}...")
-        
-        seq_dict = SeqIO.to_dict(SeqIO.parse(genome_path, "fasta"))
-        
-        for _, row in group.iterrows():
-            scaffold = str(row["sseqid_fungi"])
-            start = int(row["sstart_fungi"])
-            end = int(row["send_fungi"])
-            
-            if start > end: start, end = end, start
-            
-            if scaffold in seq_dict:
-                seq_record = seq_dict[scaffold]
-                fragment = seq_record.seq[start-1:end]
-                header = f">{row['qseqid']}|{genome_name}|{scaffold}:{start}-{end}"
-                out_f.write(f"{header}\n{fragment}\n")
-            else:
-                print(f"[WARNING] Scaffold {scaffold} not found in {genome_name}")
 
-print(f"[SUCCESS] Extraction complete. Saved to {args.output}")
+        rows = list(zip(
+            group["qseqid"],
+            group["sseqid_fungi"].astype(str),
+            group["sstart_fungi"].astype(int),
+            group["send_fungi"].astype(int),
+        ))
+        tasks.append((genome_name, genome_path, rows))
+
+    # Genomes are sliced in parallel; blocks are written in groupby (genome name) order
+    # Fragments are written unwrapped, one line each
+    with instrument.span("extract") as extract_span, \
+            ProcessPoolExecutor(max_workers=args.jobs) as executor, FastaWriter(args.output, width=0) as writer:
+        for (genome_name, _, _), (records, warnings) in zip(tasks, executor.map(slice_genome, tasks)):
+            print(f"  -> Processing {genome_name}...")
+            for warning in warnings:
+                print(warning)
+            for header, fragment in records:
+                writer.write(header, fragment)
+                extract_span.add(rows=1, bytes=len(fragment))
+
+    print(f"[SUCCESS] Extraction complete. Saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -16,18 +16,42 @@ if [ ! -f "$INPUT_FASTA" ]; then
     exit 1
 fi
 
-echo "[INFO] Clustering sequences with CD-HIT..."
-cd-hit -i "$INPUT_FASTA" -o ht_clusters.fasta -c 0.9 -n 5 -d 0 -T 8 -M 16000
-
-echo "[INFO] Annotating with EggNOG-Mapper..."
-# Note: Ensure eggnog-mapper is installed (emapper.py)
-emapper.py -i ht_clusters.fasta \
-           --output ht_annotations \
-           --cpu 8 \
-           --tax_scope 2759 \
-           --dmnd_db "${EGGNOG_DATA_DIR}/eggnog_proteins.dmnd" \
-           -m diamond \
-           --data_dir "${EGGNOG_DATA_DIR}" \
-           --translate
+# Annotations are cached by sequence across runs; only new representatives go to EggNOG-mapper
+ANNOTATION_DB="${ANNOTATION_DB:-ht_annotations.sqlite}"
+TAX_SCOPE=2759
+EMAPPER_SETTINGS="dmnd_db=${EGGNOG_DATA_DIR}/eggnog_proteins.dmnd;data_dir=${EGGNOG_DATA_DIR};tax_scope=${TAX_SCOPE};mode=diamond;translate"
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+if [ ht_clusters.fasta -nt "$INPUT_FASTA" ]; then
+    echo "[INFO] ht_clusters.fasta is newer than $INPUT_FASTA; skipping CD-HIT."
+else
+    echo "[INFO] Clustering sequences with CD-HIT..."
+    cd-hit -i "$INPUT_FASTA" -o ht_clusters.fasta -c 0.9 -n 5 -d 0 -T 8 -M 16000 || exit 1
+fi
+
+python "$SCRIPT_DIR/annotation_cache.py" select --fasta ht_clusters.fasta --db "$ANNOTATION_DB" \
+       --settings "$EMAPPER_SETTINGS" --new ht_new_reps.fasta || exit 1
+
+rm -f ht_new_annotations.emapper.*
+if [ -s ht_new_reps.fasta ]; then
+    echo "[INFO] Annotating new representatives with EggNOG-Mapper..."
+    # Note: Ensure eggnog-mapper is installed (emapper.py)
+    emapper.py -i ht_new_reps.fasta \
+               --output ht_new_annotations \
+               --cpu 8 \
+               --tax_scope "$TAX_SCOPE" \
+               --dmnd_db "${EGGNOG_DATA_DIR}/eggnog_proteins.dmnd" \
+               -m diamond \
+               --data_dir "${EGGNOG_DATA_DIR}" \
+               --translate \
+               --override || exit 1
+else
+    echo "[INFO] All representatives are already annotated."
+fi
+
+python "$SCRIPT_DIR/annotation_cache.py" merge --fasta ht_clusters.fasta --db "$ANNOTATION_DB" \
+       --settings "$EMAPPER_SETTINGS" --new ht_new_reps.fasta \
+       --new_annotations ht_new_annotations.emapper.annotations \
+       --output ht_annotations.emapper.annotations || exit 1
 
 echo "[SUCCESS] Annotation complete."
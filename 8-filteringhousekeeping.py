@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
+import os
+import re
+import sys
 import argparse
 import pandas as pd
-import sys
-from Bio import SeqIO
+from fasta_io import FastaWriter, iter_fasta, record_id
+import instrument
 
 parser = argparse.ArgumentParser(description="Filter out housekeeping genes based on EggNOG annotations.")
 parser.add_argument("--annotations", required=True, help="EggNOG annotation file (.annotations)")
 parser.add_argument("--fasta_in", required=True, help="Clustered FASTA input (ht_clusters.fasta)")
 parser.add_argument("--fasta_out", default="ht_filtered.fasta", help="Final Filtered FASTA output")
+parser.add_argument("--keywords", help="File with one housekeeping keyword per line (default: built-in list)")
+parser.add_argument("--columns", default="Description,Preferred_name,PFAMs",
+                    help="Comma-separated annotation columns searched for keywords (names from the '#query' header), or 'all'")
+parser.add_argument("--chunksize", type=int, default=500000, help="Annotation rows read at once")
+instrument.add_arguments(parser)
 
 args = parser.parse_args()
 
@@ -22,39 +30,106 @@ HOUSEKEEPING_KEYWORDS = [
     "primase", "actin", "tubulin", "kinesin", "dynein", "myosin", "chaperone",
     "heat shock protein", "ubiquitin", "kinase", "phosphatase"
 ]
-keywords_lower = [kw.lower() for kw in HOUSEKEEPING_KEYWORDS]
-
-print("[INFO] Parsing annotations...")
-# EggNOG annotation files often have variable headers. We skip comments ##
-try:
-    df = pd.read_csv(args.annotations, sep="\t", comment="#", header=None)
-    # Usually column 0 is Query, column 7 or similar is Description/Free Text.
-    # We'll just concat all text columns to be safe for keywords search
-except Exception as e:
-    exit(f"[ERROR] Could not read annotations: {e}")
-
-# Identify Housekeeping IDs
-hk_ids = set()
-for index, row in df.iterrows():
-    # Convert entire row to string to search for keywords
-    row_text = " ".join(row.astype(str)).lower()
-    if any(kw in row_text for kw in keywords_lower):
-        # Assuming column 0 is the Query ID (standard for EggNOG)
-        hk_ids.add(str(row[0]))
-
-print(f"[INFO] Found {len(hk_ids)} sequences matching housekeeping keywords.")
-
-# Write Filtered FASTA
-kept_count = 0
-excluded_count = 0
-
-with open(args.fasta_out, "w") as out_handle:
-    for record in SeqIO.parse(args.fasta_in, "fasta"):
-        if record.id not in hk_ids:
-            SeqIO.write(record, out_handle, "fasta")
-            kept_count += 1
-        else:
-            excluded_count += 1
-
-print(f"[SUCCESS] Filtered FASTA saved to {args.fasta_out}")
-print(f"         Kept: {kept_count} | Removed: {excluded_count}")
+
+def load_keywords(path):
+    """One keyword per line; blank lines and '#' comments are ignored."""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+def read_header(path):
+    """Column names from the '#query' header line of an EggNOG file (None if there is none)."""
+    with open(path) as f:
+        for line in f:
+            if not line.startswith("#"):
+                break
+            if line.startswith("#query"):
+                return line[1:].rstrip("\n").split("\t")
+    return None
+
+def search_columns(header):
+    """Positions of the columns to search (None = every column, the original behaviour)."""
+    if args.columns == "all":
+        return None
+    if header is None:
+        print("[WARNING] No '#query' header line found; searching all columns.")
+        return None
+    names = {name.lower(): i for i, name in enumerate(header)}
+    wanted = [c.strip() for c in args.columns.split(",") if c.strip()]
+    positions = [names[c.lower()] for c in wanted if c.lower() in names]
+    missing = [c for c in wanted if c.lower() not in names]
+    if missing:
+        print(f"[WARNING] Annotation columns not found: {', '.join(missing)}")
+    if not positions:
+        print("[WARNING] None of the requested columns exist; searching all columns.")
+        return None
+    return positions
+
+def main():
+    instrument.start(args)
+    keywords = load_keywords(args.keywords) if args.keywords else HOUSEKEEPING_KEYWORDS
+    keywords_lower = list(dict.fromkeys(kw.lower() for kw in keywords))
+    if not keywords_lower:
+        sys.exit("[ERROR] No housekeeping keywords given.")
+    # One compiled alternation: a row is scanned once, whatever the number of keywords
+    matcher = re.compile("|".join(re.escape(kw) for kw in sorted(keywords_lower, key=len, reverse=True)))
+
+    print("[INFO] Parsing annotations...")
+    columns = search_columns(read_header(args.annotations))
+    usecols = None if columns is None else sorted(set([0] + columns))
+    if columns is not None:
+        print(f"[INFO] Searching {len(keywords_lower)} keywords in columns: {args.columns}")
+
+    hk_ids = set()
+    keyword_counts = dict.fromkeys(keywords_lower, 0)
+    total_rows = 0
+    # EggNOG annotation files often have variable headers. We skip comments ##
+    try:
+        reader = pd.read_csv(args.annotations, sep="\t", comment="#", header=None, dtype=str,
+                             usecols=usecols, chunksize=args.chunksize)
+        with instrument.span("scan_annotations", bytes=os.path.getsize(args.annotations)) as scan_span:
+            for chunk in reader:
+                total_rows += len(chunk)
+                scan_span.add(rows=len(chunk))
+                searched = chunk.columns if columns is None else columns
+                # Same text as joining the row's fields, lowercased
+                text = chunk[searched[0]].fillna("nan")
+                for column in searched[1:]:
+                    text = text + " " + chunk[column].fillna("nan")
+                text = text.str.lower()
+
+                hits = text.str.contains(matcher)
+                # Assuming column 0 is the Query ID (standard for EggNOG)
+                hk_ids.update(chunk.loc[hits, 0].astype(str))
+
+                # Per-keyword counts only look at the rows that matched something
+                hit_text = text[hits]
+                for kw in keywords_lower:
+                    keyword_counts[kw] += int(hit_text.str.contains(kw, regex=False).sum())
+    except pd.errors.EmptyDataError:
+        pass
+    except Exception as e:
+        sys.exit(f"[ERROR] Could not read annotations: {e}")
+
+    print(f"[INFO] Found {len(hk_ids)} sequences matching housekeeping keywords ({total_rows} annotation rows).")
+    for kw, count in sorted(keyword_counts.items(), key=lambda item: -item[1]):
+        if count:
+            print(f"         {kw}: {count}")
+
+    # Write Filtered FASTA (records streamed straight through, wrapped as SeqIO.write does)
+    excluded_count = 0
+
+    with instrument.span("filter_fasta", bytes=os.path.getsize(args.fasta_in)) as filter_span, \
+            FastaWriter(args.fasta_out) as writer:
+        for header, sequence in iter_fasta(args.fasta_in):
+            filter_span.add(rows=1)
+            if record_id(header) not in hk_ids:
+                writer.write(header, sequence)
+            else:
+                excluded_count += 1
+    kept_count = writer.count
+
+    print(f"[SUCCESS] Filtered FASTA saved to {args.fasta_out}")
+    print(f"         Kept: {kept_count} | Removed: {excluded_count}")
+
+if __name__ == "__main__":
+    main()
@@ -3,108 +3,300 @@ import argparse
 import os
 import subprocess
 import sys
-from Bio import SeqIO
+import glob
+import tempfile
+from cpu_budget import run_with_core_budget
+from content_cache import ContentCache, cache_key, files_signature
+from fasta_io import FastaWriter, iter_fasta, record_id
+import instrument
 
 parser = argparse.ArgumentParser(description="Build Phylogenetic Trees for HGT Validation")
 
 parser.add_argument("-i", "--input", required=True, help="Input FASTA file (e.g., hgt_filtered.fasta)")
 parser.add_argument("-db", "--database", required=True, help="Path to local BLAST database (nt or custom combined)")
 parser.add_argument("-o", "--outdir", default="phylogenies", help="Output directory for trees")
-parser.add_argument("-t", "--threads", default=4, help="Number of threads for MAFFT/IQ-TREE")
+parser.add_argument("-t", "--threads", default=4, type=int, help="BLAST threads, and the most threads MAFFT/IQ-TREE get for one candidate")
+parser.add_argument("-c", "--cores", type=int, help="Total core budget shared by the per-candidate MAFFT/trimAl/IQ-TREE workers (default: all cores)")
+parser.add_argument("--seed", default=12345, type=int, help="IQ-TREE random seed (fixed so reruns give the same trees)")
+parser.add_argument("--cache", help="Content-addressed cache of homolog sets, alignments and trees, reused across runs")
+parser.add_argument("--cache_size", default=20, type=float, help="Cache size limit in GB (least recently used entries are evicted)")
 parser.add_argument("--max_hits", default=50, type=int, help="Max homologs to retrieve per candidate")
+parser.add_argument("--batch_size", default=500, type=int,
+                    help="Candidates searched per blastn run (the database is loaded once per run; 1 = one run per candidate)")
+instrument.add_arguments(parser)
 
 args = parser.parse_args()
 
+TOTAL_CORES = args.cores or os.cpu_count() or 1
+# Alignment cells (sequences x longest sequence) handled per MAFFT/IQ-TREE thread
+CELLS_PER_THREAD = 200000
+
+BLAST_OUTFMT = "6 qseqid sseqid sseq"
+MAFFT_OPTIONS = ["--auto"]
+TRIMAL_OPTIONS = ["-automated1"]
+IQTREE_OPTIONS = ["-bb", "1000"]
+
+# Set in main() when --cache is given
+CACHE = None
+
 def check_tool(name):
     from shutil import which
     if which(name) is None:
         sys.exit(f"Error: {name} is not installed or not in your PATH.")
 
-check_tool("mafft")
-check_tool("iqtree")
-check_tool("blastn")
-check_tool("trimal")
+def run_blast_batch(sequences, db_path, threads):
+    """
+    Runs one multi-query blastn for a list of sequences. Queries are renamed
+    q0..qN so their IDs survive BLAST's parsing unchanged.
+    Returns one list of (sseqid, sseq) per sequence, homologs deduplicated by
+    sseqid and capped at --max_hits, in BLAST's order (None if BLAST failed).
+    """
+    # Unique name, so concurrent runs sharing the output directory never mix queries
+    fd, query_path = tempfile.mkstemp(prefix=".blast_batch_", suffix=".fasta", dir=args.outdir)
+    os.close(fd)
+    with FastaWriter(query_path, width=0) as writer:
+        for i, seq in enumerate(sequences):
+            writer.write(f"q{i}", seq)
 
-if not os.path.exists(args.outdir):
-    os.makedirs(args.outdir)
-
-def run_blast_local(query_seq, db_path, out_file, threads):
-    """Runs blastn locally against a specified database."""
     cmd = [
-        "blastn", "-db", db_path, "-query", "-", 
-        "-outfmt", "6 sseqid sseq", 
-        "-max_target_seqs", str(args.max_hits), 
+        "blastn", "-db", db_path, "-query", query_path,
+        "-outfmt", BLAST_OUTFMT,
+        "-max_target_seqs", str(args.max_hits),
         "-num_threads", str(threads)
     ]
-    
-    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    stdout, stderr = process.communicate(input=query_seq)
-    
-    if process.returncode != 0:
-        print(f"Error in BLAST: {stderr}")
-        return []
-    
-    hits = []
-    for line in stdout.strip().split("\n"):
-        if line:
-            parts = line.split("\t")
-            if len(parts) >= 2:
-                hits.append((parts[0], parts[1]))
-    return hits
+
+    hits = [[] for _ in sequences]
+    seen = [set() for _ in sequences]
+    # Output is read as it streams, so memory holds only the kept homologs
+    stderr_file = tempfile.TemporaryFile(mode="w+")
+    try:
+        with instrument.span("tool:blastn") as blast_span:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+            with instrument.watch(process, blast_span):
+                for line in process.stdout:
+                    blast_span.add(rows=1, bytes=len(line))
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) < 3 or not parts[0].startswith("q"):
+                        continue
+                    i = int(parts[0][1:])
+                    h_id, h_seq = parts[1], parts[2]
+                    if h_id not in seen[i] and len(hits[i]) < args.max_hits:
+                        hits[i].append((h_id, h_seq))
+                        seen[i].add(h_id)
+                process.wait()
+            blast_span.returncode = process.returncode
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            print(f"[ERROR] blastn exited with code {process.returncode}: {stderr_file.read().strip()}", file=sys.stderr)
+            return None
+        return hits
+    finally:
+        stderr_file.close()
+        os.remove(query_path)
+
+def homologs_path(candidate_id):
+    return os.path.join(args.outdir, f"{candidate_id}_homologs.fasta")
+
+def no_homologs_path(candidate_id):
+    """Empty marker of a candidate whose search found no homologs."""
+    return os.path.join(args.outdir, f"{candidate_id}.no_homologs")
+
+def treefile_path(candidate_id):
+    return os.path.join(args.outdir, f"{candidate_id}.trimmed.aln.treefile")
+
+def is_newer(path, *inputs):
+    """True if path exists and is at least as recent as every input."""
+    if not os.path.exists(path):
+        return False
+    mtime = os.path.getmtime(path)
+    return all(os.path.exists(p) and mtime >= os.path.getmtime(p) for p in inputs)
+
+def write_homologs(candidate_id, sequence, homologs):
+    """Unaligned FASTA: the candidate followed by its homologs (written atomically, for resuming)."""
+    fasta_path = homologs_path(candidate_id)
+    with FastaWriter(fasta_path, width=0) as writer:
+        # Write Original Candidate
+        writer.write(f"{candidate_id}_CANDIDATE", sequence)
+        # Write Homologs
+        for h_id, h_seq in homologs:
+            writer.write(h_id, h_seq)
+    return fasta_path
+
+def mark_no_homologs(candidate_id):
+    open(no_homologs_path(candidate_id), "w").close()
+
+def homologs_key(sequence, db_identity):
+    """Cache key of a homolog set: sequence, database and search parameters."""
+    return cache_key("homologs", sequence.upper(), db_identity, BLAST_OUTFMT, str(args.max_hits))
+
+def tree_key(candidate_id, threads):
+    """Cache key of a tree: the exact homologs FASTA, names and every tool parameter."""
+    with open(homologs_path(candidate_id), "rb") as f:
+        homologs = f.read()
+    return cache_key("tree", candidate_id, homologs, " ".join(MAFFT_OPTIONS), " ".join(TRIMAL_OPTIONS),
+                     " ".join(IQTREE_OPTIONS), str(args.seed), str(threads))
+
+def encode_homologs(homologs):
+    return "".join(f"{h_id}\t{h_seq}\n" for h_id, h_seq in homologs).encode()
+
+def decode_homologs(data):
+    return [tuple(line.split("\t", 1)) for line in data.decode().splitlines()]
+
+def alignment_cells(fasta_path):
+    """Number of sequences x longest sequence of an unaligned FASTA."""
+    count = longest = length = 0
+    with open(fasta_path) as f:
+        for line in f:
+            if line.startswith(">"):
+                count += 1
+                longest = max(longest, length)
+                length = 0
+            else:
+                length += len(line.strip())
+    return count * max(longest, length)
+
+def threads_for_alignment(cells):
+    """One thread for small alignments, more for large ones, at most --threads."""
+    return max(1, min(args.threads, -(-cells // CELLS_PER_THREAD)))
 
 def run_mafft(input_fasta, output_aln, threads):
-    cmd = ["mafft", "--thread", str(threads), "--auto", input_fasta]
+    cmd = ["mafft", "--thread", str(threads)] + MAFFT_OPTIONS + [input_fasta]
     with open(output_aln, "w") as out_f:
-        subprocess.run(cmd, stdout=out_f, stderr=subprocess.DEVNULL)
+        instrument.run(cmd, stdout=out_f, stderr=subprocess.DEVNULL)
 
 def run_trimal(input_aln, output_trimmed):
     """Trims alignment using automated1 heuristic."""
     # -automated1 is a good general purpose heuristic for trimming
-    cmd = ["trimal", "-in", input_aln, "-out", output_trimmed, "-automated1"]
-    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    cmd = ["trimal", "-in", input_aln, "-out", output_trimmed] + TRIMAL_OPTIONS
+    instrument.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
-def run_iqtree(input_aln, threads):
-    # -bb 1000 = UltraFast Bootstrap
-    cmd = ["iqtree", "-s", input_aln, "-bb", "1000", "-nt", str(threads), "-quiet"]
-    subprocess.run(cmd)
+def run_iqtree(input_aln, threads, redo=False):
+    # -bb 1000 = UltraFast Bootstrap; fixed seed and thread count keep reruns identical
+    cmd = ["iqtree", "-s", input_aln] + IQTREE_OPTIONS + ["-nt", str(threads), "-seed", str(args.seed), "-quiet"]
+    if redo:
+        cmd.append("-redo")
+    instrument.run(cmd, stdout=subprocess.DEVNULL)
+
+def build_tree(candidate_id, threads):
+    """MAFFT -> trimAl -> IQ-TREE for one candidate. Returns a status line."""
+    fasta_path = homologs_path(candidate_id)
+    key = tree_key(candidate_id, threads) if CACHE is not None else None
+    if key is not None and CACHE.restore(key, args.outdir) is not None:
+        return f"    Tree restored from cache: {treefile_path(candidate_id)}"
+    # A tree older than its homologs is stale: IQ-TREE must not reuse its checkpoint
+    redo = os.path.exists(treefile_path(candidate_id))
 
-# Main Execution
-for record in SeqIO.parse(args.input, "fasta"):
-    candidate_id = record.id.replace(":", "_").replace("|", "_")
-    print(f"--> Processing candidate: {candidate_id}")
-    
-    # 1. Fetch Homologs
-    homologs = run_blast_local(str(record.seq), args.database, None, args.threads)
-    
-    if not homologs:
-        print(f"    No homologs found for {candidate_id}. Skipping tree.")
-        continue
-
-    # 2. Create Unaligned Fasta (Candidate + Homologs)
-    fasta_path = os.path.join(args.outdir, f"{candidate_id}_homologs.fasta")
-    with open(fasta_path, "w") as f:
-        # Write Original Candidate
-        f.write(f">{candidate_id}_CANDIDATE\n{str(record.seq)}\n")
-        # Write Homologs
-        seen = set()
-        for h_id, h_seq in homologs:
-            if h_id not in seen:
-                f.write(f">{h_id}\n{h_seq}\n")
-                seen.add(h_id)
-    
     # 3. Align (MAFFT)
     aln_path = os.path.join(args.outdir, f"{candidate_id}.aln")
-    run_mafft(fasta_path, aln_path, args.threads)
-    
+    run_mafft(fasta_path, aln_path, threads)
+
     # 4. Trim (TrimAl)
     trimmed_aln_path = os.path.join(args.outdir, f"{candidate_id}.trimmed.aln")
+    if os.path.exists(trimmed_aln_path):
+        os.remove(trimmed_aln_path)
     run_trimal(aln_path, trimmed_aln_path)
 
     # 5. Tree (IQ-TREE)
     if os.path.exists(trimmed_aln_path):
-        run_iqtree(trimmed_aln_path, args.threads)
-        print(f"    Tree generated: {trimmed_aln_path}.treefile")
-    else:
-        print("    [Error] Trimming failed, tree not generated.")
+        run_iqtree(trimmed_aln_path, threads, redo)
+        if key is not None and os.path.exists(trimmed_aln_path + ".treefile"):
+            # Alignments and every IQ-TREE output (.treefile, .iqtree, .contree, ...)
+            outputs = [aln_path, trimmed_aln_path] + glob.glob(glob.escape(trimmed_aln_path) + ".*")
+            CACHE.put(key, {os.path.basename(path): path for path in outputs})
+        return f"    Tree generated: {trimmed_aln_path}.treefile ({threads} threads)"
+    return "    [Error] Trimming failed, tree not generated."
+
+# Main Execution
+def main():
+    global CACHE
+    instrument.start(args)
+    check_tool("mafft")
+    check_tool("iqtree")
+    check_tool("blastn")
+    check_tool("trimal")
+
+    if not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+
+    candidates = [(record_id(header).replace(":", "_").replace("|", "_"), sequence.decode())
+                  for header, sequence in iter_fasta(args.input)]
+    batch_size = max(1, args.batch_size)
+
+    # Resume: a tree newer than its homologs (themselves newer than the input) is
+    # finished, and homologs (or a no-homologs marker) newer than the input need no new search.
+    finished = {c for c, _ in candidates if is_newer(treefile_path(c), homologs_path(c), args.input)}
+    no_homologs = {c for c, _ in candidates if is_newer(no_homologs_path(c), args.input)}
+    to_search = [(c, seq) for c, seq in candidates
+                 if c not in no_homologs and not is_newer(homologs_path(c), args.input)]
+    to_build = [c for c, _ in candidates if c not in finished and is_newer(homologs_path(c), args.input)]
+    if finished:
+        print(f"[INFO] {len(finished)} candidates already have an up-to-date tree; skipping them.")
+    if no_homologs:
+        print(f"[INFO] {len(no_homologs)} candidates had no homologs in a previous search; skipping them.")
+
+    # Homolog sets already in the cache need no search
+    if args.cache:
+        CACHE = ContentCache(args.cache, int(args.cache_size * 1e9))
+        db_identity = os.path.abspath(args.database) + "\n" + files_signature(glob.escape(args.database) + ".*")
+        keys = {c: homologs_key(seq, db_identity) for c, seq in to_search}
+        missing = []
+        for candidate_id, sequence in to_search:
+            cached = CACHE.read(keys[candidate_id], "homologs.tsv")
+            if cached is None:
+                missing.append((candidate_id, sequence))
+            elif cached:
+                write_homologs(candidate_id, sequence, decode_homologs(cached))
+                to_build.append(candidate_id)
+            else:
+                mark_no_homologs(candidate_id)
+        print(f"[INFO] {len(to_search) - len(missing)} homolog sets found in the cache.")
+        to_search = missing
+
+    # 1-2. Fetch Homologs, one blastn run per batch of candidates
+    failed = 0
+    with instrument.span("homologs", rows=len(to_search)):
+        for start in range(0, len(to_search), batch_size):
+            batch = to_search[start:start + batch_size]
+            print(f"--> Searching homologs for candidates {start + 1}-{start + len(batch)} of {len(to_search)}")
+            results = run_blast_batch([seq for _, seq in batch], args.database, args.threads)
+            if results is None:
+                # Nothing is recorded, so the next run searches these candidates again
+                failed += len(batch)
+                print(f"[ERROR] Homolog search failed for candidates {start + 1}-{start + len(batch)}; "
+                      "no trees built for them.", file=sys.stderr)
+                continue
+
+            for (candidate_id, sequence), homologs in zip(batch, results):
+                if CACHE is not None:
+                    CACHE.put(keys[candidate_id], {"homologs.tsv": encode_homologs(homologs)})
+                if not homologs:
+                    print(f"    No homologs found for {candidate_id}. Skipping tree.")
+                    mark_no_homologs(candidate_id)
+                    continue
+                write_homologs(candidate_id, sequence, homologs)
+                to_build.append(candidate_id)
+
+    # 3-5. Align, trim and build the trees in parallel, largest alignments first,
+    # never running more than TOTAL_CORES threads at once
+    sizes = {c: alignment_cells(homologs_path(c)) for c in to_build}
+    order = sorted(to_build, key=lambda c: (-sizes[c], c))
+    tasks = [(c, threads_for_alignment(sizes[c])) for c in order]
+    print(f"[INFO] Building {len(tasks)} trees on {TOTAL_CORES} cores...")
+    with instrument.span("trees", rows=len(tasks)):
+        for candidate_id, status, error in run_with_core_budget(tasks, TOTAL_CORES, build_tree):
+            print(f"--> Processing candidate: {candidate_id}")
+            print(status if error is None else f"    [Error] {error}")
+
+    if failed:
+        print(f"[WARNING] {failed} candidates could not be searched; rerun the same command to retry them.",
+              file=sys.stderr)
+
+    if CACHE is not None:
+        removed, freed = CACHE.prune()
+        if removed:
+            print(f"[INFO] Cache: evicted {removed} least recently used entries ({freed / 1e9:.2f} GB)")
+
+    print("Done. Trees are in", args.outdir)
 
-print("Done. Trees are in", args.outdir)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent EggNOG-mapper annotation store, so 7-cluster_and_annotate_candidates.sh
+only annotates cluster representatives it has never seen.
+
+Rows are kept in an SQLite database keyed by the hash of the representative's
+sequence and by the emapper settings (database, taxonomic scope, mode), so a
+renamed representative still hits and a changed setting never reuses old rows.
+Sequences that emapper could not annotate are stored too (without a row) and
+are not sent again.
+
+    python annotation_cache.py select --fasta ht_clusters.fasta --db ht_annotations.sqlite --settings "$S" --new ht_new_reps.fasta
+    emapper.py -i ht_new_reps.fasta --output ht_new_annotations ...
+    python annotation_cache.py merge  --fasta ht_clusters.fasta --db ht_annotations.sqlite --settings "$S" \\
+        --new ht_new_reps.fasta --new_annotations ht_new_annotations.emapper.annotations \\
+        --output ht_annotations.emapper.annotations
+"""
+import os
+import sys
+import sqlite3
+import argparse
+from content_cache import cache_key
+from fasta_io import format_record, iter_fasta, record_id
+import instrument
+
+LOOKUP_BATCH = 500
+
+def sequence_hash(sequence):
+    """Key of a sequence (bytes), independent of its header and letter case."""
+    return cache_key(sequence.upper())
+
+def read_representatives(fasta_path):
+    """[(record id, header, sequence, hash)] in file order."""
+    return [(record_id(header), header, sequence, sequence_hash(sequence))
+            for header, sequence in iter_fasta(fasta_path)]
+
+def read_emapper(path):
+    """
+    (header lines, {query: row}) of an .emapper.annotations file. The header is
+    every '#' line before the first row (ending with '#query ...'); the row is
+    the line without its query field.
+    """
+    header, rows = [], {}
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                if not rows:
+                    header.append(line.rstrip("\n"))
+                continue
+            if not line.strip():
+                continue
+            query, _, rest = line.rstrip("\n").partition("\t")
+            rows[query] = rest
+    return header, rows
+
+# ─── STORE ──────────────────────────────────────────────────────────────────────
+class AnnotationStore:
+    """SQLite table of (sequence hash, settings) -> emapper row (None = no annotation)."""
+
+    def __init__(self, db_path, settings):
+        self.settings = settings
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS annotations (
+                seq_hash TEXT NOT NULL, settings TEXT NOT NULL, row TEXT,
+                PRIMARY KEY (seq_hash, settings));
+            CREATE TABLE IF NOT EXISTS headers (
+                settings TEXT PRIMARY KEY, header TEXT NOT NULL);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, hashes):
+        """{hash: row or None} for the hashes already in the store."""
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        for i in range(0, len(hashes), LOOKUP_BATCH):
+            batch = hashes[i:i + LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            found.update(self.conn.execute(
+                f"SELECT seq_hash, row FROM annotations WHERE settings = ? AND seq_hash IN ({placeholders})",
+                [self.settings] + batch))
+        return found
+
+    def add(self, rows):
+        """Stores {hash: row or None}, replacing earlier rows of the same sequences."""
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)",
+                                  ((h, self.settings, row) for h, row in rows.items()))
+
+    def header(self):
+        found = self.conn.execute("SELECT header FROM headers WHERE settings = ?", (self.settings,)).fetchone()
+        return found[0].split("\n") if found else []
+
+    def set_header(self, lines):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO headers VALUES (?, ?)", (self.settings, "\n".join(lines)))
+
+# ─── COMMANDS ───────────────────────────────────────────────────────────────────
+def select(store, fasta_path, new_path):
+    """Writes the representatives missing from the store (one per distinct sequence). Returns their number."""
+    with instrument.span("read_representatives", bytes=os.path.getsize(fasta_path)) as read_span:
+        representatives = read_representatives(fasta_path)
+        read_span.add(rows=len(representatives))
+    with instrument.span("lookup", rows=len(representatives)):
+        known = store.lookup(h for _, _, _, h in representatives)
+    written = set()
+    with open(new_path + ".tmp", "wb") as out:
+        for _, header, sequence, h in representatives:
+            if h not in known and h not in written:
+                out.write(format_record(header, sequence))
+                written.add(h)
+    os.replace(new_path + ".tmp", new_path)
+    print(f"[INFO] {len(representatives)} representatives: {len(representatives) - len(written)} cached, "
+          f"{len(written)} new")
+    return len(written)
+
+def merge(store, fasta_path, output_path, new_path=None, new_annotations=None):
+    """
+    Adds the rows of a new emapper run to the store, then writes the annotations
+    of every representative in fasta_path. Returns (rows written, representatives missing from the store).
+    """
+    if new_path:
+        sent = read_representatives(new_path)
+        header, rows = read_emapper(new_annotations) if new_annotations and os.path.exists(new_annotations) else ([], {})
+        if sent and not header and not rows:
+            print("[WARNING] No EggNOG-mapper output for the new representatives; they stay uncached.")
+        elif sent:
+            with instrument.span("store_new", rows=len(sent)):
+                store.add({h: rows.get(rid) for rid, _, _, h in sent})
+            if header:
+                store.set_header(header)
+            print(f"[INFO] Cached {len(sent)} new representatives ({sum(1 for rid, _, _, _ in sent if rid in rows)} annotated)")
+
+    with instrument.span("read_representatives", bytes=os.path.getsize(fasta_path)) as read_span:
+        representatives = read_representatives(fasta_path)
+        read_span.add(rows=len(representatives))
+    with instrument.span("lookup", rows=len(representatives)):
+        known = store.lookup(h for _, _, _, h in representatives)
+    written = missing = 0
+    with open(output_path + ".tmp", "w") as out:
+        for line in store.header():
+            out.write(line + "\n")
+        for rid, _, _, h in representatives:
+            if h not in known:
+                missing += 1
+            elif known[h] is not None:
+                out.write(f"{rid}\t{known[h]}\n")
+                written += 1
+    os.replace(output_path + ".tmp", output_path)
+    return written, missing
+
+# ─── COMMAND LINE ───────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache EggNOG-mapper annotations by sequence across runs.")
+    instrument.add_arguments(parser)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_select = sub.add_parser("select", help="Write the representatives that still need annotating")
+    p_merge = sub.add_parser("merge", help="Store a new emapper run and write the merged annotations")
+    for p in (p_select, p_merge):
+        p.add_argument("--fasta", required=True, help="Cluster representatives (ht_clusters.fasta)")
+        p.add_argument("--db", default="ht_annotations.sqlite", help="Annotation store (SQLite)")
+        p.add_argument("--settings", default="", help="emapper settings the rows depend on (database, scope, mode)")
+    p_select.add_argument("--new", required=True, help="FASTA of the representatives to annotate")
+    p_merge.add_argument("--new", help="FASTA given to emapper by 'select'")
+    p_merge.add_argument("--new_annotations", help="emapper output for --new (.emapper.annotations)")
+    p_merge.add_argument("--output", default="ht_annotations.emapper.annotations", help="Merged annotations for every representative")
+
+    args = parser.parse_args()
+    instrument.start(args, name=f"annotation_cache_{args.command}")
+    if not os.path.exists(args.fasta):
+        sys.exit(f"[ERROR] FASTA not found: {args.fasta}")
+    with AnnotationStore(args.db, args.settings) as store:
+        if args.command == "select":
+            select(store, args.fasta, args.new)
+        else:
+            written, missing = merge(store, args.fasta, args.output, args.new, args.new_annotations)
+            if missing:
+                print(f"[WARNING] {missing} representatives have no cached annotation run; run 'select' and emapper first.")
+            print(f"[SUCCESS] {written} annotation rows saved to {args.output}")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark of fasta_io against Biopython on a synthetic genome: full parse
+(SeqIO.parse vs iter_fasta), writing (SeqIO.write vs FastaWriter) and random
+scaffold access (SeqIO.index vs FastaIndex on the plain and bgzipped genome).
+
+Every fasta_io result is checked against Biopython's: same records, same
+written bytes, same fetched sequences.
+
+    python benchmarks/bench_fasta_io.py --scaffolds 20000 --mean_length 50000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from Bio import SeqIO, bgzf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fasta_io import FastaIndex, FastaWriter, build_fai, ensure_fai, iter_fasta
+
+parser = argparse.ArgumentParser(description="Benchmark fasta_io against Biopython SeqIO.")
+parser.add_argument("--scaffolds", type=int, default=20000, help="Scaffolds in the synthetic genome")
+parser.add_argument("--mean_length", type=int, default=50000, help="Mean scaffold length (bp)")
+parser.add_argument("--fetches", type=int, default=2000, help="Random scaffolds fetched in the access test")
+parser.add_argument("--seed", type=int, default=1)
+parser.add_argument("--workdir", help="Keep the synthetic files here instead of a temporary directory")
+args = parser.parse_args()
+
+def make_genome(path):
+    rng = random.Random(args.seed)
+    # One random block reused at shifting offsets keeps generation fast
+    block = "".join(rng.choice("ACGTacgtN") for _ in range(1 << 16)) * 4
+    with open(path, "w") as f:
+        for i in range(args.scaffolds):
+            length = max(1, int(rng.expovariate(1 / args.mean_length)))
+            start = rng.randrange(len(block) // 2)
+            seq = (block[start:] * (length // (len(block) - start) + 1))[:length]
+            f.write(f">scaffold_{i} len={length}\n")
+            for j in range(0, length, 60):
+                f.write(seq[j:j + 60] + "\n")
+
+def timed(label, size, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed:8.2f} s  {size / 1e6 / elapsed:8.1f} MB/s")
+    return result, elapsed
+
+def run_benchmark(workdir):
+    genome = os.path.join(workdir, "genome.fasta")
+    genome_gz = genome + ".gz"
+    if not os.path.exists(genome):
+        print(f"[INFO] Writing synthetic genome ({args.scaffolds} scaffolds) to {genome}...")
+        make_genome(genome)
+    if not os.path.exists(genome_gz):
+        with open(genome, "rb") as src, bgzf.BgzfWriter(genome_gz, "wb") as out:
+            while True:
+                data = src.read(1 << 22)
+                if not data:
+                    break
+                out.write(data)
+    size = os.path.getsize(genome)
+    print(f"[INFO] Genome: {size / 1e6:.1f} MB plain, {os.path.getsize(genome_gz) / 1e6:.1f} MB bgzipped")
+
+    print("[INFO] Full parse")
+    biopython, t_bio = timed("SeqIO.parse", size, lambda: [(r.description, str(r.seq)) for r in SeqIO.parse(genome, "fasta")])
+    raw, t_raw = timed("fasta_io.iter_fasta", size, lambda: list(iter_fasta(genome)))
+    raw_gz, _ = timed("fasta_io.iter_fasta (bgzip)", size, lambda: list(iter_fasta(genome_gz)))
+    assert raw == raw_gz, "bgzip records differ from the plain genome's"
+    assert biopython == [(h.decode(), s.decode()) for h, s in raw], "iter_fasta records differ from SeqIO.parse"
+    print(f"  -> {t_bio / t_raw:.1f}x faster, identical records")
+    del biopython, raw, raw_gz
+
+    print("[INFO] Writing")
+    out_bio = os.path.join(workdir, "written_seqio.fasta")
+    out_raw = os.path.join(workdir, "written_fasta_io.fasta")
+    _, t_bio = timed("SeqIO.write", size, lambda: SeqIO.write(SeqIO.parse(genome, "fasta"), out_bio, "fasta"))
+
+    def write_raw():
+        with FastaWriter(out_raw) as writer:
+            for header, sequence in iter_fasta(genome):
+                writer.write(header, sequence)
+    _, t_raw = timed("FastaWriter", size, write_raw)
+    with open(out_bio, "rb") as a, open(out_raw, "rb") as b:
+        assert a.read() == b.read(), "FastaWriter output differs from SeqIO.write"
+    print(f"  -> {t_bio / t_raw:.1f}x faster, identical output")
+
+    print(f"[INFO] Random access ({args.fetches} scaffolds)")
+    rng = random.Random(args.seed)
+    names = [f"scaffold_{rng.randrange(args.scaffolds)}" for _ in range(args.fetches)]
+    build_fai(genome, genome + ".fai")
+    ensure_fai(genome_gz, cache_dir=workdir)
+
+    def fetch_bio():
+        index = SeqIO.index(genome, "fasta")
+        fetched = [str(index[name].seq) for name in names]
+        index.close()
+        return fetched
+
+    def fetch_raw(path):
+        with FastaIndex(path, os.path.join(workdir, os.path.basename(path) + ".fai")) as index:
+            return [index.fetch(name).decode() for name in names]
+
+    fetched_bio, t_bio = timed("SeqIO.index", size, fetch_bio)
+    fetched_raw, t_raw = timed("FastaIndex", size, lambda: fetch_raw(genome))
+    fetched_gz, t_gz = timed("FastaIndex (bgzip)", size, lambda: fetch_raw(genome_gz))
+    assert fetched_bio == fetched_raw == fetched_gz, "FastaIndex sequences differ from SeqIO.index"
+    print(f"  -> {t_bio / t_raw:.1f}x faster (plain), {t_bio / t_gz:.1f}x faster (bgzip), identical sequences")
+
+    print("[SUCCESS] All fasta_io results match Biopython.")
+
+def main():
+    # The synthetic files are only kept when --workdir is given
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        run_benchmark(args.workdir)
+        return
+    with tempfile.TemporaryDirectory(prefix="bench_fasta_io_") as workdir:
+        run_benchmark(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark of 5-CompareBlastResults.py: legacy sort/apply engine vs the
+vectorized groupby engine on synthetic Script 2 / Script 4 tables.
+
+Both engines run as separate processes on the same inputs; the wall times are
+reported and the two output tables are checked to be byte-identical. The
+scores are integers in a narrow range, so most candidates have tied best hits.
+
+    python benchmarks/bench_ht_index.py --plant_rows 10000000 --fungi_rows 2000000
+"""
+import os
+import sys
+import time
+import argparse
+import filecmp
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "5-CompareBlastResults.py")
+
+parser = argparse.ArgumentParser(description="Benchmark the HT index computation of Script 5.")
+parser.add_argument("--plant_rows", type=int, default=10_000_000, help="Rows in the synthetic plant table (Script 4 output)")
+parser.add_argument("--fungi_rows", type=int, default=2_000_000, help="Rows in the synthetic fungi table (Script 2 output)")
+parser.add_argument("--candidates", type=int, default=500_000, help="Distinct qseqids")
+parser.add_argument("--seed", type=int, default=1)
+parser.add_argument("--workdir", help="Keep inputs/outputs here instead of a temporary directory")
+args = parser.parse_args()
+
+def make_tables(directory):
+    rng = np.random.default_rng(args.seed)
+    ids = np.array([f"scaffold_{i}" for i in range(args.candidates)], dtype=object)
+
+    n = args.fungi_rows
+    fungi = pd.DataFrame({
+        "qseqid": ids[rng.integers(0, args.candidates, n)],
+        "sseqid": ids[rng.integers(0, args.candidates, n)],
+        "pident": rng.integers(80000, 100001, n) / 1000,
+        "length": rng.integers(500, 20000, n),
+        "mismatch": rng.integers(0, 100, n),
+        "gapopen": rng.integers(0, 10, n),
+        "qstart": rng.integers(1, 10**6, n),
+        "qend": rng.integers(1, 10**6, n),
+        "sstart": rng.integers(1, 10**8, n),
+        "send": rng.integers(1, 10**8, n),
+        "evalue": rng.choice([0.0, 1e-200, 1e-100], n),
+        # Integer scores in a narrow range: many ties, which both engines must break the same way
+        "bitscore": rng.integers(900, 1200, n),
+        "fungi_genome": np.array([f"fungus_{i}.fasta" for i in range(1000)])[rng.integers(0, 1000, n)],
+    })
+    n = args.plant_rows
+    plant = pd.DataFrame({
+        "qseqid": ids[rng.integers(0, args.candidates, n)],
+        "sseqid": ids[rng.integers(0, args.candidates, n)],
+        "pident": rng.integers(70000, 100001, n) / 1000,
+        "length": rng.integers(100, 20000, n),
+        "evalue": rng.choice([1e-30, 1e-20], n),
+        "bitscore": rng.integers(100, 1200, n),
+        "plant_genome": np.array([f"plant_{i}.fasta" for i in range(400)])[rng.integers(0, 400, n)],
+    })
+    fungi_path = os.path.join(directory, "fungi.tsv")
+    plant_path = os.path.join(directory, "plant.tsv")
+    fungi.to_csv(fungi_path, sep="\t", index=False)
+    plant.to_csv(plant_path, sep="\t", index=False)
+    return fungi_path, plant_path
+
+def run_engine(engine, fungi_path, plant_path, directory):
+    output = os.path.join(directory, f"comparison_{engine}.tsv")
+    candidates = os.path.join(directory, f"candidates_{engine}.tsv")
+    cmd = [sys.executable, SCRIPT, "--fungi_results", fungi_path, "--plant_results", plant_path,
+           "--output", output, "--candidates_out", candidates, "--engine", engine]
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start, output, candidates
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.workdir or tmp
+        os.makedirs(directory, exist_ok=True)
+
+        print(f"[INFO] Generating {args.fungi_rows:,} fungi rows and {args.plant_rows:,} plant rows...")
+        fungi_path, plant_path = make_tables(directory)
+
+        results = {}
+        for engine in ("legacy", "vectorized"):
+            print(f"[INFO] Running {engine} engine...")
+            results[engine] = run_engine(engine, fungi_path, plant_path, directory)
+            print(f"       {results[engine][0]:.1f}s")
+
+        identical = all(filecmp.cmp(a, b, shallow=False) for a, b in zip(results["legacy"][1:], results["vectorized"][1:]))
+        legacy_time, vectorized_time = results["legacy"][0], results["vectorized"][0]
+        total_rows = args.fungi_rows + args.plant_rows
+        print(f"[RESULT] rows={total_rows:,} legacy={legacy_time:.1f}s vectorized={vectorized_time:.1f}s "
+              f"speedup={legacy_time / vectorized_time:.1f}x identical_output={identical}")
+        if not identical:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
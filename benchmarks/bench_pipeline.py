@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the pipeline's Python stages on synthetic data (synthetic.py):
+Scripts 2, 3, 5, 6 and 8 on generated genomes, BLAST tables and annotations,
+and Scripts 4 and 9 with stand-in tools (stub_tools.py) that sleep in
+proportion to their work, so only the scheduling of the BLAST / MAFFT /
+IQ-TREE jobs under the core budget is measured.
+
+Every script runs as its own process with --report (instrument.py). The
+results give its wall time, peak RSS and the rows and rows/s of its main
+phase; for Scripts 4 and 9 also the mean number of tools running at once.
+The peak RSS is the VmHWM of the script's own process, sampled from /proc by
+this harness (worker processes and tools are not included; the report's
+figure is used where /proc does not exist).
+
+    python benchmarks/bench_pipeline.py --workdir bench --plant_genomes 20 --blast_rows 100000 --output results.json
+    python instrument.py compare old_bench/reports/2.json bench/reports/2.json
+"""
+import os
+import sys
+import csv
+import json
+import glob
+import time
+import shutil
+import argparse
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+import synthetic
+import instrument
+
+STUB_TOOLS = ["makeblastdb", "blastn", "mafft", "trimal", "iqtree"]
+
+parser = argparse.ArgumentParser(description="Benchmark the pipeline scripts on synthetic data.")
+parser.add_argument("--workdir", default="bench", help="Data (data/), script outputs (run/) and reports (reports/)")
+parser.add_argument("--steps", default="2,3,4,5,6,8,9", help="Scripts to run, in order (3 and 5 need the output of 2, 4 that of 3)")
+parser.add_argument("-j", "--jobs", type=int, default=4, help="Worker processes of Scripts 2, 3 and 6; parallel genomes of Script 4")
+parser.add_argument("-c", "--cores", type=int, default=8, help="Core budget of Scripts 4 and 9")
+parser.add_argument("-t", "--threads", type=int, default=4, help="Threads per BLAST job (Script 4), most per tree (Script 9)")
+parser.add_argument("--stub_scale", type=float, default=0.01, help="Seconds per work unit of the stand-in tools (see stub_tools.py)")
+parser.add_argument("--output", help="Also write the results table (.json or .csv)")
+synthetic.add_arguments(parser)
+args = parser.parse_args()
+
+# ─── STEPS ──────────────────────────────────────────────────────────────────────
+# Per step: script, main phase (span) of its report, tool spans measured for concurrency,
+# outputs removed before it runs (so resumable scripts redo their work)
+STEPS = {
+    "2": ("2-filter_blast_results.py", "filter", None, ["filtered_blast_results_with_fungi.tsv", "scaffold_index"]),
+    "3": ("3-extractfasta.py", "extract", None, ["selected_sequences"]),
+    "4": ("4-FindNonUbiquitousSequences.py", "blast", "tool:blastn",
+          ["plant_blast_outputs", "all_candidates_query.fasta", "plant_alignment_results.tsv", "plant_genomes"]),
+    "5": ("5-CompareBlastResults.py", "best_hits", None, ["fungi_vs_plant_comparison.tsv", "ht_candidates.tsv"]),
+    "6": ("6-extractHTcandidates.py", "extract", None, ["ht_candidates.fasta", ".fai_cache"]),
+    "8": ("8-filteringhousekeeping.py", "scan_annotations", None, ["hgt_filtered.fasta"]),
+    "9": ("9-build_phylogenies.py", "trees", "tool:", ["phylogenies"]),
+}
+NEEDS = {"3": "filtered_blast_results_with_fungi.tsv", "4": "selected_sequences", "5": "filtered_blast_results_with_fungi.tsv"}
+
+def command(step, paths):
+    """Command line of one step, run from the run directory."""
+    if step == "2":
+        return ["--blast_dir", paths["blast_dir"], "--fungi_fai", paths["fungi_fai"], "--plant_fai", paths["plant_fai"],
+                "-j", str(args.jobs)]
+    if step == "3":
+        return ["-p", paths["plant_genomes"], "--fai_dir", paths["plant_fai"], "-j", str(args.jobs)]
+    if step == "4":
+        return ["-s", "selected_sequences", "-p", "plant_genomes", "-j", str(args.jobs), "-t", str(args.threads),
+                "-c", str(args.cores)]
+    if step == "5":
+        return ["--fungi_results", "filtered_blast_results_with_fungi.tsv", "--plant_results", paths["plant_table"]]
+    if step == "6":
+        return ["-i", paths["candidates"], "-g", paths["fungi_genomes"], "--fai_dir", paths["fungi_fai"], "-j", str(args.jobs)]
+    if step == "8":
+        return ["--annotations", paths["annotations"], "--fasta_in", paths["clusters"], "--fasta_out", "hgt_filtered.fasta"]
+    if step == "9":
+        # The stand-in blastn needs no database files
+        return ["-i", paths["tree_queries"], "-db", os.path.join(os.path.dirname(paths["blast_dir"]), "nt"), "-o", "phylogenies",
+                "-t", str(args.threads), "-c", str(args.cores)]
+
+def prepare(step, paths):
+    """Removes the step's previous outputs; Script 4 gets fresh links to the plant genomes (no BLAST DBs)."""
+    for path in STEPS[step][3]:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    if step == "4":
+        os.makedirs("plant_genomes")
+        for genome in glob.glob(os.path.join(paths["plant_genomes"], "*.fasta")):
+            os.symlink(genome, os.path.join("plant_genomes", os.path.basename(genome)))
+
+def make_stub_bin(directory):
+    """Directory of links named after the tools, all pointing to stub_tools.py."""
+    os.makedirs(directory, exist_ok=True)
+    for tool in STUB_TOOLS:
+        link = os.path.join(directory, tool)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(BENCH_DIR, "stub_tools.py"), link)
+    return directory
+
+def run_step(cmd, log, env):
+    """
+    Runs one step, polling the VmHWM of its process (ru_maxrss would start from
+    this harness's own peak). Returns (exit code, peak RSS in MB or None).
+    """
+    process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+    peak_kb = 0
+    while process.poll() is None:
+        peak_kb = max(peak_kb, instrument.status_kb(process.pid, "VmHWM") or 0)
+        time.sleep(instrument.POLL_INTERVAL)
+    return process.returncode, round(peak_kb / 1024, 1) if peak_kb else None
+
+def result_of(step, report_path, wall, peak_rss):
+    """One row of the results table from a step's report and its measured peak RSS."""
+    with open(report_path) as f:
+        report = json.load(f)
+    _, main_span, tool_prefix, _ = STEPS[step]
+    summary = {s["name"]: s for s in report["summary"]}
+    main = summary.get(main_span, {"wall_s": 0, "rows": 0, "rows_per_s": 0})
+    row = {
+        "step": step, "script": report["script"], "wall_s": round(wall, 3),
+        "peak_rss_mb": report["peak_rss_mb"] if peak_rss is None else peak_rss, "phase": main_span, "phase_s": main["wall_s"],
+        "rows": main["rows"], "rows_per_s": main["rows_per_s"], "concurrency": "",
+    }
+    if tool_prefix and main["wall_s"] > 0:
+        # Mean number of tools running at once during the main phase
+        tool_time = sum(s["wall_s"] for s in report["spans"] if s["name"].startswith(tool_prefix))
+        row["concurrency"] = round(tool_time / main["wall_s"], 2)
+    return row
+
+# ─── MAIN ───────────────────────────────────────────────────────────────────────
+def main():
+    steps = [s.strip() for s in args.steps.split(",") if s.strip()]
+    unknown = [s for s in steps if s not in STEPS]
+    if unknown:
+        sys.exit(f"[ERROR] Unknown steps: {', '.join(unknown)} (choose from {', '.join(STEPS)})")
+
+    workdir = os.path.abspath(args.workdir)
+    output = os.path.abspath(args.output) if args.output else None
+    manifest = synthetic.generate(os.path.join(workdir, "data"), {name: getattr(args, name) for name in synthetic.SETTINGS})
+    paths = manifest["paths"]
+    run_dir = os.path.join(workdir, "run")
+    report_dir = os.path.join(workdir, "reports")
+    os.makedirs(run_dir, exist_ok=True)
+    os.makedirs(report_dir, exist_ok=True)
+    env = dict(os.environ, BENCH_STUB_SCALE=str(args.stub_scale),
+               PATH=make_stub_bin(os.path.join(workdir, "bin")) + os.pathsep + os.environ.get("PATH", ""))
+    env.pop("HT_REPORT_DIR", None)
+    os.chdir(run_dir)
+
+    results = []
+    for step in steps:
+        if step in NEEDS and not os.path.exists(NEEDS[step]):
+            sys.exit(f"[ERROR] Step {step} needs {NEEDS[step]} from an earlier step; include it in --steps.")
+        prepare(step, paths)
+        report_path = os.path.join(report_dir, f"{step}.json")
+        cmd = [sys.executable, os.path.join(REPO_DIR, STEPS[step][0])] + command(step, paths) + ["--report", report_path]
+        print(f"[INFO] Step {step}: {STEPS[step][0]}")
+        start = time.perf_counter()
+        with open(os.path.join(report_dir, f"{step}.log"), "w") as log:
+            returncode, peak_rss = run_step(cmd, log, env)
+        wall = time.perf_counter() - start
+        if returncode != 0:
+            sys.exit(f"[ERROR] Step {step} failed (exit code {returncode}), see {report_dir}/{step}.log")
+        results.append(result_of(step, report_path, wall, peak_rss))
+
+    columns = ["step", "script", "wall_s", "peak_rss_mb", "phase", "phase_s", "rows", "rows_per_s", "concurrency"]
+    print(f"\n{'step':<5}{'script':<34}{'wall s':>9}{'RSS MB':>9}  {'phase':<18}{'rows':>12}{'rows/s':>12}{'conc.':>7}")
+    for r in results:
+        print(f"{r['step']:<5}{r['script']:<34}{r['wall_s']:>9.2f}{r['peak_rss_mb']:>9.1f}  {r['phase']:<18}"
+              f"{r['rows']:>12,}{r['rows_per_s']:>12,.0f}{str(r['concurrency']):>7}")
+
+    if output:
+        if output.endswith(".csv"):
+            with open(output, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(results)
+        else:
+            with open(output, "w") as f:
+                json.dump({"settings": manifest["settings"], "jobs": args.jobs, "cores": args.cores,
+                           "threads": args.threads, "stub_scale": args.stub_scale, "results": results}, f, indent=1)
+        print(f"[SUCCESS] Results saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Stand-ins for the external tools of Scripts 4 and 9 (makeblastdb, blastn,
+mafft, trimal, iqtree), so their scheduling can be benchmarked without the
+tools or real data. bench_pipeline.py links each tool name to this file; the
+name it is called by selects the tool.
+
+Each stub writes output in the real tool's format (deterministic hits derived
+from the sequences) and sleeps for a time proportional to its work divided by
+its thread count, i.e. perfect thread scaling:
+    makeblastdb  database MB
+    blastn       query MB x database MB (100 MB for a database that is not a FASTA)
+    mafft        alignment Mcells (sequences x longest) x 10
+    iqtree       alignment Mcells x 50
+in units of BENCH_STUB_SCALE seconds (default 0.01). trimAl is not timed.
+"""
+import os
+import sys
+import time
+import shutil
+import zlib
+
+SCALE = float(os.environ.get("BENCH_STUB_SCALE", "0.01"))
+NT_MB = 100
+
+def options(argv):
+    """{flag: value} of '-flag value' pairs (flags without a value map to None)."""
+    found = {}
+    i = 0
+    while i < len(argv):
+        if argv[i].startswith("-"):
+            value = argv[i + 1] if i + 1 < len(argv) and not argv[i + 1].startswith("-") else None
+            found[argv[i]] = value
+            i += 2 if value is not None else 1
+        else:
+            i += 1
+    return found
+
+def read_fasta(path):
+    """[(id, sequence)] of a FASTA file."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                records.append([line[1:].split()[0], []])
+            elif records:
+                records[-1][1].append(line.strip())
+    return [(name, "".join(parts)) for name, parts in records]
+
+def work(units, threads=1):
+    time.sleep(SCALE * units / max(1, threads))
+
+def mb(path):
+    return os.path.getsize(path) / 1e6 if os.path.exists(path) else NT_MB
+
+# ─── TOOLS ──────────────────────────────────────────────────────────────────────
+def makeblastdb(opts):
+    source, out = opts["-in"], opts["-out"]
+    work(mb(source))
+    # .nsq holds 2 bits per base: its size is what Script 4 scales threads by
+    with open(out + ".nsq", "wb") as f:
+        f.truncate(os.path.getsize(source) // 4)
+    open(out + ".nin", "w").close()
+
+def blastn(opts):
+    db, query = opts["-db"], opts["-query"]
+    fields = opts["-outfmt"].split()[1:] if opts.get("-outfmt") else \
+        "qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore".split()
+    max_hits = int(opts.get("-max_target_seqs") or 5)
+    db_name = os.path.basename(db)
+    records = read_fasta(query)
+    work(mb(query) * mb(db), int(opts.get("-num_threads") or 1))
+
+    out = open(opts["-out"], "w") if opts.get("-out") else sys.stdout
+    for qid, seq in records:
+        h = zlib.crc32((seq[:200] + db_name).encode())
+        # Every query hits itself-like sequences; how many depends on the pair
+        for k in range(2 + h % max(1, max_hits - 1)):
+            length = min(len(seq), 100 + (h >> 8) % 2000)
+            homolog = seq[k:k + length] or seq
+            values = {
+                "qseqid": qid, "sseqid": f"{db_name}_s{(h >> 4) % 997 + k}", "pident": f"{80 + (h >> 12) % 20}.{k % 10}",
+                "length": str(length), "mismatch": "0", "gapopen": "0", "qstart": str(k + 1), "qend": str(k + length),
+                "sstart": "1", "send": str(length), "evalue": "1e-50", "bitscore": str(200 + (h >> 16) % 3000 - k),
+                "sseq": homolog,
+            }
+            out.write("\t".join(values[f] for f in fields) + "\n")
+    if out is not sys.stdout:
+        out.close()
+
+def alignment_mcells(path):
+    records = read_fasta(path)
+    return len(records) * max((len(s) for _, s in records), default=0) / 1e6
+
+def mafft(argv):
+    source = argv[-1]
+    threads = int(options(argv).get("--thread") or 1)
+    work(alignment_mcells(source) * 10, threads)
+    with open(source) as f:
+        shutil.copyfileobj(f, sys.stdout)
+
+def trimal(opts):
+    shutil.copyfile(opts["-in"], opts["-out"])
+
+def iqtree(opts):
+    source = opts["-s"]
+    work(alignment_mcells(source) * 50, int(opts.get("-nt") or 1))
+    names = [name for name, _ in read_fasta(source)]
+    with open(source + ".treefile", "w") as f:
+        f.write("(" + ",".join(f"{name}:0.1" for name in names) + ");\n")
+    with open(source + ".iqtree", "w") as f:
+        f.write(f"IQ-TREE stand-in: {len(names)} sequences\n")
+
+if __name__ == "__main__":
+    tool = os.path.basename(sys.argv[0])
+    argv = sys.argv[1:]
+    if tool == "makeblastdb":
+        makeblastdb(options(argv))
+    elif tool == "blastn":
+        blastn(options(argv))
+    elif tool == "mafft":
+        mafft(argv)
+    elif tool == "trimal":
+        trimal(options(argv))
+    elif tool == "iqtree":
+        iqtree(options(argv))
+    else:
+        sys.exit(f"[ERROR] No stand-in for '{tool}'")
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Synthetic inputs for the pipeline benchmarks: genomes with their .fai files,
+hs-blastn '<plant>_VS_<fungus>.blast' files (Script 1 output), a plant BLAST
+table (Script 4 output), an HT candidate table (Script 5 output), candidate
+FASTAs and an EggNOG-mapper annotation table.
+
+Everything is drawn from one seed, so the same settings give the same files.
+IDs are consistent across the files: BLAST hits name scaffolds of the genomes
+they were "aligned" against, candidates name scaffolds of the fungal genomes.
+
+    python benchmarks/synthetic.py --outdir bench_data --plant_genomes 6 --fungi_genomes 4 --blast_rows 20000
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fasta_io import FastaWriter, build_fai
+from blast_filter import COLUMNS
+
+ANNOTATION_COLUMNS = [
+    "query", "seed_ortholog", "evalue", "score", "eggNOG_OGs", "max_annot_lvl", "COG_category",
+    "Description", "Preferred_name", "GOs", "EC", "KEGG_ko", "KEGG_Pathway", "KEGG_Module",
+    "KEGG_Reaction", "KEGG_rclass", "BRITE", "KEGG_TC", "CAZy", "BiGG_Reaction", "PFAMs"
+]
+# A few descriptions hit the housekeeping keywords of Script 8, most do not
+DESCRIPTIONS = [
+    "hypothetical protein", "transposase", "glycoside hydrolase family 28", "pectate lyase",
+    "cutinase", "major facilitator superfamily transporter", "60S ribosomal protein L7",
+    "heat shock protein 70", "serine/threonine-protein kinase", "cytochrome P450 monooxygenase",
+    "NAD dependent epimerase", "alpha/beta hydrolase fold", "zinc finger C2H2 type", "-",
+]
+
+# ─── SETTINGS ───────────────────────────────────────────────────────────────────
+def add_arguments(parser):
+    """Scale options shared by this generator and bench_pipeline.py."""
+    group = parser.add_argument_group("synthetic data")
+    group.add_argument("--plant_genomes", type=int, default=6, help="Plant genomes")
+    group.add_argument("--fungi_genomes", type=int, default=4, help="Fungal genomes")
+    group.add_argument("--scaffolds", type=int, default=500, help="Scaffolds per genome")
+    group.add_argument("--mean_length", type=int, default=20000, help="Mean scaffold length (bp)")
+    group.add_argument("--blast_rows", type=int, default=20000, help="Rows per hs-blastn file (one file per genome pair)")
+    group.add_argument("--plant_rows", type=int, default=1_000_000, help="Rows of the plant BLAST table (Script 5 input)")
+    group.add_argument("--candidates", type=int, default=5000, help="HT candidates (Scripts 6 and 8 inputs)")
+    group.add_argument("--annotation_rows", type=int, default=50000, help="Rows of the EggNOG annotation table")
+    group.add_argument("--trees", type=int, default=40, help="Candidates given to Script 9")
+    group.add_argument("--seed", type=int, default=1)
+
+SETTINGS = ["plant_genomes", "fungi_genomes", "scaffolds", "mean_length", "blast_rows",
+            "plant_rows", "candidates", "annotation_rows", "trees", "seed"]
+
+# ─── GENOMES ────────────────────────────────────────────────────────────────────
+def random_block(rng, size=1 << 18):
+    """Random sequence reused at shifting offsets, which keeps generation fast."""
+    return "".join(rng.choice("ACGT") for _ in range(size // 4)) * 4
+
+def make_genome(path, prefix, scaffolds, mean_length, rng, block):
+    """Writes a genome of exponentially distributed scaffold lengths; returns {name: length}."""
+    lengths = {}
+    with FastaWriter(path) as writer:
+        for i in range(scaffolds):
+            length = max(200, int(rng.expovariate(1 / mean_length)))
+            start = rng.randrange(len(block) // 2)
+            seq = (block[start:] * (length // (len(block) - start) + 1))[:length]
+            name = f"{prefix}_scaffold_{i}"
+            writer.write(f"{name} len={length}", seq)
+            lengths[name] = length
+    return lengths
+
+def make_genomes(directory, fai_dir, kind, count, scaffolds, mean_length, rng, block):
+    """count genomes '<kind>_<i>.fasta' with their .fai; returns {genome file: {scaffold: length}}."""
+    os.makedirs(directory, exist_ok=True)
+    os.makedirs(fai_dir, exist_ok=True)
+    genomes = {}
+    for g in range(count):
+        name = f"{kind}_{g}.fasta"
+        path = os.path.join(directory, name)
+        genomes[name] = make_genome(path, f"{kind}{g}", scaffolds, mean_length, rng, block)
+        build_fai(path, os.path.join(fai_dir, name + ".fai"))
+    return genomes
+
+# ─── TABLES ─────────────────────────────────────────────────────────────────────
+def blast_table(rng, queries, subjects, rows):
+    """Tabular outfmt 6 hits (12 standard columns) between two lists of (scaffold, length)."""
+    q = rng.integers(0, len(queries), rows)
+    s = rng.integers(0, len(subjects), rows)
+    length = rng.integers(100, 3000, rows)
+    q_len = np.array([l for _, l in queries])[q]
+    s_len = np.array([l for _, l in subjects])[s]
+    qstart = rng.integers(1, np.maximum(2, q_len - length))
+    sstart = rng.integers(1, np.maximum(2, s_len - length))
+    pident = np.round(rng.uniform(70, 100, rows), 3)
+    return pd.DataFrame({
+        "qseqid": np.array([n for n, _ in queries], dtype=object)[q],
+        "sseqid": np.array([n for n, _ in subjects], dtype=object)[s],
+        "pident": pident,
+        "length": length,
+        "mismatch": (length * (100 - pident) / 100).astype(int),
+        "gapopen": rng.integers(0, 10, rows),
+        "qstart": qstart,
+        "qend": qstart + length - 1,
+        "sstart": sstart,
+        "send": sstart + length - 1,
+        "evalue": 10.0 ** -rng.integers(20, 180, rows),
+        "bitscore": np.round(length * pident / 55, 1),
+    })[COLUMNS]
+
+def make_blast_files(directory, plant_genomes, fungi_genomes, rows, rng):
+    """One '<plant>_VS_<fungus>.blast' file per pair (fungal query, plant subject), as Script 1 writes."""
+    os.makedirs(directory, exist_ok=True)
+    total = 0
+    for plant, plant_scaffolds in plant_genomes.items():
+        for fungus, fungi_scaffolds in fungi_genomes.items():
+            table = blast_table(rng, list(fungi_scaffolds.items()), list(plant_scaffolds.items()), rows)
+            table.to_csv(os.path.join(directory, f"{plant}_VS_{fungus}.blast"), sep="\t", header=False, index=False)
+            total += rows
+    return total
+
+def make_plant_table(path, query_ids, plant_genomes, rows, rng):
+    """Combined plant hits as written by Script 4 (qseqid sseqid pident length evalue bitscore plant_genome)."""
+    subjects = [(name, genome) for genome, scaffolds in plant_genomes.items() for name in scaffolds]
+    s = rng.integers(0, len(subjects), rows)
+    length = rng.integers(100, 3000, rows)
+    pident = np.round(rng.uniform(70, 100, rows), 3)
+    pd.DataFrame({
+        "qseqid": np.array(query_ids, dtype=object)[rng.integers(0, len(query_ids), rows)],
+        "sseqid": np.array([n for n, _ in subjects], dtype=object)[s],
+        "pident": pident,
+        "length": length,
+        "evalue": 10.0 ** -rng.integers(20, 180, rows),
+        "bitscore": np.round(length * pident / 50 + rng.uniform(0, 1, rows), 3),
+        "plant_genome": np.array([g for _, g in subjects], dtype=object)[s],
+    }).to_csv(path, sep="\t", index=False)
+
+def make_candidates(path, fungi_genomes, count, rng):
+    """HT candidate table with the fungal columns Script 6 reads (as Script 5 writes them)."""
+    scaffolds = [(name, length, genome) for genome, lengths in fungi_genomes.items() for name, length in lengths.items()]
+    rows = []
+    for i in range(count):
+        name, length, genome = scaffolds[rng.integers(0, len(scaffolds))]
+        span = int(min(length - 1, rng.integers(500, 5000)))
+        start = int(rng.integers(1, length - span + 1))
+        rows.append((f"cand_{i}", name, start, start + span, genome, round(float(rng.uniform(1, 500)), 2)))
+    table = pd.DataFrame(rows, columns=["qseqid", "sseqid_fungi", "sstart_fungi", "send_fungi", "fungi_genome_fungi", "h_index"])
+    table.to_csv(path, sep="\t", index=False)
+
+def make_candidate_fasta(path, count, rng, block, mean_length=1500):
+    """Candidate sequences 'cand_<i>' (cluster representatives for Script 8, queries for Script 9)."""
+    py_rng = random.Random(int(rng.integers(1 << 30)))
+    with FastaWriter(path) as writer:
+        for i in range(count):
+            length = max(300, int(py_rng.expovariate(1 / mean_length)))
+            start = py_rng.randrange(len(block) - length)
+            writer.write(f"cand_{i}", block[start:start + length])
+
+def make_annotations(path, count, candidates, rng):
+    """EggNOG-mapper 2.x .emapper.annotations table; the first queries are candidates of the FASTA."""
+    queries = [f"cand_{i}" if i < candidates else f"other_{i}" for i in range(count)]
+    descriptions = np.array(DESCRIPTIONS, dtype=object)[rng.integers(0, len(DESCRIPTIONS), count)]
+    with open(path, "w") as f:
+        f.write("## emapper-2.1.12\n## command: synthetic\n##\n")
+        f.write("#" + "\t".join(ANNOTATION_COLUMNS) + "\n")
+        for query, description, score in zip(queries, descriptions, rng.uniform(50, 900, count)):
+            fields = dict.fromkeys(ANNOTATION_COLUMNS, "-")
+            fields.update(query=query, seed_ortholog=f"4751.{query}", evalue="1e-60", score=f"{score:.1f}",
+                          eggNOG_OGs="KOG0001@2759", max_annot_lvl="4751|Fungi", COG_category="S",
+                          Description=description, Preferred_name=description.split()[0][:8],
+                          PFAMs="PF00001" if score > 400 else "-")
+            f.write("\t".join(fields[c] for c in ANNOTATION_COLUMNS) + "\n")
+        f.write(f"## {count} queries scanned\n")
+
+# ─── DATA SET ───────────────────────────────────────────────────────────────────
+def generate(outdir, settings):
+    """
+    Writes the whole data set into outdir, unless it already holds one made
+    with the same settings. Returns the layout {role: path} and row counts.
+    """
+    manifest_path = os.path.join(outdir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["settings"] == settings:
+            print(f"[INFO] Reusing synthetic data in {outdir}")
+            return manifest
+    print(f"[INFO] Generating synthetic data in {outdir}...")
+    os.makedirs(outdir, exist_ok=True)
+    rng = np.random.default_rng(settings["seed"])
+    py_rng = random.Random(settings["seed"])
+    block = random_block(py_rng)
+    paths = {role: os.path.join(os.path.abspath(outdir), name) for role, name in {
+        "plant_genomes": "plant_genomes", "fungi_genomes": "fungi_genomes",
+        "plant_fai": "plant_fai", "fungi_fai": "fungi_fai", "blast_dir": "blastresults",
+        "plant_table": "plant_alignment_results.tsv", "candidates": "ht_candidates.tsv",
+        "clusters": "ht_clusters.fasta", "annotations": "ht_annotations.emapper.annotations",
+        "tree_queries": "tree_candidates.fasta",
+    }.items()}
+    # Files of an earlier data set must not leak into this one
+    for path in paths.values():
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+    plants = make_genomes(paths["plant_genomes"], paths["plant_fai"], "plant", settings["plant_genomes"],
+                          settings["scaffolds"], settings["mean_length"], py_rng, block)
+    fungi = make_genomes(paths["fungi_genomes"], paths["fungi_fai"], "fungus", settings["fungi_genomes"],
+                         settings["scaffolds"], settings["mean_length"], py_rng, block)
+    blast_rows = make_blast_files(paths["blast_dir"], plants, fungi, settings["blast_rows"], rng)
+    # Plant hits are keyed like Script 2's hits, so Script 5 finds both sides for most queries
+    fungal_ids = [name for scaffolds in fungi.values() for name in scaffolds]
+    make_plant_table(paths["plant_table"], fungal_ids, plants, settings["plant_rows"], rng)
+    make_candidates(paths["candidates"], fungi, settings["candidates"], rng)
+    make_candidate_fasta(paths["clusters"], settings["candidates"], rng, block)
+    make_annotations(paths["annotations"], settings["annotation_rows"], settings["candidates"], rng)
+    make_candidate_fasta(paths["tree_queries"], settings["trees"], rng, block)
+
+    manifest = {"settings": settings, "paths": paths, "rows": {
+        "blast": blast_rows, "plant_table": settings["plant_rows"], "candidates": settings["candidates"],
+        "annotations": settings["annotation_rows"], "trees": settings["trees"],
+    }}
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic inputs for the pipeline scripts.")
+    parser.add_argument("--outdir", required=True, help="Directory the data set is written to")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    manifest = generate(args.outdir, {name: getattr(args, name) for name in SETTINGS})
+    print(f"[SUCCESS] Synthetic data in {args.outdir}: " +
+          ", ".join(f"{rows:,} {role} rows" for role, rows in manifest["rows"].items()))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Primary identity / alignment-length / scaffold-length filter shared by
+2-filter_blast_results.py (filtering .blast files on disk) and
+1-BlastWholeGenomes.py --filter (filtering hs-blastn output as it streams).
+"""
+import numpy as np
+import pandas as pd
+
+# ─── CONFIGURATION ──────────────────────────────────────────────────────────────
+# Thresholds defined in the thesis context
+IDENTITY_THRESHOLD = 80
+ALIGNMENT_LENGTH_THRESHOLD = 500
+SCAFFOLD_LENGTH_THRESHOLD = 20000  # 20 kb (filters out short/fragmented scaffolds)
+
+COLUMNS = [
+    "qseqid", "sseqid", "pident", "length", "mismatch", "gapopen",
+    "qstart", "qend", "sstart", "send", "evalue", "bitscore"
+]
+
+# Explicit compact dtypes: avoids type inference on every chunk and keeps
+# IDs as strings. evalue stays float64 (float32 underflows below ~1e-38).
+COLUMN_DTYPES = {
+    "qseqid": str, "sseqid": str, "pident": "float32", "length": "uint32",
+    "mismatch": "uint32", "gapopen": "uint32", "qstart": "uint32", "qend": "uint32",
+    "sstart": "uint32", "send": "uint32", "evalue": "float64", "bitscore": "float32"
+}
+
+DEFAULT_CHUNK_ROWS = 500000
+
+# ─── FILTERS ────────────────────────────────────────────────────────────────────
+def filter_chunk(chunk, scaffold_index, fungi_name, min_identity=IDENTITY_THRESHOLD,
+                 min_length=ALIGNMENT_LENGTH_THRESHOLD, min_scaffold=SCAFFOLD_LENGTH_THRESHOLD,
+                 keep_scaffold_length=False):
+    """
+    Applies the three thresholds to one chunk of tabular BLAST hits.
+    With keep_scaffold_length the looked-up lengths are kept as a
+    'scaffold_length' column (used by the hit store).
+    """
+    # 1. Identity & Alignment Length
+    mask = (chunk["pident"] >= min_identity) & \
+           (chunk["length"] >= min_length)
+    chunk = chunk[mask]
+    if chunk.empty:
+        return chunk.assign(scaffold_length=np.zeros(0, dtype=np.int64)) if keep_scaffold_length else chunk
+
+    # 2. Scaffold Length (vectorized lookup of qseqid in the scaffold index)
+    # This ensures the fungal hit is on a substantial scaffold, not a tiny contig.
+    # If we can't verify scaffold length (no .fai for this fungus), missing IDs
+    # map to length 0: the hit is dropped unless min_scaffold is 0.
+    scaffold_lengths = scaffold_index.lookup("fungi", fungi_name, chunk["qseqid"])
+    keep = scaffold_lengths >= min_scaffold
+    if keep_scaffold_length:
+        chunk = chunk.assign(scaffold_length=scaffold_lengths)
+    return chunk[keep]
+
+def read_blast_chunks(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yields outfmt 6 hits from a path or an open text stream as typed DataFrame chunks."""
+    try:
+        reader = pd.read_csv(source, sep="\t", names=COLUMNS, dtype=COLUMN_DTYPES, chunksize=chunk_rows)
+    except pd.errors.EmptyDataError:
+        return
+    yield from reader
+
+def filter_blast_stream(source, fungi_name, scaffold_index, chunk_rows=DEFAULT_CHUNK_ROWS, **thresholds):
+    """
+    Reads outfmt 6 hits from a path or an open text stream chunk by chunk and
+    keeps only those that pass the filters (keyword arguments of filter_chunk).
+    Returns (kept_hits or None, rows_read). Kept hits carry a 'fungi_genome' column.
+    """
+    kept = []
+    rows_read = 0
+    for chunk in read_blast_chunks(source, chunk_rows):
+        rows_read += len(chunk)
+        chunk = filter_chunk(chunk, scaffold_index, fungi_name, **thresholds)
+        if not chunk.empty:
+            kept.append(chunk)
+
+    if not kept:
+        return None, rows_read
+
+    hits = pd.concat(kept, ignore_index=True) if len(kept) > 1 else kept[0]
+    return hits.assign(fungi_genome=fungi_name), rows_read
+
+# ─── LOCUS MERGING ──────────────────────────────────────────────────────────────
+def _overlap_components(slo, shi, qlo, qhi, max_gap):
+    """
+    Connected components of HSPs (sorted by slo) whose subject intervals and
+    query intervals both overlap or are at most max_gap bp apart: each HSP gets
+    the index of the first HSP of its component. A sweep over the subject axis
+    compares each HSP only with those still open at its start.
+    """
+    slo, shi, qlo, qhi = (a.tolist() for a in (slo, shi, qlo, qhi))
+    root = list(range(len(slo)))
+
+    def find(i):
+        while root[i] != i:
+            root[i] = root[root[i]]
+            i = root[i]
+        return i
+
+    open_hsps = []
+    for i in range(len(slo)):
+        open_hsps = [j for j in open_hsps if shi[j] + max_gap >= slo[i]]
+        for j in open_hsps:
+            if qlo[i] <= qhi[j] + max_gap and qlo[j] <= qhi[i] + max_gap:
+                a, b = find(i), find(j)
+                root[max(a, b)] = min(a, b)
+        open_hsps.append(i)
+    return np.array([find(i) for i in range(len(slo))])
+
+def merge_hsps(hits, max_gap=0):
+    """
+    Collapses overlapping HSPs into loci, per (qseqid, sseqid) pair of scaffolds
+    and strand. Two HSPs belong to the same locus when their subject intervals
+    and their query intervals both overlap or are at most max_gap bp apart
+    (loci are the connected components of that relation). A vectorized
+    sort-sweep over the subject intervals finds the candidate clusters; only
+    clusters of more than one HSP are swept again with the query check.
+
+    Each locus keeps the fields of its best-scoring HSP, with qstart/qend and
+    sstart/send widened to the span of the whole locus (in the best HSP's
+    orientation), and an 'hsp_count' column. length, pident, mismatch, gapopen,
+    evalue and bitscore stay those of the best HSP. Loci keep the input order
+    of their best HSP.
+    """
+    if hits.empty:
+        return hits.assign(hsp_count=np.zeros(0, dtype="uint32"))
+
+    keys = ["qseqid", "sseqid", "_minus"]
+    work = hits.assign(
+        _slo=np.minimum(hits["sstart"], hits["send"]).astype("int64"),
+        _shi=np.maximum(hits["sstart"], hits["send"]).astype("int64"),
+        _qlo=np.minimum(hits["qstart"], hits["qend"]).astype("int64"),
+        _qhi=np.maximum(hits["qstart"], hits["qend"]).astype("int64"),
+        _minus=(hits["qstart"] > hits["qend"]) != (hits["sstart"] > hits["send"]),
+        _row=np.arange(len(hits)),
+    ).sort_values(keys + ["_slo"], kind="stable")
+
+    # A new cluster starts where a subject interval begins past everything seen
+    # so far on its scaffold pair and strand (plus the allowed gap)
+    reach = work.groupby(keys, sort=False)["_shi"].cummax()
+    previous = reach.groupby([work[k] for k in keys], sort=False).shift()
+    starts = previous.isna().to_numpy() | (work["_slo"].to_numpy() > previous.to_numpy() + max_gap)
+
+    # Locus = position of its first HSP in `work`; clusters are split on the query axis
+    locus = np.arange(len(work))
+    bounds = np.append(np.flatnonzero(starts), len(work))
+    columns = [work[c].to_numpy() for c in ("_slo", "_shi", "_qlo", "_qhi")]
+    for i in np.flatnonzero(np.diff(bounds) > 1):
+        first, end = bounds[i], bounds[i + 1]
+        locus[first:end] = first + _overlap_components(*(c[first:end] for c in columns), max_gap)
+
+    grouped = work.groupby(locus, sort=False)
+    best = work.loc[grouped["bitscore"].idxmax().to_numpy()].copy()
+    spans = grouped.agg(slo=("_slo", "min"), shi=("_shi", "max"), qlo=("_qlo", "min"),
+                        qhi=("_qhi", "max"), hsp_count=("_slo", "size"))
+
+    forward = (best["sstart"] <= best["send"]).to_numpy()
+    best["sstart"] = np.where(forward, spans["slo"], spans["shi"])
+    best["send"] = np.where(forward, spans["shi"], spans["slo"])
+    forward = (best["qstart"] <= best["qend"]).to_numpy()
+    best["qstart"] = np.where(forward, spans["qlo"], spans["qhi"])
+    best["qend"] = np.where(forward, spans["qhi"], spans["qlo"])
+    best["hsp_count"] = spans["hsp_count"].to_numpy().astype("uint32")
+
+    best = best.sort_values("_row").drop(columns=["_slo", "_shi", "_qlo", "_qhi", "_minus", "_row"])
+    return best.astype({c: hits[c].dtype for c in ("qstart", "qend", "sstart", "send")}).reset_index(drop=True)
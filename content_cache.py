@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache for the outputs of expensive external tools.
+
+An entry is a directory of files stored under a key that hashes everything the
+outputs depend on (input sequence, database identity, tool parameters), so a
+changed input simply gets a new key and stale entries are never reused. Every
+hit refreshes the entry's timestamp; prune() then removes the least recently
+used entries until the cache fits its size limit.
+
+FileHashes gives content digests of input files (genomes) for the incremental
+modes of the pipeline scripts, re-reading a file only when its size or mtime changed.
+
+    python content_cache.py --cache ./phylogenies/.cache --max_size 20   # prune to 20 GB
+"""
+import os
+import glob
+import json
+import shutil
+import hashlib
+import argparse
+import threading
+
+LAST_USED_FILE = ".last_used"
+
+# ─── KEYS ───────────────────────────────────────────────────────────────────────
+def cache_key(*parts):
+    """Hex digest of the parts (str or bytes), separated so ('ab', 'c') != ('a', 'bc')."""
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        h.update(len(part).to_bytes(8, "little"))
+        h.update(part)
+    return h.hexdigest()
+
+def files_signature(pattern):
+    """Name, size and mtime of every file matching a glob, e.g. the volumes of a BLAST database."""
+    entries = []
+    for path in sorted(glob.glob(pattern)):
+        st = os.stat(path)
+        entries.append(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}")
+    return "\n".join(entries)
+
+def file_digest(path, block_size=1 << 20):
+    """Hex digest of a file's contents."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+class FileHashes:
+    """
+    Content digests of files, remembered in a JSON file by (size, mtime) so an
+    unchanged multi-gigabyte genome is read once, not on every run. A touched
+    but identical file is re-read and keeps its digest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._dirty = False
+        if os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def digest(self, file_path):
+        st = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+            entry = [st.st_size, st.st_mtime_ns, file_digest(file_path)]
+            self._entries[key] = entry
+            self._dirty = True
+        return entry[2]
+
+    def save(self):
+        if not self._dirty:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self._entries, f)
+        os.replace(self.path + ".tmp", self.path)
+        self._dirty = False
+
+# ─── CACHE ──────────────────────────────────────────────────────────────────────
+class ContentCache:
+    """Directory-backed cache of file sets, safe to use from several threads or processes."""
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counter = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """Directory of the entry (refreshing its LRU timestamp), or None on a miss."""
+        entry = self._entry(key)
+        marker = os.path.join(entry, LAST_USED_FILE)
+        try:
+            os.utime(marker)
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def read(self, key, name):
+        """Contents of one cached file as bytes, or None on a miss."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        with open(os.path.join(entry, name), "rb") as f:
+            return f.read()
+
+    def restore(self, key, dest_dir):
+        """Copies every file of an entry into dest_dir. Returns their new paths, or None on a miss."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        restored = []
+        for name in sorted(os.listdir(entry)):
+            if name != LAST_USED_FILE:
+                restored.append(os.path.join(dest_dir, name))
+                shutil.copyfile(os.path.join(entry, name), restored[-1])
+        return restored
+
+    def put(self, key, files):
+        """
+        Stores {name: source path or bytes} under key, atomically. An existing
+        entry for the same key is kept (same key, same content).
+        """
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+        with self._lock:
+            self._counter += 1
+            tmp_entry = f"{entry}.tmp{os.getpid()}_{self._counter}"
+        os.makedirs(tmp_entry)
+        for name, source in files.items():
+            if isinstance(source, bytes):
+                with open(os.path.join(tmp_entry, name), "wb") as f:
+                    f.write(source)
+            else:
+                shutil.copyfile(source, os.path.join(tmp_entry, name))
+        open(os.path.join(tmp_entry, LAST_USED_FILE), "w").close()
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another worker stored the same key first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def entries(self):
+        """[(last_used, size_in_bytes, path)] for every complete entry."""
+        found = []
+        for marker in glob.glob(os.path.join(self.cache_dir, "??", "*", LAST_USED_FILE)):
+            entry = os.path.dirname(marker)
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            found.append((os.path.getmtime(marker), size, entry))
+        return found
+
+    def prune(self, max_bytes=None):
+        """Removes least recently used entries until the cache fits. Returns (entries removed, bytes freed)."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0, 0
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = freed = 0
+        for _, size, entry in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+# ─── COMMAND LINE ───────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report on or prune a content-addressed cache directory.")
+    parser.add_argument("--cache", required=True, help="Cache directory")
+    parser.add_argument("--max_size", type=float, help="Prune least recently used entries down to this size (GB)")
+    args = parser.parse_args()
+
+    cache = ContentCache(args.cache)
+    if args.max_size is not None:
+        removed, freed = cache.prune(int(args.max_size * 1e9))
+        print(f"[INFO] Removed {removed} entries ({freed / 1e9:.2f} GB)")
+    entries = cache.entries()
+    print(f"[SUCCESS] {len(entries)} entries, {sum(size for _, size, _ in entries) / 1e9:.2f} GB in {args.cache}")
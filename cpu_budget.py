@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs multi-threaded external tools concurrently under a fixed budget of cores.
+
+Each task declares how many threads it will use; a task only starts once that
+many cores are free (and, optionally, fewer than max_tasks tasks are running),
+and tasks are started in the order given (so callers can order work largest-first).
+"""
+import queue
+import threading
+
+class CoreBudget:
+    """Counting semaphore over CPU cores that lets a task take several at once."""
+
+    def __init__(self, cores):
+        self.cores = max(1, int(cores))
+        self.free = self.cores
+        self.condition = threading.Condition()
+
+    def acquire(self, threads):
+        """Blocks until `threads` cores are free; returns the number actually taken."""
+        threads = max(1, min(int(threads), self.cores))
+        with self.condition:
+            while self.free < threads:
+                self.condition.wait()
+            self.free -= threads
+        return threads
+
+    def release(self, threads):
+        with self.condition:
+            self.free += threads
+            self.condition.notify_all()
+
+def run_with_core_budget(tasks, cores, fn, max_tasks=None):
+    """
+    Runs fn(task, threads) for every (task, threads) pair of `tasks`, never
+    using more than `cores` threads in total nor running more than `max_tasks`
+    tasks at once (if given).
+    Yields (task, result, error) as tasks finish; error is None on success.
+    """
+    tasks = list(tasks)
+    budget = CoreBudget(cores)
+    slots = threading.Semaphore(max(1, int(max_tasks))) if max_tasks else None
+    finished = queue.Queue()
+
+    def worker(task, threads):
+        result, error = None, None
+        try:
+            result = fn(task, threads)
+        except Exception as e:
+            error = e
+        finally:
+            budget.release(threads)
+            if slots is not None:
+                slots.release()
+        finished.put((task, result, error))
+
+    def dispatch():
+        for task, threads in tasks:
+            if slots is not None:
+                slots.acquire()
+            threads = budget.acquire(threads)
+            threading.Thread(target=worker, args=(task, threads), daemon=True).start()
+
+    threading.Thread(target=dispatch, daemon=True).start()
+    for _ in range(len(tasks)):
+        yield finished.get()
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FASTA I/O shared by the pipeline scripts, on raw bytes instead of SeqRecords.
+
+Random access goes through samtools-style .fai indexes. Plain genomes are
+memory-mapped and only the byte ranges of the requested scaffolds are read, so
+pulling a few hundred scaffolds out of a multi-gigabase genome does not parse
+(or hold in memory) the rest of it. bgzip-compressed genomes (.gz) are read the
+same way through their .gzi block index, decompressing only the blocks that
+hold the requested bases. Missing .fai/.gzi files are built with a single
+streaming pass.
+
+iter_fasta() parses a whole file over a memory map and FastaWriter streams
+records out, both wrapping sequences as Biopython's SeqIO does.
+"""
+import os
+import gzip
+import mmap
+import zlib
+import struct
+import bisect
+from collections import OrderedDict, namedtuple
+
+FaiEntry = namedtuple("FaiEntry", ["length", "offset", "line_bases", "line_width"])
+
+FASTA_EXTENSIONS = (".fasta", ".fa", ".fna")
+# bgzip-compressed genomes, e.g. genome.fa.gz
+GZIP_EXTENSIONS = tuple(ext + ".gz" for ext in FASTA_EXTENSIONS)
+
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+# Decompressed BGZF blocks kept per open genome (64 KB each)
+BLOCK_CACHE_SIZE = 64
+
+def is_fasta_file(name):
+    """True for plain or bgzip-compressed FASTA file names."""
+    return name.lower().endswith(FASTA_EXTENSIONS + GZIP_EXTENSIONS)
+
+def fasta_basename(path):
+    """File name without the .gz and FASTA extensions ('x.fa.gz' -> 'x')."""
+    name = os.path.basename(path)
+    if name.lower().endswith(".gz"):
+        name = name[:-3]
+    return os.path.splitext(name)[0]
+
+def is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+def is_bgzf(path):
+    """True if the file is BGZF (bgzip) compressed, i.e. gzip with a 'BC' block-size field."""
+    with open(path, "rb") as f:
+        head = f.read(18)
+    return head[:4] == BGZF_MAGIC and head[12:14] == b"BC"
+
+def open_fasta(path):
+    """Binary handle on a plain or gzip/bgzip-compressed FASTA."""
+    return gzip.open(path, "rb") if is_gzip(path) else open(path, "rb")
+
+# ─── .FAI INDEXES ───────────────────────────────────────────────────────────────
+def read_fai(fai_path):
+    """Returns {name: FaiEntry} in file order."""
+    entries = {}
+    with open(fai_path) as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) >= 5:
+                entries[parts[0]] = FaiEntry(*(int(x) for x in parts[1:5]))
+    return entries
+
+def build_fai(fasta_path, fai_path):
+    """
+    Writes a samtools-compatible .fai for fasta_path (one streaming pass).
+    Assumes every sequence line except the last of a record has the same width,
+    as samtools does.
+    """
+    tmp_path = fai_path + ".tmp"
+    # Offsets of a compressed genome are positions in the decompressed text, as samtools uses
+    with open_fasta(fasta_path) as f, open(tmp_path, "w") as out:
+        name = None
+        length = offset = line_bases = line_width = 0
+        position = 0
+        for line in f:
+            line_len = len(line)
+            if line.startswith(b">"):
+                if name is not None:
+                    out.write(f"{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\n")
+                name = line[1:].split(None, 1)[0].decode() if line[1:].strip() else ""
+                length = line_bases = line_width = 0
+                offset = position + line_len
+            elif name is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if line_bases == 0 and bases:
+                    line_bases, line_width = bases, line_len
+                length += bases
+            position += line_len
+        if name is not None:
+            out.write(f"{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\n")
+    os.replace(tmp_path, fai_path)
+
+def find_fai(fasta_path, fai_dir=None):
+    """Looks for '<genome>.fai' in fai_dir, then next to the FASTA. Returns None if absent."""
+    candidates = []
+    if fai_dir:
+        candidates.append(os.path.join(fai_dir, os.path.basename(fasta_path) + ".fai"))
+    candidates.append(fasta_path + ".fai")
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+def source_stamp(fasta_path):
+    """Size and mtime of a genome, as recorded next to the indexes built from it."""
+    st = os.stat(fasta_path)
+    return f"{st.st_size} {st.st_mtime_ns}"
+
+def index_is_current(index_path, fasta_path):
+    """
+    False if the genome changed after the index was made: its size or mtime
+    differ from those recorded in '<index>.source' (indexes built by
+    ensure_fai), or, without that record, it is newer than the index.
+    """
+    stamp_path = index_path + ".source"
+    if os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            return f.read() == source_stamp(fasta_path)
+    return os.path.getmtime(index_path) >= os.path.getmtime(fasta_path)
+
+def ensure_fai(fasta_path, fai_dir=None, cache_dir=".fai_cache"):
+    """
+    Returns the .fai of a genome. If there is none (in fai_dir or next to the
+    FASTA), or it is older than the genome, one is built into cache_dir, since
+    genome directories may be read-only. An index in cache_dir is rebuilt when
+    the genome's size or mtime changed since it was built.
+    A bgzipped genome also gets its .gzi next to the .fai if it has none, or if
+    the .fai was just rebuilt.
+    """
+    fai_path = find_fai(fasta_path, fai_dir)
+    if fai_path is not None and not index_is_current(fai_path, fasta_path):
+        print(f"  -> {fai_path} is out of date for {os.path.basename(fasta_path)}, not used")
+        fai_path = None
+    rebuilt = False
+    if fai_path is None:
+        os.makedirs(cache_dir, exist_ok=True)
+        fai_path = os.path.join(cache_dir, os.path.basename(fasta_path) + ".fai")
+        if not os.path.exists(fai_path) or not index_is_current(fai_path, fasta_path):
+            print(f"  -> Indexing {os.path.basename(fasta_path)}...")
+            stamp = source_stamp(fasta_path)
+            build_fai(fasta_path, fai_path)
+            with open(fai_path + ".source", "w") as f:
+                f.write(stamp)
+            rebuilt = True
+    if is_gzip(fasta_path):
+        gzi_path = find_gzi(fasta_path, fai_path)
+        if rebuilt or gzi_path is None or not index_is_current(gzi_path, fasta_path):
+            build_gzi(fasta_path, fai_path[:-len(".fai")] + ".gzi")
+    return fai_path
+
+# ─── BGZIP ──────────────────────────────────────────────────────────────────────
+def scan_bgzf_blocks(bgzf_path):
+    """
+    [(compressed offset, uncompressed offset)] of every BGZF block, read from
+    the block headers and size trailers only (nothing is decompressed).
+    """
+    blocks = []
+    compressed = uncompressed = 0
+    with open(bgzf_path, "rb") as f:
+        while True:
+            head = f.read(12)
+            if not head:
+                break
+            if len(head) < 12 or head[:4] != BGZF_MAGIC:
+                raise ValueError(f"{bgzf_path} is not bgzip-compressed (recompress it with 'bgzip')")
+            extra = f.read(struct.unpack("<H", head[10:12])[0])
+            block_size = None
+            i = 0
+            while i + 4 <= len(extra):
+                length = struct.unpack("<H", extra[i + 2:i + 4])[0]
+                if extra[i:i + 2] == b"BC":
+                    block_size = struct.unpack("<H", extra[i + 4:i + 6])[0] + 1
+                i += 4 + length
+            if block_size is None:
+                raise ValueError(f"{bgzf_path} is not bgzip-compressed (recompress it with 'bgzip')")
+            f.seek(compressed + block_size - 4)
+            data_size = struct.unpack("<I", f.read(4))[0]
+            blocks.append((compressed, uncompressed))
+            compressed += block_size
+            uncompressed += data_size
+    return blocks
+
+def build_gzi(bgzf_path, gzi_path):
+    """Writes a samtools-compatible .gzi (every block start but the first)."""
+    blocks = scan_bgzf_blocks(bgzf_path)[1:]
+    tmp_path = gzi_path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(struct.pack("<Q", len(blocks)))
+        for entry in blocks:
+            out.write(struct.pack("<QQ", *entry))
+    os.replace(tmp_path, gzi_path)
+
+def read_gzi(gzi_path):
+    """[(compressed offset, uncompressed offset)] of every block, the first one included."""
+    with open(gzi_path, "rb") as f:
+        count = struct.unpack("<Q", f.read(8))[0]
+        values = struct.unpack(f"<{2 * count}Q", f.read(16 * count))
+    return [(0, 0)] + list(zip(values[0::2], values[1::2]))
+
+def find_gzi(fasta_path, fai_path=None):
+    """Looks for the .gzi next to the .fai, then next to the genome. Returns None if absent."""
+    candidates = [fasta_path + ".gzi"]
+    if fai_path:
+        candidates.insert(0, fai_path[:-len(".fai")] + ".gzi")
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return None
+
+class BgzfReader:
+    """Byte-range reads of the decompressed text of a memory-mapped bgzip file."""
+
+    def __init__(self, bgzf_path, gzi_path=None):
+        self._file = open(bgzf_path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        blocks = read_gzi(gzi_path) if gzi_path else scan_bgzf_blocks(bgzf_path)
+        self._compressed = [c for c, _ in blocks] + [len(self._data)]
+        self._uncompressed = [u for _, u in blocks]
+        self._cache = OrderedDict()
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def _block(self, i):
+        block = self._cache.get(i)
+        if block is None:
+            block = zlib.decompress(self._data[self._compressed[i]:self._compressed[i + 1]], 31)
+            self._cache[i] = block
+            if len(self._cache) > BLOCK_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(i)
+        return block
+
+    def read(self, start, end):
+        """Decompressed bytes [start, end), decompressing only the blocks they span."""
+        if end <= start:
+            return b""
+        i = bisect.bisect_right(self._uncompressed, start) - 1
+        parts = []
+        position = start
+        while position < end and i < len(self._uncompressed):
+            block = self._block(i)
+            block_start = self._uncompressed[i]
+            parts.append(block[position - block_start:end - block_start])
+            position = block_start + len(block)
+            i += 1
+        return b"".join(parts)
+
+# ─── RANDOM ACCESS ──────────────────────────────────────────────────────────────
+class FastaIndex:
+    """Memory-mapped FASTA file (plain or bgzip-compressed) with its .fai index."""
+
+    def __init__(self, fasta_path, fai_path=None):
+        self.path = fasta_path
+        if fai_path is None:
+            fai_path = fasta_path + ".fai"
+        if not os.path.exists(fai_path):
+            build_fai(fasta_path, fai_path)
+        self.index = read_fai(fai_path)
+        self._file = self._data = self._bgzf = None
+        if is_gzip(fasta_path):
+            self._bgzf = BgzfReader(fasta_path, find_gzi(fasta_path, fai_path))
+        else:
+            self._file = open(fasta_path, "rb")
+            size = os.fstat(self._file.fileno()).st_size
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        if self._bgzf is not None:
+            self._bgzf.close()
+            return
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def _read(self, start, end):
+        if self._bgzf is not None:
+            return self._bgzf.read(start, end)
+        return self._data[start:end]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def names(self):
+        return list(self.index)
+
+    def header(self, name):
+        """Full header line of a record, without '>' and the line break."""
+        # The header line ends just before the sequence offset; look back for its start
+        end = self.index[name].offset - 1
+        start = end
+        while True:
+            start = max(0, start - 4096)
+            chunk = self._read(start, end)
+            line_start = chunk.rfind(b"\n")
+            if line_start >= 0 or start == 0:
+                return chunk[line_start + 2:].rstrip(b"\r").decode()
+
+    def _byte_offset(self, entry, position):
+        """File offset of the 0-based base `position` of a record."""
+        lines, column = divmod(position, entry.line_bases)
+        return entry.offset + lines * entry.line_width + column
+
+    def fetch(self, name, start=0, end=None):
+        """Sequence bytes of [start, end) (0-based, end excluded), read straight from the mapped file."""
+        entry = self.index[name]
+        end = entry.length if end is None else min(end, entry.length)
+        start = max(0, start)
+        if end <= start or entry.line_bases == 0:
+            return b""
+        raw = self._read(self._byte_offset(entry, start), self._byte_offset(entry, end - 1) + 1)
+        if entry.line_width != entry.line_bases:
+            raw = raw.replace(b"\n", b"").replace(b"\r", b"")
+        return raw
+
+# ─── STREAMING ──────────────────────────────────────────────────────────────────
+SEQUENCE_WHITESPACE = b" \t\r\n\x0b\x0c"
+GZIP_CHUNK_SIZE = 1 << 24
+
+def iter_fasta(fasta_path):
+    """
+    Yields (header, sequence) as bytes for every record, header without '>'.
+    Sequence lines are joined with whitespace removed, as Biopython does.
+    Plain files are parsed over a memory map; gzip/bgzip files are decompressed
+    in large chunks, each cut after its last complete record.
+    """
+    if is_gzip(fasta_path):
+        with gzip.open(fasta_path, "rb") as f:
+            # Chunks of the unfinished record; only each new chunk is searched
+            # for a record start, so long scaffolds stay linear
+            pending = []
+            while True:
+                chunk = f.read(GZIP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                cut = chunk.rfind(b"\n>") + 1
+                # A record can also start right at the chunk boundary
+                at_boundary = chunk[:1] == b">" and pending and pending[-1].endswith(b"\n")
+                if not cut and not at_boundary:
+                    pending.append(chunk)
+                    continue
+                pending.append(chunk[:cut])
+                yield from _parse_records(b"".join(pending))
+                pending = [chunk[cut:]]
+            yield from _parse_records(b"".join(pending))
+        return
+    with open(fasta_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield from _parse_records(data)
+
+def _parse_records(data):
+    """Records of a buffer (bytes or mmap) holding whole records."""
+    size = len(data)
+    # Records start at a '>' that begins a line; text before the first one is ignored
+    if data[:1] == b">":
+        start = 0
+    else:
+        start = data.find(b"\n>") + 1 or size
+    while start < size:
+        line_end = data.find(b"\n", start)
+        if line_end < 0:
+            line_end = size
+        header = data[start + 1:line_end].rstrip()
+        next_record = data.find(b"\n>", line_end)
+        end = size if next_record < 0 else next_record
+        sequence = data[line_end + 1:end].replace(b"\n", b"")
+        # Other whitespace is rare; checking for it is much cheaper than translate()
+        if b"\r" in sequence or b" " in sequence or b"\t" in sequence:
+            sequence = sequence.translate(None, SEQUENCE_WHITESPACE)
+        yield header, sequence
+        start = size if next_record < 0 else next_record + 1
+
+def record_id(header):
+    """Record ID of a header (first word), as Biopython's record.id."""
+    parts = header.split(None, 1)
+    return parts[0].decode() if parts else ""
+
+# ─── WRITING ────────────────────────────────────────────────────────────────────
+def format_record(header, sequence, width=60):
+    """
+    A FASTA record as bytes, wrapped like Biopython's SeqIO.write (60 columns).
+    width=0 writes the sequence on a single line.
+    """
+    if isinstance(header, str):
+        header = header.encode()
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    lines = [b">" + header]
+    if width:
+        lines.extend(sequence[i:i + width] for i in range(0, len(sequence), width))
+    else:
+        lines.append(sequence)
+    return b"\n".join(lines) + b"\n"
+
+class FastaWriter:
+    """
+    Streams records into a FASTA file through a large buffer. The file is
+    written under a temporary name and only appears, complete, on close().
+    """
+
+    def __init__(self, path, width=60, buffer_size=1 << 20):
+        self.path = path
+        self.width = width
+        self.count = 0
+        self._tmp_path = path + ".tmp"
+        self._handle = open(self._tmp_path, "wb", buffering=buffer_size)
+
+    def write(self, header, sequence):
+        self._handle.write(format_record(header, sequence, self.width))
+        self.count += 1
+
+    def close(self):
+        self._handle.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._handle.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact binary store of every BLAST hit above a permissive floor, so the
+primary-filter thresholds can be explored without re-reading the raw .blast
+files.
+
+One memory-mapped .npy array per column, all rows sorted by decreasing
+identity: every identity cutoff is a prefix of the store, found with one
+np.searchsorted on the stored (ascending) negated identity. String columns
+are stored as integer codes into vocabulary arrays, and each row keeps its
+original position so exports come out in the same order as
+2-filter_blast_results.py writes them.
+
+Built by 2-filter_blast_results.py --hit_store DIR, then:
+    python hit_store.py sweep  --store DIR --identity 80 85 90 --length 300 500 1000 --scaffold 10000 20000
+    python hit_store.py export --store DIR --identity 85 --length 500 --scaffold 20000 --output filtered.tsv
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from blast_filter import (
+    COLUMNS, COLUMN_DTYPES, IDENTITY_THRESHOLD, ALIGNMENT_LENGTH_THRESHOLD, SCAFFOLD_LENGTH_THRESHOLD, merge_hsps
+)
+from table_io import TableWriter
+
+META_FILE = "store.json"
+# -pident in store order (ascending), the search key of the identity cutoffs
+IDENTITY_KEY = "pident_key"
+STRING_COLUMNS = ["qseqid", "sseqid", "fungi_genome", "source"]
+NUMERIC_COLUMNS = [c for c in COLUMNS if c not in STRING_COLUMNS] + ["scaffold_length"]
+NUMERIC_DTYPES = dict({c: COLUMN_DTYPES[c] for c in COLUMNS if c not in STRING_COLUMNS}, scaffold_length="int64")
+EXPORT_CHUNK_ROWS = 1000000
+
+# ─── WRITING ────────────────────────────────────────────────────────────────────
+class HitStoreWriter:
+    """
+    Appends filtered hit tables (one per BLAST file) to raw column files, then
+    sorts them into the final store in close().
+    """
+
+    def __init__(self, store_dir, floors):
+        self.store_dir = store_dir
+        self.floors = floors
+        self.build_dir = os.path.join(store_dir, ".build")
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+        os.makedirs(self.build_dir)
+        self.vocab = {c: {} for c in STRING_COLUMNS}
+        self.handles = {c: open(self._raw(c), "wb") for c in NUMERIC_COLUMNS + STRING_COLUMNS}
+        self.rows = 0
+
+    def _raw(self, column):
+        return os.path.join(self.build_dir, column + ".bin")
+
+    def _codes(self, column, values):
+        """Integer codes of a string column, extending the vocabulary as needed."""
+        vocab = self.vocab[column]
+        codes, uniques = pd.factorize(values)
+        mapping = np.array([vocab.setdefault(u, len(vocab)) for u in uniques], dtype=np.uint32)
+        return mapping[codes]
+
+    def append(self, hits, source):
+        """Adds the hits of one BLAST file (with 'fungi_genome' and 'scaffold_length' columns)."""
+        if hits is None or hits.empty:
+            return
+        for column in NUMERIC_COLUMNS:
+            hits[column].to_numpy(dtype=NUMERIC_DTYPES[column]).tofile(self.handles[column])
+        for column in ("qseqid", "sseqid", "fungi_genome"):
+            self._codes(column, hits[column].to_numpy(dtype=object)).tofile(self.handles[column])
+        self._codes("source", np.full(len(hits), source, dtype=object)).tofile(self.handles["source"])
+        self.rows += len(hits)
+
+    def close(self):
+        """Sorts all rows by decreasing identity and writes the final arrays."""
+        for handle in self.handles.values():
+            handle.close()
+
+        pident = np.fromfile(self._raw("pident"), dtype=NUMERIC_DTYPES["pident"])
+        # Stable sort: rows of equal identity keep their original order
+        order = np.argsort(-pident, kind="stable")
+        np.save(os.path.join(self.store_dir, IDENTITY_KEY + ".npy"), -pident[order])
+        del pident
+        np.save(os.path.join(self.store_dir, "row.npy"), order.astype(np.uint64))
+
+        for column in NUMERIC_COLUMNS + STRING_COLUMNS:
+            dtype = NUMERIC_DTYPES.get(column, np.uint32)
+            values = np.fromfile(self._raw(column), dtype=dtype)
+            np.save(os.path.join(self.store_dir, column + ".npy"), values[order])
+        for column in STRING_COLUMNS:
+            words = list(self.vocab[column])
+            np.save(os.path.join(self.store_dir, column + ".vocab.npy"), np.array(words, dtype=object), allow_pickle=True)
+
+        # Metadata last: a store without it is incomplete
+        tmp_meta = os.path.join(self.store_dir, META_FILE + ".tmp")
+        with open(tmp_meta, "w") as f:
+            json.dump({"rows": self.rows, "floors": self.floors}, f)
+        os.replace(tmp_meta, os.path.join(self.store_dir, META_FILE))
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+
+# ─── READING ────────────────────────────────────────────────────────────────────
+class HitStore:
+    """Read-only view of a store directory (columns are memory-mapped)."""
+
+    def __init__(self, store_dir):
+        meta_path = os.path.join(store_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No complete hit store in {store_dir}")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        self.store_dir = store_dir
+        self.floors = self.meta["floors"]
+        self._columns = {}
+        self._vocab = {}
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(os.path.join(self.store_dir, name + ".npy"), mmap_mode="r")
+        return self._columns[name]
+
+    def vocab(self, name):
+        if name not in self._vocab:
+            self._vocab[name] = np.load(os.path.join(self.store_dir, name + ".vocab.npy"), allow_pickle=True)
+        return self._vocab[name]
+
+    def check_floors(self, min_identity, min_length, min_scaffold):
+        """Thresholds below the floors the store was built with would silently miss hits."""
+        for name, value in (("identity", min_identity), ("length", min_length), ("scaffold", min_scaffold)):
+            if value < self.floors[name]:
+                raise ValueError(f"{name} threshold {value} is below the store floor {self.floors[name]}")
+
+    def prefix(self, min_identity):
+        """Number of leading rows with pident >= min_identity (a binary search on the memory map)."""
+        return int(np.searchsorted(self.column(IDENTITY_KEY), -np.float32(min_identity), side="right"))
+
+    def select(self, min_identity, min_length, min_scaffold):
+        """Store positions of the hits passing the three thresholds, in original output order."""
+        n = self.prefix(min_identity)
+        mask = (self.column("length")[:n] >= min_length) & \
+               (self.column("scaffold_length")[:n] >= min_scaffold)
+        positions = np.flatnonzero(mask)
+        return positions[np.argsort(self.column("row")[positions], kind="stable")]
+
+    def frame(self, positions):
+        """Decoded hit table (standard filtered columns) for the given store positions."""
+        data = {}
+        for column in COLUMNS + ["fungi_genome"]:
+            values = self.column(column)[positions]
+            if column in STRING_COLUMNS:
+                values = self.vocab(column)[values]
+            data[column] = values
+        return pd.DataFrame(data)
+
+# ─── SWEEP / EXPORT ─────────────────────────────────────────────────────────────
+def sweep(store, identities, lengths, scaffolds):
+    """Hits, distinct plant scaffolds (sseqid) and distinct fungal scaffolds (qseqid) per threshold combination."""
+    rows = []
+    scaffold_length = store.column("scaffold_length")
+    length = store.column("length")
+    qseqid, sseqid = store.column("qseqid"), store.column("sseqid")
+    n_q, n_s = len(store.vocab("qseqid")), len(store.vocab("sseqid"))
+    for min_identity in identities:
+        n = store.prefix(min_identity)
+        # One prefix per identity cutoff; the other two cutoffs are masks over it
+        prefix_length, prefix_scaffold = np.asarray(length[:n]), np.asarray(scaffold_length[:n])
+        prefix_q, prefix_s = np.asarray(qseqid[:n]), np.asarray(sseqid[:n])
+        for min_length, min_scaffold in itertools.product(lengths, scaffolds):
+            store.check_floors(min_identity, min_length, min_scaffold)
+            mask = (prefix_length >= min_length) & (prefix_scaffold >= min_scaffold)
+            rows.append({
+                "min_identity": min_identity, "min_length": min_length, "min_scaffold": min_scaffold,
+                "hits": int(mask.sum()),
+                "unique_sseqid": int(np.count_nonzero(np.bincount(prefix_s[mask], minlength=n_s))),
+                "unique_qseqid": int(np.count_nonzero(np.bincount(prefix_q[mask], minlength=n_q))),
+            })
+    return pd.DataFrame(rows)
+
+def export(store, output, min_identity, min_length, min_scaffold, merge_loci=False, merge_gap=0):
+    """Writes the hits of one threshold combination exactly as 2-filter_blast_results.py would."""
+    store.check_floors(min_identity, min_length, min_scaffold)
+    positions = store.select(min_identity, min_length, min_scaffold)
+    if len(positions) == 0:
+        return 0
+
+    writer = TableWriter(output)
+    if merge_loci:
+        # Loci are merged per BLAST file, as in script 2
+        sources = store.column("source")[positions]
+        bounds = np.flatnonzero(np.diff(sources)) + 1
+        groups = np.split(positions, bounds)
+    else:
+        groups = [positions[i:i + EXPORT_CHUNK_ROWS] for i in range(0, len(positions), EXPORT_CHUNK_ROWS)]
+    for group in groups:
+        hits = store.frame(group).astype({c: t for c, t in COLUMN_DTYPES.items() if c not in STRING_COLUMNS})
+        if merge_loci:
+            hits = merge_hsps(hits, merge_gap)
+        writer.write(hits)
+    writer.close()
+    return writer.rows
+
+# ─── COMMAND LINE ───────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Explore primary-filter thresholds on a hit store built by Script 2.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_sweep = sub.add_parser("sweep", help="Count surviving hits for every threshold combination")
+    p_sweep.add_argument("--store", required=True, help="Hit store directory (2-filter_blast_results.py --hit_store)")
+    p_sweep.add_argument("--identity", type=float, nargs="+", default=[IDENTITY_THRESHOLD], help="Identity cutoffs (%%)")
+    p_sweep.add_argument("--length", type=int, nargs="+", default=[ALIGNMENT_LENGTH_THRESHOLD], help="Alignment length cutoffs (bp)")
+    p_sweep.add_argument("--scaffold", type=int, nargs="+", default=[SCAFFOLD_LENGTH_THRESHOLD], help="Fungal scaffold length cutoffs (bp)")
+    p_sweep.add_argument("--output", help="Also save the table as TSV")
+
+    p_export = sub.add_parser("export", help="Write the standard filtered TSV for one threshold combination")
+    p_export.add_argument("--store", required=True, help="Hit store directory (2-filter_blast_results.py --hit_store)")
+    p_export.add_argument("--identity", type=float, default=IDENTITY_THRESHOLD, help="Identity cutoff (%%)")
+    p_export.add_argument("--length", type=int, default=ALIGNMENT_LENGTH_THRESHOLD, help="Alignment length cutoff (bp)")
+    p_export.add_argument("--scaffold", type=int, default=SCAFFOLD_LENGTH_THRESHOLD, help="Fungal scaffold length cutoff (bp)")
+    p_export.add_argument("--output", default="filtered_blast_results_with_fungi.tsv", help="Output table (TSV, or Parquet if it ends in .parquet)")
+    p_export.add_argument("--merge_loci", action="store_true", help="Collapse overlapping HSPs into loci (as Script 2 --merge_loci)")
+    p_export.add_argument("--merge_gap", type=int, default=0, help="With --merge_loci, also merge HSPs at most this many bp apart")
+
+    args = parser.parse_args()
+    try:
+        store = HitStore(args.store)
+        print(f"[INFO] Hit store {args.store}: {len(store)} hits (floors: {store.floors})")
+        if args.command == "sweep":
+            table = sweep(store, args.identity, args.length, args.scaffold)
+            print(table.to_string(index=False))
+            if args.output:
+                table.to_csv(args.output, sep="\t", index=False)
+                print(f"[SUCCESS] Sweep saved to {args.output}")
+        else:
+            kept = export(store, args.output, args.identity, args.length, args.scaffold, args.merge_loci, args.merge_gap)
+            if kept:
+                print(f"[SUCCESS] {kept} hits saved to {args.output}")
+            else:
+                print("[WARNING] No hits passed the filters. Output file not created.")
+    except (FileNotFoundError, ValueError) as e:
+        sys.exit(f"[ERROR] {e}")
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run instrumentation shared by the pipeline scripts.
+
+Scripts wrap their phases and external tool calls in timed spans that count the
+rows and bytes they process; at exit a report is written with the wall time,
+throughput of every span and the script's peak RSS when it ended, plus CPU
+time and peak RSS of the whole run and the CPU time of its child processes. The peak RSS of each external tool
+(its whole process tree) is sampled from /proc while it runs, on Linux only:
+ru_maxrss of a child starts from the peak of the process it was forked from,
+so it cannot tell a small tool started by a large script. A cProfile dump of
+the main thread can be written alongside.
+
+    import instrument
+    instrument.add_arguments(parser)                 # --report, --profile
+    args = parser.parse_args()
+    instrument.start(args)
+    with instrument.span("filter") as s:
+        ...
+        s.add(rows=len(chunk), bytes=size)
+    instrument.run(["mafft", ...], stdout=f)         # subprocess.run in a "tool:mafft" span
+    with instrument.span("tool:blastn") as s:        # a tool started with Popen
+        process = subprocess.Popen(...)
+        with instrument.watch(process, s):
+            ...
+
+Nothing is recorded unless --report/--profile is given or HT_REPORT_DIR is set
+(every script then writes <script>.json there, e.g. for a whole pipeline run).
+
+    python instrument.py compare old/2-filter_blast_results.json new/2-filter_blast_results.json
+"""
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import atexit
+import cProfile
+import argparse
+import resource
+import threading
+import subprocess
+from contextlib import contextmanager
+
+REPORT_DIR_ENV = "HT_REPORT_DIR"
+SPAN_COLUMNS = ["name", "parent", "thread", "start_s", "wall_s", "rows", "bytes",
+                "rows_per_s", "mb_per_s", "peak_rss_so_far_mb", "tool_peak_rss_mb", "returncode"]
+# Seconds between two samples of a running tool's memory
+POLL_INTERVAL = 0.05
+HAS_PROC = os.path.exists("/proc/self/status")
+
+# ─── MEASUREMENTS ───────────────────────────────────────────────────────────────
+def status_kb(pid, field):
+    """A kB field of /proc/<pid>/status (VmRSS, VmHWM), None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB. VmHWM where /proc
+    exists, since ru_maxrss also counts the peak of the parent before exec.
+    """
+    peak_kb = status_kb("self", "VmHWM") if HAS_PROC else None
+    if peak_kb is not None:
+        return round(peak_kb / 1024, 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+def process_tree(pid):
+    """pid and all its descendants (from /proc/<pid>/task/*/children)."""
+    pids = [pid]
+    for parent in pids:
+        for children in glob.glob(f"/proc/{parent}/task/*/children"):
+            try:
+                with open(children) as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except (OSError, ValueError):
+                pass
+    return pids
+
+class ToolMonitor:
+    """
+    Samples the memory of a tool's process tree in a background thread: the
+    peak is the largest total VmRSS seen (or the tool's own VmHWM, if larger).
+    """
+
+    def __init__(self, pid, interval=POLL_INTERVAL):
+        self.pid = pid
+        self.peak_kb = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._poll, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def _sample(self):
+        total = sum(status_kb(pid, "VmRSS") or 0 for pid in process_tree(self.pid))
+        self.peak_kb = max(self.peak_kb, total, status_kb(self.pid, "VmHWM") or 0)
+
+    def _poll(self, interval):
+        self._sample()
+        while not self.stopped.wait(interval):
+            self._sample()
+
+    def stop(self):
+        """Stops sampling; returns the peak in MB."""
+        self.stopped.set()
+        self.thread.join()
+        return round(self.peak_kb / 1024, 1)
+
+def rate(amount, seconds, scale=1):
+    return round(amount / scale / seconds, 1) if amount and seconds > 0 else 0
+
+class Span:
+    """One timed phase; add() counts the rows and bytes it processed."""
+
+    def __init__(self, name, parent="", rows=0, bytes=0):
+        self.name = name
+        self.parent = parent
+        self.rows = rows
+        self.bytes = bytes
+        self.returncode = None
+        self.tool_peak_rss = None
+
+    def add(self, rows=0, bytes=0):
+        self.rows += rows
+        self.bytes += bytes
+
+    def record(self, origin):
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "thread": self.thread,
+            "start_s": round(self.start - origin, 4),
+            "wall_s": round(self.wall, 4),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "rows_per_s": rate(self.rows, self.wall),
+            "mb_per_s": rate(self.bytes, self.wall, 1e6),
+            # VmHWM is cumulative: the peak of the whole script up to the end of the span
+            "peak_rss_so_far_mb": self.peak_rss_so_far,
+            "tool_peak_rss_mb": self.tool_peak_rss,
+            "returncode": self.returncode,
+        }
+
+# ─── RECORDER ───────────────────────────────────────────────────────────────────
+class Recorder:
+    """Collects the spans of one run and writes the report and profile at exit."""
+
+    def __init__(self, script, report=None, profile=None):
+        self.script = script
+        self.report = report
+        self.profile = profile
+        self.pid = os.getpid()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.profiler = None
+        if profile:
+            # cProfile only follows the thread that enabled it
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def span(self, name, rows=0, bytes=0):
+        stack = self.local.__dict__.setdefault("stack", [])
+        s = Span(name, stack[-1].name if stack else "", rows, bytes)
+        s.thread = threading.current_thread().name
+        s.start = time.perf_counter()
+        stack.append(s)
+        try:
+            yield s
+        finally:
+            stack.pop()
+            s.wall = time.perf_counter() - s.start
+            s.peak_rss_so_far = peak_rss_mb()
+            with self.lock:
+                self.spans.append(s)
+
+    def summary(self, spans):
+        """Spans aggregated by name, in order of first appearance."""
+        by_name = {}
+        for s in spans:
+            total = by_name.setdefault(s["name"], {"name": s["name"], "count": 0, "wall_s": 0.0, "rows": 0, "bytes": 0})
+            total["count"] += 1
+            total["wall_s"] += s["wall_s"]
+            total["rows"] += s["rows"]
+            total["bytes"] += s["bytes"]
+        for total in by_name.values():
+            total["wall_s"] = round(total["wall_s"], 4)
+            total["rows_per_s"] = rate(total["rows"], total["wall_s"])
+            total["mb_per_s"] = rate(total["bytes"], total["wall_s"], 1e6)
+        return list(by_name.values())
+
+    def finish(self):
+        # Forked workers inherit the recorder; only the process that started it reports
+        if os.getpid() != self.pid:
+            return
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            print(f"[INFO] Profile saved to {self.profile}")
+        if not self.report:
+            return
+        # From start(): module imports (pandas, ...) are only in the CPU times
+        wall = time.perf_counter() - self.origin
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self.lock:
+            spans = [s.record(self.origin) for s in sorted(self.spans, key=lambda s: s.start)]
+        tool_peaks = [s["tool_peak_rss_mb"] for s in spans if s["tool_peak_rss_mb"] is not None]
+        run = {
+            "script": self.script,
+            "argv": sys.argv[1:],
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_s": round(wall, 4),
+            "cpu_user_s": round(own.ru_utime, 4),
+            "cpu_sys_s": round(own.ru_stime, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "children_cpu_s": round(children.ru_utime + children.ru_stime, 4),
+            # Largest single tool; None if no tool was measured
+            "tools_peak_rss_mb": max(tool_peaks, default=None),
+            "spans": spans,
+            "summary": self.summary(spans),
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.report)), exist_ok=True)
+        tmp = self.report + ".tmp"
+        with open(tmp, "w", newline="") as f:
+            if self.report.endswith(".csv"):
+                writer = csv.DictWriter(f, fieldnames=SPAN_COLUMNS)
+                writer.writeheader()
+                writer.writerows(spans)
+                # The whole run as a last row
+                writer.writerow({"name": "total", "start_s": 0, "wall_s": run["wall_s"],
+                                 "peak_rss_so_far_mb": run["peak_rss_mb"], "tool_peak_rss_mb": run["tools_peak_rss_mb"]})
+            else:
+                json.dump(run, f, indent=1)
+        os.replace(tmp, self.report)
+        print(f"[INFO] Run report saved to {self.report}")
+
+_recorder = None
+
+# ─── SCRIPT INTERFACE ───────────────────────────────────────────────────────────
+def add_arguments(parser):
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument("--report", help="Write timings, throughput and peak memory per phase (.json or .csv)")
+    group.add_argument("--profile", help="Write a cProfile dump of the run (.prof)")
+
+def start(args=None, name=None):
+    """Starts recording if a report or profile was asked for (or HT_REPORT_DIR is set)."""
+    global _recorder
+    script = name or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    report = getattr(args, "report", None)
+    profile = getattr(args, "profile", None)
+    if not report and os.environ.get(REPORT_DIR_ENV):
+        report = os.path.join(os.environ[REPORT_DIR_ENV], f"{script}.json")
+    if _recorder or not (report or profile):
+        return
+    _recorder = Recorder(script, report, profile)
+    atexit.register(_recorder.finish)
+
+@contextmanager
+def span(name, rows=0, bytes=0):
+    """Times the block as one phase; the yielded Span counts rows/bytes with add()."""
+    if _recorder is None:
+        yield Span(name, rows=rows, bytes=bytes)
+        return
+    with _recorder.span(name, rows, bytes) as s:
+        yield s
+
+@contextmanager
+def watch(process, s):
+    """Records the peak RSS of a started tool's process tree on its span while the block runs."""
+    if _recorder is None or not HAS_PROC:
+        yield
+        return
+    monitor = ToolMonitor(process.pid)
+    try:
+        yield
+    finally:
+        s.tool_peak_rss = monitor.stop()
+
+def run(cmd, input=None, capture_output=False, check=False, **kwargs):
+    """subprocess.run timed as a 'tool:<executable>' span, with the tool's peak RSS."""
+    if _recorder is None:
+        return subprocess.run(cmd, input=input, capture_output=capture_output, check=check, **kwargs)
+    if capture_output:
+        kwargs["stdout"] = kwargs["stderr"] = subprocess.PIPE
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    with span(f"tool:{os.path.basename(str(cmd[0]))}") as s:
+        with subprocess.Popen(cmd, **kwargs) as process:
+            with watch(process, s):
+                stdout, stderr = process.communicate(input)
+        s.returncode = process.returncode
+    result = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+    if check:
+        result.check_returncode()
+    return result
+
+# ─── REPORT COMPARISON ──────────────────────────────────────────────────────────
+def compare(old_path, new_path, threshold):
+    """Prints the change of every span between two JSON reports; returns the number of regressions."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_spans = {s["name"]: s for s in old["summary"]}
+    rows = [("total", old["wall_s"], new["wall_s"])]
+    rows += [(s["name"], old_spans[s["name"]]["wall_s"] if s["name"] in old_spans else None, s["wall_s"])
+             for s in new["summary"]]
+
+    regressions = 0
+    print(f"{'span':<32} {'old s':>10} {'new s':>10} {'change':>8}")
+    for span_name, before, after in rows:
+        if before is None:
+            print(f"{span_name:<32} {'-':>10} {after:>10.3f} {'new':>8}")
+            continue
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ""
+        if change > threshold and after - before > 0.01:
+            flag = "  <- slower"
+            regressions += 1
+        print(f"{span_name:<32} {before:>10.3f} {after:>10.3f} {change:>+8.1%}{flag}")
+    new_names = {s["name"] for s in new["summary"]}
+    for s in old["summary"]:
+        if s["name"] not in new_names:
+            print(f"{s['name']:<32} {s['wall_s']:>10.3f} {'-':>10} {'gone':>8}")
+    print(f"{'peak RSS (MB)':<32} {old['peak_rss_mb']:>10} {new['peak_rss_mb']:>10}")
+    # Largest single tool; None if no tool was measured
+    tools = ["-" if report["tools_peak_rss_mb"] is None else str(report["tools_peak_rss_mb"]) for report in (old, new)]
+    print(f"{'largest tool peak RSS (MB)':<32} {tools[0]:>10} {tools[1]:>10}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two run reports written with --report (.json).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_compare = sub.add_parser("compare", help="Per-span wall time changes between two runs")
+    p_compare.add_argument("old", help="Report of the reference run")
+    p_compare.add_argument("new", help="Report of the run to check")
+    p_compare.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    regressions = compare(args.old, args.new, args.threshold)
+    if regressions:
+        print(f"[WARNING] {regressions} spans slower by more than {args.threshold:.0%}")
+        sys.exit(1)
+    print("[SUCCESS] No regressions.")
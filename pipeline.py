@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single entry point for steps 1-9 (plus tree screening with --taxonomy).
+
+Every step is a stage with declared inputs, outputs and external tools, and a
+stage depends on the stages producing its inputs. A stage is skipped when
+nothing it depends on changed since it last succeeded: the content hash of its
+inputs, its command line (parameters), the pipeline scripts and modules, and
+the executables of its tools. Stages whose inputs are ready run at the same
+time under a shared core budget. Every finished stage is recorded at once, so
+rerunning the same command after a failure restarts from the failed stage.
+
+    python pipeline.py --plant_genomes ./data/plant_genomes --fungi_genomes ./data/fungi_genomes \\
+        --plant_fai ./data/plant_indices --fungi_fai ./data/fungi_indices \\
+        --eggnog_db /path/to/eggnog_data --nt_db /path/to/ncbi_nt_db --cores 64
+"""
+import os
+import sys
+import glob
+import json
+import shlex
+import shutil
+import argparse
+import threading
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from content_cache import FileHashes, cache_key
+from cpu_budget import CoreBudget
+from fasta_io import FASTA_EXTENSIONS, GZIP_EXTENSIONS
+from instrument import REPORT_DIR_ENV
+
+# ─── ARGUMENT PARSING ───────────────────────────────────────────────────────────
+parser = argparse.ArgumentParser(description="Run the HT pipeline (steps 1-9) as a DAG of cached stages.")
+parser.add_argument("--plant_genomes", required=True, help="Directory containing Plant genome FASTAs")
+parser.add_argument("--fungi_genomes", required=True, help="Directory containing Fungi genome FASTAs")
+parser.add_argument("--plant_fai", required=True, help="Directory containing Plant .fai index files")
+parser.add_argument("--fungi_fai", required=True, help="Directory containing Fungi .fai index files")
+parser.add_argument("--eggnog_db", required=True, help="EggNOG-mapper data directory (Script 7)")
+parser.add_argument("--nt_db", required=True, help="BLAST database for the phylogenies (Script 9)")
+parser.add_argument("--taxonomy", help="Homolog taxonomy TSV; adds the tree screening stage (Script 10)")
+parser.add_argument("-w", "--workdir", default=".", help="Directory where every stage runs and writes its outputs")
+parser.add_argument("-c", "--cores", type=int, default=os.cpu_count(), help="Total core budget shared by the running stages")
+parser.add_argument("--prep_cores", type=int, help="Cores left to the BLAST database and scaffold index builds while Step 1 runs (default: cores/8)")
+parser.add_argument("--parallel", type=int, default=3, help="Most stages running at the same time")
+parser.add_argument("--stage_args", action="append", default=[], metavar="STAGE=ARGS",
+                    help="Extra arguments for one stage's script, e.g. 'distribution=--max_fraction 0.3' (repeatable)")
+parser.add_argument("--force", action="append", default=[], metavar="STAGE", help="Rerun this stage even if it is up to date (repeatable)")
+parser.add_argument("--until", metavar="STAGE", help="Stop after this stage (only it and the stages it depends on are run)")
+parser.add_argument("--dry_run", action="store_true", help="Only show which stages are up to date and which would run")
+parser.add_argument("--reports", action="store_true", help="Have every stage write its timing/memory report (instrument.py) to .pipeline/reports")
+
+args = parser.parse_args()
+
+# ─── CONFIGURATION ──────────────────────────────────────────────────────────────
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = ".pipeline"
+STATE_FILE = os.path.join(STATE_DIR, "state.json")
+LOG_DIR = os.path.join(STATE_DIR, "logs")
+REPORT_DIR = os.path.join(STATE_DIR, "reports")
+FILE_HASHES_FILE = os.path.join(STATE_DIR, "file_hashes.json")
+
+GENOME_PATTERNS = tuple("*" + ext for ext in FASTA_EXTENSIONS + GZIP_EXTENSIONS)
+# Every stage also depends on the shared modules (blast_filter.py, table_io.py, ...)
+SHARED_MODULES = sorted(p for p in glob.glob(os.path.join(SCRIPT_DIR, "*.py"))
+                        if not os.path.basename(p)[0].isdigit() and os.path.basename(p) != "pipeline.py")
+
+# Intermediate files passed between the scripts
+FILTERED = "filtered_blast_results_with_fungi.tsv"
+PLANT_RESULTS = "plant_alignment_results.tsv"
+CANDIDATES = "ht_candidates.tsv"
+ANNOTATIONS = "ht_annotations.emapper.annotations"
+
+# ─── STAGES ─────────────────────────────────────────────────────────────────────
+class Stage:
+    """
+    One pipeline step. inputs are (path, patterns, stat_only) entries, outputs
+    are files or directories; `after` adds dependencies that are not files
+    (e.g. BLAST databases written next to the genomes).
+    """
+
+    def __init__(self, name, command, inputs, outputs, tools=(), after=(), threads=1):
+        self.name = name
+        self.command = [str(part) for part in command]
+        self.inputs = inputs
+        self.outputs = outputs
+        self.tools = tools
+        self.after = after
+        self.threads = threads
+
+def files(path, *patterns):
+    """Input hashed by content: a file, or the files of a directory matching patterns."""
+    return (path, patterns or ("*",), False)
+
+def external(path, *patterns):
+    """Input identified by file size and mtime only (large reference databases, raw BLAST outputs)."""
+    return (path, patterns or ("*",), True)
+
+def script(name):
+    return os.path.join(SCRIPT_DIR, name)
+
+def build_stages(extra_args):
+    plant, fungi = args.plant_genomes, args.fungi_genomes
+    plant_fai, fungi_fai = args.plant_fai, args.fungi_fai
+    cores = max(1, args.cores)
+    prep_cores = args.prep_cores or max(1, cores // 8)
+    py = [sys.executable]
+
+    stages = [
+        # Independent of Step 1: built while the genome-wide search runs
+        Stage("plant_dbs", py + [script("4-FindNonUbiquitousSequences.py"), "-p", plant, "--databases_only", "-j", prep_cores],
+              inputs=[files(plant, "*.fasta", "*.fa", "*.fna")], outputs=[], tools=["makeblastdb"], threads=prep_cores),
+        Stage("scaffold_index", py + [script("scaffold_index.py"), "--fungi_fai", fungi_fai, "--plant_fai", plant_fai, "--index", "scaffold_index"],
+              inputs=[files(fungi_fai, "*.fai"), files(plant_fai, "*.fai")], outputs=["scaffold_index"]),
+        Stage("blast", py + [script("1-BlastWholeGenomes.py"), plant, fungi, "-o", "blastresults", "-c", max(1, cores - prep_cores), "--delta"],
+              inputs=[files(plant, "*.fasta"), files(fungi, "*.fasta")], outputs=["blastresults"],
+              tools=["hs-blastn"], threads=max(1, cores - prep_cores)),
+        Stage("filter", py + [script("2-filter_blast_results.py"), "--blast_dir", "blastresults", "--fungi_fai", fungi_fai,
+                              "--plant_fai", plant_fai, "--scaffold_index", "scaffold_index", "--output", FILTERED, "-j", cores],
+              inputs=[external("blastresults", "*.blast"), files("scaffold_index"), files(fungi_fai, "*.fai"), files(plant_fai, "*.fai")],
+              outputs=[FILTERED], threads=cores),
+        Stage("extract", py + [script("3-extractfasta.py"), "-i", FILTERED, "-p", plant, "--fai_dir", plant_fai,
+                               "-o", "selected_sequences", "-j", cores],
+              inputs=[files(FILTERED), files(plant, *GENOME_PATTERNS), files(plant_fai, "*.fai")],
+              outputs=["selected_sequences"], threads=cores),
+        Stage("distribution", py + [script("4-FindNonUbiquitousSequences.py"), "-s", "selected_sequences", "-p", plant,
+                                    "-c", cores, "-o", PLANT_RESULTS, "--keep_query"],
+              inputs=[files("selected_sequences", "*.fasta", "*.fa"), files(plant, "*.fasta", "*.fa", "*.fna")],
+              outputs=[PLANT_RESULTS, os.path.join("plant_blast_outputs", "candidate_distribution.tsv"), "all_candidates_query.fasta"],
+              tools=["blastn", "makeblastdb"], after=["plant_dbs"], threads=cores),
+        Stage("compare", py + [script("5-CompareBlastResults.py"), "--fungi_results", FILTERED, "--plant_results", PLANT_RESULTS,
+                               "--output", "fungi_vs_plant_comparison.tsv", "--candidates_out", CANDIDATES],
+              inputs=[files(FILTERED), files(PLANT_RESULTS)], outputs=["fungi_vs_plant_comparison.tsv", CANDIDATES]),
+        Stage("candidates", py + [script("6-extractHTcandidates.py"), "-i", CANDIDATES, "-g", fungi, "--fai_dir", fungi_fai,
+                                  "-o", "ht_candidates.fasta", "-j", cores],
+              inputs=[files(CANDIDATES), files(fungi, *GENOME_PATTERNS), files(fungi_fai, "*.fai")],
+              outputs=["ht_candidates.fasta"], threads=cores),
+        Stage("annotate", ["bash", script("7-cluster_and_annotate_candidates.sh"), args.eggnog_db],
+              inputs=[files("ht_candidates.fasta"), external(args.eggnog_db)], outputs=["ht_clusters.fasta", ANNOTATIONS],
+              tools=["cd-hit", "emapper.py", "diamond"], threads=8),
+        Stage("housekeeping", py + [script("8-filteringhousekeeping.py"), "--annotations", ANNOTATIONS,
+                                    "--fasta_in", "ht_clusters.fasta", "--fasta_out", "hgt_filtered.fasta"],
+              inputs=[files(ANNOTATIONS), files("ht_clusters.fasta")], outputs=["hgt_filtered.fasta"]),
+        Stage("phylogenies", py + [script("9-build_phylogenies.py"), "-i", "hgt_filtered.fasta", "-db", args.nt_db,
+                                   "-o", "phylogenies", "-c", cores],
+              inputs=[files("hgt_filtered.fasta"), external(args.nt_db, ".*")], outputs=["phylogenies"],
+              tools=["blastn", "mafft", "trimal", "iqtree"], threads=cores),
+    ]
+    if args.taxonomy:
+        stages.append(Stage("screening", py + [script("10-screen_trees.py"), "-d", "phylogenies", "--taxonomy", args.taxonomy,
+                                               "-o", "tree_screening.tsv", "-j", cores],
+                            inputs=[files("phylogenies", "*.treefile"), files(args.taxonomy)],
+                            outputs=["tree_screening.tsv"], threads=cores))
+
+    names = {stage.name for stage in stages}
+    for name in extra_args:
+        if name not in names:
+            sys.exit(f"[ERROR] Unknown stage '{name}' (stages: {', '.join(sorted(names))})")
+    for stage in stages:
+        stage.command += extra_args.get(stage.name, [])
+    return stages
+
+def dependencies(stages):
+    """{stage name: names of the stages it waits for}."""
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {stage.name: {producers[path] for path, _, _ in stage.inputs if path in producers} | set(stage.after)
+            for stage in stages}
+
+# ─── HASHING ────────────────────────────────────────────────────────────────────
+hash_lock = threading.Lock()
+
+def input_members(path, patterns):
+    """Files of one input: the file itself, a directory's matching files, or a prefix's ('db' + '.*')."""
+    if os.path.isfile(path):
+        return [path]
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(path):
+            found.update(glob.glob(os.path.join(glob.escape(path), pattern)))
+        else:
+            found.update(glob.glob(glob.escape(path) + pattern))
+    return sorted(p for p in found if os.path.isfile(p))
+
+def input_digest(hashes, path, patterns, stat_only):
+    lines = []
+    for member in input_members(path, patterns):
+        if stat_only:
+            st = os.stat(member)
+            lines.append(f"{os.path.basename(member)}:{st.st_size}:{st.st_mtime_ns}")
+        else:
+            lines.append(f"{os.path.basename(member)}:{hashes.digest(member)}")
+    return cache_key(path, *lines)
+
+def tool_fingerprint(hashes, tool):
+    """A tool is identified by the contents of its executable."""
+    path = shutil.which(tool)
+    return f"{tool}:{hashes.digest(os.path.realpath(path)) if path else 'missing'}"
+
+def stage_key(hashes, stage):
+    """Hash of everything the stage's outputs depend on."""
+    with hash_lock:
+        code = [hashes.digest(p) for p in SHARED_MODULES + [part for part in stage.command if part.startswith(SCRIPT_DIR)]
+                if os.path.isfile(p)]
+        tools = [tool_fingerprint(hashes, tool) for tool in stage.tools]
+        inputs = [input_digest(hashes, *entry) for entry in stage.inputs]
+        hashes.save()
+    return cache_key(stage.name, "\0".join(stage.command), *code, *tools, *inputs)
+
+def up_to_date(state, stage, key):
+    return state.get(stage.name) == key and all(os.path.exists(output) for output in stage.outputs)
+
+# ─── STATE ──────────────────────────────────────────────────────────────────────
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+def save_state(state):
+    with open(STATE_FILE + ".tmp", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(STATE_FILE + ".tmp", STATE_FILE)
+
+# ─── EXECUTION ──────────────────────────────────────────────────────────────────
+def run_stage(stage, budget):
+    """Runs one stage with its output in LOG_DIR/<stage>.log. Raises on failure."""
+    log_path = os.path.join(LOG_DIR, f"{stage.name}.log")
+    env = None
+    if args.reports:
+        # The stage's scripts (Step 7 through annotation_cache.py) write REPORT_DIR/<stage>/<script>.json
+        env = dict(os.environ, **{REPORT_DIR_ENV: os.path.abspath(os.path.join(REPORT_DIR, stage.name))})
+    threads = budget.acquire(stage.threads)
+    try:
+        print(f"[INFO] {stage.name}: running ({threads} cores, log: {log_path})")
+        with open(log_path, "w") as log:
+            log.write("$ " + shlex.join(stage.command) + "\n")
+            log.flush()
+            result = subprocess.run(stage.command, stdout=log, stderr=subprocess.STDOUT, env=env)
+    finally:
+        budget.release(threads)
+    if result.returncode != 0:
+        raise RuntimeError(f"exit code {result.returncode}, see {log_path}")
+    missing = [output for output in stage.outputs if not os.path.exists(output)]
+    if missing:
+        raise RuntimeError(f"outputs not created: {', '.join(missing)} (see {log_path})")
+
+def run_pipeline(stages, state, hashes):
+    """Runs the stages as their dependencies finish. Returns (run, skipped, failed) stage names."""
+    depends_on = dependencies(stages)
+    budget = CoreBudget(args.cores)
+    done, failed, blocked = set(), set(), set()
+    ran, skipped = [], []
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+        while True:
+            changed = True
+            while changed:
+                changed = False
+                for stage in stages:
+                    name = stage.name
+                    if name in done or name in failed or name in blocked or any(s.name == name for s, _ in running.values()):
+                        continue
+                    if depends_on[name] & (failed | blocked):
+                        print(f"[WARNING] {name}: not run, an upstream stage failed")
+                        blocked.add(name)
+                        changed = True
+                    elif depends_on[name] <= done and len(running) < args.parallel:
+                        key = stage_key(hashes, stage)
+                        if up_to_date(state, stage, key):
+                            print(f"[INFO] {name}: up to date, skipped")
+                            done.add(name)
+                            skipped.append(name)
+                            changed = True
+                        else:
+                            running[executor.submit(run_stage, stage, budget)] = (stage, key)
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, key = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"[ERROR] {stage.name}: {e}", file=sys.stderr)
+                    failed.add(stage.name)
+                    state.pop(stage.name, None)
+                else:
+                    print(f"[INFO] {stage.name}: done")
+                    done.add(stage.name)
+                    ran.append(stage.name)
+                    # Only the new key makes this stage count as complete on a rerun
+                    state[stage.name] = key
+                save_state(state)
+    return ran, skipped, sorted(failed)
+
+def dry_run(stages, state, hashes):
+    """Prints each stage's status; a stage after one that would run cannot be hashed yet."""
+    depends_on = dependencies(stages)
+    will_run = set()
+    for stage in stages:
+        if depends_on[stage.name] & will_run:
+            status = "would run (after upstream stages)"
+        elif up_to_date(state, stage, stage_key(hashes, stage)):
+            status = "up to date"
+        else:
+            status = "would run"
+        if status != "up to date":
+            will_run.add(stage.name)
+        print(f"  {stage.name:<16} {status}")
+
+def select_until(stages, target):
+    """The target stage and every stage it depends on."""
+    depends_on = dependencies(stages)
+    if target not in depends_on:
+        sys.exit(f"[ERROR] Unknown stage '{target}' (stages: {', '.join(depends_on)})")
+    wanted, todo = set(), [target]
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(depends_on[name])
+    return [stage for stage in stages if stage.name in wanted]
+
+# ─── MAIN EXECUTION ─────────────────────────────────────────────────────────────
+def main():
+    # Inputs given on the command line are resolved before moving to the workdir
+    for option in ("plant_genomes", "fungi_genomes", "plant_fai", "fungi_fai", "eggnog_db", "nt_db", "taxonomy"):
+        if getattr(args, option):
+            setattr(args, option, os.path.abspath(getattr(args, option)))
+    extra_args = {}
+    for entry in args.stage_args:
+        name, sep, extra = entry.partition("=")
+        if not sep:
+            sys.exit(f"[ERROR] --stage_args expects STAGE=ARGS, got '{entry}'")
+        extra_args.setdefault(name, []).extend(shlex.split(extra))
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    stages = build_stages(extra_args)
+    if args.until:
+        stages = select_until(stages, args.until)
+    state = load_state()
+    for name in args.force:
+        if name not in {stage.name for stage in stages}:
+            sys.exit(f"[ERROR] Unknown stage '{name}' for --force")
+        state.pop(name, None)
+    hashes = FileHashes(FILE_HASHES_FILE)
+
+    if args.dry_run:
+        print(f"[INFO] Pipeline in {os.getcwd()}:")
+        dry_run(stages, state, hashes)
+        return
+
+    print(f"[INFO] Running {len(stages)} stages in {os.getcwd()} ({args.cores} cores, up to {args.parallel} stages at once)")
+    ran, skipped, failed = run_pipeline(stages, state, hashes)
+    if failed:
+        sys.exit(f"[ERROR] Failed: {', '.join(failed)}. Rerun the same command to resume from there.")
+    print(f"[SUCCESS] Pipeline complete: {len(ran)} stages run, {len(skipped)} up to date.")
+
+if __name__ == "__main__":
+    main()
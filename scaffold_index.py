@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Consolidated scaffold-length index built from the fungal and plant .fai files.
+
+All scaffold IDs are stored in one memory-mapped array, sorted inside each
+genome segment, with a parallel array of lengths. Looking up the lengths of a
+whole column of IDs is a single np.searchsorted call instead of a dict lookup
+per row. The index remembers the size and mtime of every .fai it was built from
+and is only rebuilt when one of them changes.
+
+Usage (one-time build, also done automatically by 2-filter_blast_results.py):
+    python scaffold_index.py --fungi_fai ./data/fungi_indices \
+                             --plant_fai ./data/plant_indices \
+                             --index ./scaffold_index
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+IDS_FILE = "ids.npy"
+LENGTHS_FILE = "lengths.npy"
+META_FILE = "genomes.json"
+
+# ─── FAI PARSING ────────────────────────────────────────────────────────────────
+def read_fai(fai_path):
+    """Parses a .fai file and returns (ids, lengths) as lists."""
+    ids, lengths = [], []
+    try:
+        with open(fai_path, 'r') as f:
+            for line in f:
+                parts = line.strip().split("\t")
+                if len(parts) >= 2:
+                    ids.append(parts[0])
+                    lengths.append(int(parts[1]))
+    except Exception as e:
+        print(f"[WARNING] Could not read FAI file {fai_path}: {e}", file=sys.stderr)
+    return ids, lengths
+
+def genome_key(fai_filename):
+    """'X.fasta.fai' -> 'X.fasta', 'X.fai' -> 'X'."""
+    return fai_filename[:-4]
+
+def scan_fai_dir(fai_dir):
+    """Returns {genome_key: signature} for every .fai file in a directory."""
+    found = {}
+    if not fai_dir or not os.path.isdir(fai_dir):
+        return found
+    for filename in sorted(os.listdir(fai_dir)):
+        if not filename.endswith(".fai"):
+            continue
+        path = os.path.join(fai_dir, filename)
+        st = os.stat(path)
+        found[genome_key(filename)] = {"fai": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return found
+
+# ─── INDEX ──────────────────────────────────────────────────────────────────────
+class ScaffoldIndex:
+    """Read-only view of an index directory (arrays are memory-mapped)."""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.ids = np.load(os.path.join(index_dir, IDS_FILE), mmap_mode="r")
+        self.lengths = np.load(os.path.join(index_dir, LENGTHS_FILE), mmap_mode="r")
+
+    def resolve(self, kingdom, name):
+        """
+        Finds the index entry for a genome name as it appears in BLAST filenames.
+        Mirrors the historical lookup order: '<name>.fasta.fai' first, then '<name>.fai'.
+        """
+        genomes = self.meta["genomes"].get(kingdom, {})
+        for key in (name + ".fasta", name):
+            if key in genomes:
+                return genomes[key]
+        return None
+
+    def lookup(self, kingdom, name, seq_ids):
+        """
+        Returns an int64 array with the length of every ID in seq_ids
+        (0 for IDs, or whole genomes, that are not in the index).
+        """
+        seq_ids = np.asarray(seq_ids, dtype=str).astype("S")
+        result = np.zeros(len(seq_ids), dtype=np.int64)
+        entry = self.resolve(kingdom, name)
+        if entry is None or entry["start"] == entry["end"] or len(seq_ids) == 0:
+            return result
+
+        ids = self.ids[entry["start"]:entry["end"]]
+        pos = np.searchsorted(ids, seq_ids)
+        inside = pos < len(ids)
+        found = np.zeros(len(seq_ids), dtype=bool)
+        found[inside] = ids[pos[inside]] == seq_ids[inside]
+        result[found] = self.lengths[entry["start"] + pos[found]]
+        return result
+
+def _is_current(index_dir, wanted):
+    """True if the index exists and was built from exactly these .fai files."""
+    meta_path = os.path.join(index_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        genomes = json.load(f).get("genomes", {})
+    for kingdom, entries in wanted.items():
+        built = genomes.get(kingdom, {})
+        if set(built) != set(entries):
+            return False
+        for key, sig in entries.items():
+            old = built[key]
+            if (old["fai"], old["size"], old["mtime_ns"]) != (sig["fai"], sig["size"], sig["mtime_ns"]):
+                return False
+    return set(genomes) == set(wanted)
+
+def build_index(index_dir, fai_dirs):
+    """
+    (Re)builds the index for {kingdom: fai_dir}. Segments of genomes whose .fai
+    is unchanged are copied from the previous index instead of being re-parsed.
+    """
+    wanted = {kingdom: scan_fai_dir(fai_dir) for kingdom, fai_dir in fai_dirs.items()}
+
+    previous = None
+    if os.path.exists(os.path.join(index_dir, META_FILE)):
+        try:
+            previous = ScaffoldIndex(index_dir)
+        except Exception as e:
+            print(f"[WARNING] Ignoring unreadable scaffold index in {index_dir}: {e}", file=sys.stderr)
+
+    id_parts, length_parts = [], []
+    genomes = {}
+    offset = 0
+    reparsed = 0
+    for kingdom, entries in wanted.items():
+        genomes[kingdom] = {}
+        old_genomes = previous.meta["genomes"].get(kingdom, {}) if previous is not None else {}
+        for key, sig in entries.items():
+            old = old_genomes.get(key)
+            if old is not None and (old["fai"], old["size"], old["mtime_ns"]) == (sig["fai"], sig["size"], sig["mtime_ns"]):
+                ids = np.array(previous.ids[old["start"]:old["end"]])
+                lengths = np.array(previous.lengths[old["start"]:old["end"]])
+            else:
+                names, values = read_fai(sig["fai"])
+                ids = np.array(names, dtype="S") if names else np.array([], dtype="S1")
+                lengths = np.array(values, dtype=np.int64)
+                order = np.argsort(ids, kind="stable")
+                ids, lengths = ids[order], lengths[order]
+                reparsed += 1
+            genomes[kingdom][key] = dict(sig, start=offset, end=offset + len(ids))
+            offset += len(ids)
+            id_parts.append(ids)
+            length_parts.append(lengths)
+
+    width = max([part.dtype.itemsize for part in id_parts] + [1])
+    all_ids = np.concatenate([part.astype(f"S{width}") for part in id_parts]) if id_parts else np.array([], dtype="S1")
+    all_lengths = np.concatenate(length_parts) if length_parts else np.array([], dtype=np.int64)
+    previous = None  # release the memory maps before overwriting the files
+
+    # Write to temporary names first; the metadata goes last so a crash never
+    # leaves an index whose metadata points into mismatched arrays.
+    os.makedirs(index_dir, exist_ok=True)
+    for name, array in ((IDS_FILE, all_ids), (LENGTHS_FILE, all_lengths)):
+        tmp_path = os.path.join(index_dir, name + ".tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(index_dir, name))
+    tmp_meta = os.path.join(index_dir, META_FILE + ".tmp")
+    with open(tmp_meta, "w") as f:
+        json.dump({"genomes": genomes}, f)
+    os.replace(tmp_meta, os.path.join(index_dir, META_FILE))
+
+    total = sum(len(entries) for entries in genomes.values())
+    print(f"[INFO] Scaffold index: {total} genomes, {len(all_ids)} scaffolds ({reparsed} .fai files parsed) -> {index_dir}")
+
+def ensure_index(index_dir, fai_dirs):
+    """Rebuilds the index only if a .fai was added, removed or modified. Returns a ScaffoldIndex."""
+    wanted = {kingdom: scan_fai_dir(fai_dir) for kingdom, fai_dir in fai_dirs.items()}
+    if not _is_current(index_dir, wanted):
+        build_index(index_dir, fai_dirs)
+    return ScaffoldIndex(index_dir)
+
+# ─── COMMAND LINE ───────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the consolidated scaffold-length index from .fai files.")
+    parser.add_argument("--fungi_fai", required=True, help="Directory containing Fungi .fasta.fai index files")
+    parser.add_argument("--plant_fai", help="Directory containing Plant .fasta.fai index files")
+    parser.add_argument("--index", default="scaffold_index", help="Output index directory")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the index is up to date")
+    args = parser.parse_args()
+
+    dirs = {"fungi": args.fungi_fai, "plant": args.plant_fai}
+    if args.force:
+        build_index(args.index, dirs)
+    else:
+        ensure_index(args.index, dirs)
+    print("[SUCCESS] Scaffold index is up to date.")
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Reading and writing of the tables handed from one script to the next
+(filtered_blast_results_with_fungi, plant_alignment_results,
+fungi_vs_plant_comparison, ht_candidates).
+
+The format follows the file extension: '.parquet' files are columnar (needs
+pyarrow), anything else is the historical tab-separated text. In Parquet the
+genome and scaffold name columns are dictionary-encoded, numbers keep their
+binary dtypes and readers only load the columns they ask for.
+
+Conversion / TSV export:
+    python table_io.py filtered_blast_results_with_fungi.parquet filtered_blast_results_with_fungi.tsv
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+# ─── FORMAT ─────────────────────────────────────────────────────────────────────
+def is_parquet(path):
+    return path.lower().endswith(PARQUET_EXTENSIONS)
+
+def require_parquet(what="Parquet tables"):
+    """Exits with a clear message if pyarrow is not installed."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        sys.exit(f"[ERROR] {what} requires pyarrow (pip install pyarrow).")
+
+def is_genome_column(name):
+    """Genome name columns ('fungi_genome', 'plant_genome_plant', ...) are read as categories."""
+    return "genome" in name
+
+# ─── READING ────────────────────────────────────────────────────────────────────
+def table_columns(path):
+    """Column names of a table without loading it."""
+    if is_parquet(path):
+        require_parquet()
+        import pyarrow.parquet as pq
+        return list(pq.read_schema(path).names)
+    return list(pd.read_csv(path, sep="\t", nrows=0).columns)
+
+def _widen_float32(values):
+    """float32 -> float64 through the decimal text, exactly as a TSV round trip would."""
+    return pd.to_numeric(pd.Series(values.to_numpy().astype(str), index=values.index))
+
+def read_table(path, columns=None, dtype=None):
+    """
+    Loads a table (all columns, or only `columns`). `dtype` maps column names to
+    the wanted dtypes; names that are absent from the table are ignored.
+    TSV floats are parsed exactly, so a value written by write_table reads back
+    unchanged and ties on it compare the same way in every run.
+    """
+    dtype = dtype or {}
+    if not is_parquet(path):
+        return pd.read_csv(path, sep="\t", usecols=columns, dtype=dtype, float_precision="round_trip")
+
+    require_parquet()
+    import pyarrow.parquet as pq
+    names = columns if columns is not None else pq.read_schema(path).names
+    categories = [c for c in names if dtype.get(c) == "category"]
+    df = pq.read_table(path, columns=columns, read_dictionary=categories).to_pandas()
+    for column, wanted in dtype.items():
+        if column not in df.columns or column in categories:
+            continue
+        if wanted is str:
+            continue  # Parquet strings already come back as strings
+        if df[column].dtype == np.float32 and np.dtype(wanted) == np.float64:
+            df[column] = _widen_float32(df[column])
+        else:
+            df[column] = df[column].astype(wanted)
+    return df
+
+# ─── WRITING ────────────────────────────────────────────────────────────────────
+def compact(df):
+    """
+    Smallest lossless dtypes for one whole table: integers are downcast, floats
+    become float32 only when no value changes, genome names become categories.
+    """
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if is_genome_column(column) and pd.api.types.is_string_dtype(values.dtype) \
+                and not isinstance(values.dtype, pd.CategoricalDtype):
+            df[column] = values.astype("category")
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            kind = "unsigned" if len(values) and values.min() >= 0 else "integer"
+            df[column] = pd.to_numeric(values, downcast=kind)
+        elif values.dtype == np.float64:
+            narrow = values.to_numpy().astype(np.float32)
+            if np.array_equal(narrow.astype(np.float64), values.to_numpy(), equal_nan=True):
+                df[column] = narrow
+    return df
+
+class TableWriter:
+    """
+    Streams DataFrame chunks with identical columns into one table, written
+    under a temporary name and moved into place by close(). Parquet chunks are
+    cast to the schema of the first chunk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".part"
+        self.parquet = is_parquet(path)
+        if self.parquet:
+            require_parquet()
+        self.rows = 0
+        self._handle = None
+        self._schema = None
+
+    def write(self, df):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._handle is None:
+                self._schema = table.schema
+                self._handle = pq.ParquetWriter(self.tmp_path, self._schema, compression="zstd")
+            else:
+                table = table.cast(self._schema)
+            self._handle.write_table(table)
+        elif self._handle is None:
+            self._handle = open(self.tmp_path, "w")
+            df.to_csv(self._handle, sep="\t", index=False)
+        else:
+            df.to_csv(self._handle, sep="\t", index=False, header=False)
+        self.rows += len(df)
+
+    def close(self):
+        """Publishes the table. Returns False (and writes nothing) if no chunk was written."""
+        if self._handle is None:
+            return False
+        self._handle.close()
+        os.replace(self.tmp_path, self.path)
+        return True
+
+    def abort(self):
+        if self._handle is not None:
+            self._handle.close()
+            os.remove(self.tmp_path)
+            self._handle = None
+
+def write_table(df, path):
+    """Writes a whole table (compacted first when the target is Parquet)."""
+    writer = TableWriter(path)
+    writer.write(compact(df) if writer.parquet else df)
+    writer.close()
+
+# ─── COMMAND LINE ───────────────────────────────────────────────────────────────
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert pipeline tables between TSV and Parquet (format from the extension).")
+    parser.add_argument("input", help="Input table (.tsv or .parquet)")
+    parser.add_argument("output", help="Output table (.tsv or .parquet)")
+    args = parser.parse_args()
+
+    table = read_table(args.input)
+    write_table(table, args.output)
+    print(f"[SUCCESS] {len(table)} rows: {args.input} -> {args.output}")